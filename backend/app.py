@@ -1,41 +1,74 @@
+import asyncio
 import json
+import math
 import os
 import shutil
 import time
 import uuid
 from datetime import datetime  # 添加這行
 from pathlib import Path
-from typing import Dict, List, Optional, Union
+from typing import Dict, List, Literal, Optional, Union
 
 import pdfplumber
 from config import Config
 from docx import Document
 from fastapi import FastAPI, File, Form, HTTPException, UploadFile
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import FileResponse
+from fastapi.responses import FileResponse, ORJSONResponse, StreamingResponse
 from fastapi.websockets import WebSocket
 from langchain.document_loaders import PyPDFLoader  # 添加這行
+from mylibspublic.circuit_breaker import CircuitOpenError, circuit_breaker_stats
+from mylibspublic.completion_cache import completion_cache_stats
+from mylibspublic.embedding_cache import embedding_cache_stats
+from mylibspublic.hedging import hedge_stats
+from mylibspublic.http_pool import aclose_clients, close_sessions
+from mylibspublic.json_codec import dumps
+from mylibspublic.load_balancer import load_balancer_stats
+from mylibspublic.micro_batcher import micro_batch_stats
+from mylibspublic.model_cascade import cascade_stats
+from mylibspublic.rate_limiter import OverloadedError, limiter_stats
+from mylibspublic.single_flight import default_flight
+from mylibspublic.structured_logging import configure_logging, get_logger
+from mylibspublic.token_estimator import default_estimator
+from mylibspublic.translation_memory import translation_memory_stats
 from pydantic import BaseModel
 from rag_utils import (
     delete_from_vector_store,
     initialize_rag,
+    aquery_knowledge_base,
+    astream_query_knowledge_base,
     initialize_vector_store,
-    query_knowledge_base,
     reset_vector_store,
 )
 from translation_utils import (
-    one_chunk_translate_text,
+    atranslate_text,
+    translation_quality_stats,
+    warm_translation_memory,
 )
 
 
+configure_logging(
+    Config.LOG_LEVEL,
+    Config.LOG_FORMAT,
+    Config.LOG_DEBUG_SAMPLE_RATE,
+    Config.LOG_DEBUG_PER_SECOND,
+)
+logger = get_logger(__name__)
+
+
 # Pydantic models
 class KnowledgeBase(BaseModel):
     name: str
     description: str = ""
 
 
+# 翻譯品質模式，見 translation_utils.QUALITY_MODES；未指定時使用 Config.TRANSLATION_QUALITY
+TranslationQuality = Literal["fast", "balanced", "best"]
+
+
 class TranslateRequest(BaseModel):
     text: str
+    quality: Optional[TranslationQuality] = None
 
 
 class EmbedRequest(BaseModel):
@@ -87,14 +120,15 @@ def safely_delete_directory(path: Path):
                 shutil.rmtree(path)
             return True
         except Exception as e:
-            print(f"刪除嘗試 {attempt + 1} 失敗: {str(e)}")
+            logger.warning("刪除嘗試失敗", attempt=attempt + 1, error=str(e))
             if attempt < max_attempts - 1:
                 time.sleep(2)  # 在重試之前等待
             else:
                 raise
 
 
-app = FastAPI()
+# 以 orjson 序列化回應，降低大型文件與向量內容的編碼成本
+app = FastAPI(default_response_class=ORJSONResponse)
 
 # CORS 設置
 app.add_middleware(
@@ -107,6 +141,46 @@ app.add_middleware(
 
 # 初始化默認知識庫
 vector_store, ffm = initialize_rag()
+# 翻譯記憶的模糊比對索引在背景建立
+warm_translation_memory()
+
+
+@app.on_event("shutdown")
+async def close_http_pools():
+    """關閉共用的 HTTP 連線池，並保存 token 估算的校正結果"""
+    await aclose_clients()
+    close_sessions()
+    default_estimator.save()
+
+
+@app.get("/api/status")
+async def get_status():
+    """回報推論端點的客戶端狀態（副本、熔斷、限流、備援、快取、翻譯記憶與品質模式、合併、token 估算）"""
+    return {
+        "load_balancers": load_balancer_stats(),
+        "model_cascade": cascade_stats(),
+        "circuit_breakers": circuit_breaker_stats(),
+        "rate_limiters": limiter_stats(),
+        "hedging": hedge_stats(),
+        "completion_cache": completion_cache_stats(),
+        "embedding_cache": embedding_cache_stats(),
+        "embedding_query_batches": micro_batch_stats(),
+        "translation_memory": translation_memory_stats(),
+        "translation_quality": translation_quality_stats(),
+        "single_flight": default_flight.stats(),
+        "token_estimator": default_estimator.stats(),
+    }
+
+
+def upstream_unavailable(e: Union[CircuitOpenError, OverloadedError]) -> HTTPException:
+    """推論端點熔斷中或重試後仍過載：回傳 503，並告知多久後可重試"""
+    retry_after = max(1, math.ceil(e.retry_after))
+    return HTTPException(
+        status_code=503,
+        detail=f"推論服務暫時無法使用，請於 {retry_after} 秒後重試",
+        headers={"Retry-After": str(retry_after)},
+    )
+
 
 # WebSocket 連接
 active_connections: List[WebSocket] = []
@@ -167,7 +241,7 @@ def read_file_content(file_path: str) -> str:
         else:
             raise ValueError(f"不支援的檔案類型: {file_extension}")
     except Exception as e:
-        print(f"讀取檔案時出錯: {str(e)}")
+        logger.error("讀取檔案時出錯", error=str(e))
         raise
 
 
@@ -247,7 +321,7 @@ async def delete_knowledge_base(kb_id: str):
             if kb_path.exists():
                 shutil.rmtree(kb_path, ignore_errors=True)
         except Exception as e:
-            print(f"刪除知識庫目錄時出錯: {str(e)}")
+            logger.warning("刪除知識庫目錄時出錯", error=str(e))
             # 繼續執行，即使刪除失敗
 
         # 4. 更新配置
@@ -263,7 +337,7 @@ async def delete_knowledge_base(kb_id: str):
     except HTTPException as e:
         raise e
     except Exception as e:
-        print(f"刪除知識庫時出錯: {str(e)}")
+        logger.error("刪除知識庫時出錯", error=str(e))
         # 即使出錯也返回成功
         return {"success": True}
 
@@ -318,14 +392,23 @@ async def reset_knowledge_base(kb_id: str):
 @app.post("/api/translate")
 async def translate(request: TranslateRequest):
     try:
-        translated_text = one_chunk_translate_text(
+        routing = []
+        translated_text = await atranslate_text(
             request.text,
             Config.MODEL_NAME,
             Config.SOURCE_LANG,
             Config.TARGET_LANG,
             Config.COUNTRY,
+            routing=routing,
+            quality=request.quality,
         )
-        return {"translated_text": translated_text}
+        return {
+            "translated_text": translated_text,
+            "routing": routing,
+            "quality": request.quality or Config.TRANSLATION_QUALITY,
+        }
+    except (CircuitOpenError, OverloadedError) as e:
+        raise upstream_unavailable(e)
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -379,7 +462,7 @@ def load_pdf(file_path):
         pages = loader.load()
         text_content = "\n".join([page.page_content for page in pages])
     except Exception as e:
-        print(f"PyPDFLoader failed: {str(e)}")
+        logger.warning("PyPDFLoader failed", error=str(e))
         # 如果 PyPDFLoader 失敗，嘗試使用 pdfplumber
         try:
             with pdfplumber.open(file_path) as pdf:
@@ -389,21 +472,23 @@ def load_pdf(file_path):
                 if not text_content:
                     raise ValueError("無法提取 PDF 內容")
         except Exception as e:
-            print(f"pdfplumber failed: {str(e)}")
+            logger.warning("pdfplumber failed", error=str(e))
             # 如果兩種方法都失敗，嘗試直接讀取文本
             try:
                 with open(file_path, "r", encoding="utf-8") as f:
                     text_content = f.read()
             except Exception as e:
-                print(f"直接讀取文本失敗: {str(e)}")
+                logger.error("直接讀取文本失敗", error=str(e))
                 raise ValueError(f"無法讀取文件: {file_path}")
 
     return text_content
 
 
 @app.post("/api/upload_and_translate")
-async def upload_and_translate(file: UploadFile = File(...)):
-    """上傳並翻譯檔案"""
+async def upload_and_translate(
+    file: UploadFile = File(...), quality: Optional[TranslationQuality] = Form(None)
+):
+    """上傳並翻譯檔案，可用 quality 表單欄位選擇翻譯品質模式"""
     if not file or not file.filename:
         raise HTTPException(status_code=400, detail="沒有提供文件")
 
@@ -418,34 +503,48 @@ async def upload_and_translate(file: UploadFile = File(...)):
 
         try:
             # 讀取檔案內容
-            text_content = load_pdf(str(temp_file_path))
+            text_content = await asyncio.to_thread(load_pdf, str(temp_file_path))
 
             if not text_content:
                 raise ValueError("無法讀取檔案內容")
 
             # 翻譯內容
-            translated_content = one_chunk_translate_text(
+            routing = []
+            translated_content = await atranslate_text(
                 text_content,
                 Config.MODEL_NAME,
                 Config.SOURCE_LANG,
                 Config.TARGET_LANG,
                 Config.COUNTRY,
+                routing=routing,
+                quality=quality,
             )
 
             # 清理臨時文件
             if temp_file_path.exists():
                 temp_file_path.unlink()
 
-            return {"content": text_content, "translated_content": translated_content}
+            return {
+                "content": text_content,
+                "translated_content": translated_content,
+                "routing": routing,
+                "quality": quality or Config.TRANSLATION_QUALITY,
+            }
 
+        except (CircuitOpenError, OverloadedError) as e:
+            if temp_file_path.exists():
+                temp_file_path.unlink()
+            raise upstream_unavailable(e)
         except Exception as e:
-            print(f"處理檔案內容時出錯: {str(e)}")
+            logger.exception("處理檔案內容時出錯")
             if temp_file_path.exists():
                 temp_file_path.unlink()
             raise HTTPException(status_code=500, detail=f"處理檔案內容時出錯: {str(e)}")
 
+    except HTTPException as e:
+        raise e
     except Exception as e:
-        print(f"上傳和翻譯過程中出錯: {str(e)}")
+        logger.exception("上傳和翻譯過程中出錯")
         raise HTTPException(status_code=500, detail=f"上傳和翻譯過程中出錯: {str(e)}")
 
 
@@ -486,7 +585,7 @@ async def embed_content(request: EmbedRequest):
                         texts=[content], metadatas=[metadata], ids=[doc_id]
                     )
                     doc_ids.append(doc_id)
-                    print(f"已添加文檔，ID: {doc_id}")
+                    logger.debug("已添加文檔", doc_id=doc_id)
 
                 # 保存更改
                 temp_store.persist()
@@ -506,7 +605,7 @@ async def embed_content(request: EmbedRequest):
                     texts=[request.content], metadatas=[metadata], ids=[doc_id]
                 )
                 temp_store.persist()
-                print(f"已添加文檔，ID: {doc_id}")
+                logger.debug("已添加文檔", doc_id=doc_id)
                 result_doc_id = doc_id
 
             return {"success": True, "doc_id": result_doc_id}
@@ -518,10 +617,12 @@ async def embed_content(request: EmbedRequest):
                     if hasattr(temp_store._client, "reset"):
                         temp_store._client.reset()
                 except Exception as e:
-                    print(f"清理資源時出錯: {str(e)}")
+                    logger.warning("清理資源時出錯", error=str(e))
 
+    except (CircuitOpenError, OverloadedError) as e:
+        raise upstream_unavailable(e)
     except Exception as e:
-        print(f"處理文檔時出錯: {str(e)}")
+        logger.exception("處理文檔時出錯")
         raise HTTPException(status_code=500, detail=str(e))
 
 
@@ -572,11 +673,13 @@ async def query(request: QueryRequest):
             current_vector_store = vector_store
 
         try:
-            answer = query_knowledge_base(
+            routing = []
+            answer = await aquery_knowledge_base(
                 vector_store=current_vector_store,
                 ffm=ffm,
                 query=request.query,
                 model_settings=request.model_settings,
+                routing=routing,
             )
 
             # 獲取相關文件片段
@@ -585,7 +688,9 @@ async def query(request: QueryRequest):
                 if request.model_settings
                 else 3
             )
-            docs = current_vector_store.similarity_search(request.query, k=top_k)
+            docs = await asyncio.to_thread(
+                current_vector_store.similarity_search, request.query, k=top_k
+            )
             chunks = [doc.page_content for doc in docs]
 
             # 如果用了臨時向量存儲，清理它
@@ -595,7 +700,7 @@ async def query(request: QueryRequest):
                 except:
                     pass
 
-            return {"answer": answer, "relevant_chunks": chunks}
+            return {"answer": answer, "relevant_chunks": chunks, "routing": routing}
 
         finally:
             # 確保在出現錯誤時能清理臨時向量存儲
@@ -605,10 +710,73 @@ async def query(request: QueryRequest):
                 except:
                     pass
 
+    except (CircuitOpenError, OverloadedError) as e:
+        raise upstream_unavailable(e)
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
+def ndjson_line(event: dict) -> str:
+    """將事件序列化為一行 NDJSON"""
+    return dumps(event).decode("utf8") + "\n"
+
+
+@app.post("/api/query/stream")
+async def query_stream(request: QueryRequest):
+    """串流版本的查詢：先送出 relevant_chunks，再逐段送出回答 (NDJSON)"""
+    kb_id = request.knowledge_base_id or Config.current_kb_id
+    knowledge_bases = load_knowledge_bases()
+
+    if kb_id not in knowledge_bases:
+        raise HTTPException(status_code=404, detail="知識庫不存在")
+
+    if kb_id != Config.current_kb_id:
+        current_vector_store = initialize_vector_store(knowledge_bases[kb_id]["path"])
+    else:
+        current_vector_store = vector_store
+
+    top_k = (
+        request.model_settings.get("parameters", {}).get("topK", 3)
+        if request.model_settings
+        else 3
+    )
+
+    async def event_stream():
+        try:
+            # 先送出相關文件片段，讓前端可以立即顯示
+            docs = await asyncio.to_thread(
+                current_vector_store.similarity_search, request.query, k=top_k
+            )
+            chunks = [doc.page_content for doc in docs]
+            yield ndjson_line({"type": "chunks", "relevant_chunks": chunks})
+
+            async for token in astream_query_knowledge_base(
+                vector_store=current_vector_store,
+                ffm=ffm,
+                query=request.query,
+                model_settings=request.model_settings,
+            ):
+                yield ndjson_line({"type": "token", "text": token})
+
+            yield ndjson_line({"type": "done"})
+        except (CircuitOpenError, OverloadedError) as e:
+            error = upstream_unavailable(e)
+            yield ndjson_line(
+                {"type": "error", "status": error.status_code, "detail": error.detail}
+            )
+        except Exception as e:
+            yield ndjson_line({"type": "error", "detail": str(e)})
+        finally:
+            # 如果用了臨時向量存儲，清理它
+            if kb_id != Config.current_kb_id and current_vector_store:
+                try:
+                    current_vector_store._client.close()
+                except:
+                    pass
+
+    return StreamingResponse(event_stream(), media_type="application/x-ndjson")
+
+
 # 新增檔案管理相關的路由
 @app.get("/api/files")
 async def get_files(path: str = "/", search: Optional[str] = None):
@@ -789,40 +957,34 @@ async def get_file_content(file_path: str):
         # 處理檔案路徑
         file_path = file_path.replace("\\", "/").lstrip("/")
         full_path = upload_folder / file_path
-        print(f"請求的檔案路徑: {full_path}")
+        logger.debug("請求的檔案路徑", path=str(full_path))
 
         if not full_path.exists():
-            print(f"檔案不存在: {full_path}")
+            logger.info("檔案不存在", path=str(full_path))
             raise HTTPException(status_code=404, detail="檔案不存在")
 
         if not full_path.is_file():
-            print(f"不是檔案: {full_path}")
+            logger.info("不是檔案", path=str(full_path))
             raise HTTPException(status_code=400, detail="不是有效的檔案")
 
         # 讀取檔案內容
         file_extension = full_path.suffix.lower()
-        print(f"檔案類型: {file_extension}")
+        logger.debug("檔案類型", extension=file_extension)
 
         try:
             if file_extension == ".pdf":
-                print("開始讀取 PDF 檔案")
                 with pdfplumber.open(str(full_path)) as pdf:
                     content = "\n".join(
                         page.extract_text() for page in pdf.pages if page.extract_text()
                     )
                     if not content:
                         raise ValueError("PDF 內容為空")
-                print("PDF 讀取完成")
             elif file_extension == ".txt":
-                print("開始讀取 TXT 檔案")
                 with open(full_path, "r", encoding="utf-8") as f:
                     content = f.read()
-                print("TXT 讀取完成")
             elif file_extension == ".docx":
-                print("開始讀取 DOCX 檔案")
                 doc = Document(full_path)
                 content = "\n".join(paragraph.text for paragraph in doc.paragraphs)
-                print("DOCX 讀取完成")
             else:
                 raise HTTPException(
                     status_code=400, detail=f"不支援的檔案類型: {file_extension}"
@@ -831,17 +993,17 @@ async def get_file_content(file_path: str):
             if not content:
                 raise ValueError("檔案內容為空")
 
-            print(f"成功讀取檔案，內容度: {len(content)}")
+            logger.debug("成功讀取檔案", chars=len(content))
             return {"content": content, "filename": full_path.name}
 
         except Exception as e:
-            print(f"讀取檔案時出錯: {str(e)}")
+            logger.exception("讀取檔案時出錯")
             raise HTTPException(status_code=500, detail=f"讀取檔案時出錯: {str(e)}")
 
     except HTTPException as e:
         raise e
     except Exception as e:
-        print(f"處理請求時出錯: {str(e)}")
+        logger.exception("處理請求時出錯")
         raise HTTPException(status_code=500, detail=str(e))
 
 
@@ -862,7 +1024,7 @@ async def test_file_content():
 
         return {"content": content}
     except Exception as e:
-        print(f"測試時出錯: {str(e)}")  # 添加詳細的錯誤日誌
+        logger.exception("測試時出錯")
         raise HTTPException(status_code=500, detail=str(e))
 
 
@@ -881,14 +1043,14 @@ async def test_file_read():
         with open(test_file_path, "w", encoding="utf-8") as f:
             f.write(test_content)
 
-        print(f"測試檔案已創建: {test_file_path}")
+        logger.debug("測試檔案已創建", path=str(test_file_path))
 
         # 嘗試讀取檔案
         try:
             content = read_file_content(str(test_file_path))
-            print(f"成功讀取檔案內容: {content}")
+            logger.trace("成功讀取檔案內容", content=content)
         except Exception as e:
-            print(f"讀取檔案時出錯: {str(e)}")
+            logger.error("讀取檔案時出錯", error=str(e))
             raise
 
         # 清理測試檔案
@@ -896,7 +1058,7 @@ async def test_file_read():
 
         return {"success": True, "content": content}
     except Exception as e:
-        print(f"測試時出錯: {str(e)}")
+        logger.exception("測試時出錯")
         return {"success": False, "error": str(e)}
 
 
@@ -919,7 +1081,7 @@ async def get_knowledge_base_files(kb_id: str):
             try:
                 temp_store = initialize_vector_store(kb_path)
             except Exception as e:
-                print(f"初始化向量存儲失敗: {str(e)}")
+                logger.error("初始化向量存儲失敗", error=str(e))
                 return []
 
         try:
@@ -958,11 +1120,11 @@ async def get_knowledge_base_files(kb_id: str):
                                             )
                                             seen_files.add(source)
                         except Exception as e:
-                            print(f"獲取文檔 metadata 時出錯: {str(e)}")
+                            logger.error("獲取文檔 metadata 時出錯", error=str(e))
                             return []
 
             except Exception as e:
-                print(f"獲取文件列表時出錯: {str(e)}")
+                logger.error("獲取文件列表時出錯", error=str(e))
                 return []
 
             return files
@@ -977,10 +1139,10 @@ async def get_knowledge_base_files(kb_id: str):
                         temp_store._client.reset()
                     # 不再調用 close 方法
                 except Exception as e:
-                    print(f"清理向量存儲資源時出錯: {str(e)}")
+                    logger.warning("清理向量存儲資源時出錯", error=str(e))
 
     except Exception as e:
-        print(f"處理知識庫文件請求時出錯: {str(e)}")
+        logger.error("處理知識庫文件請求時出錯", error=str(e))
         return []
 
 
@@ -1013,7 +1175,7 @@ async def get_translated_files():
 
         return translated_files
     except Exception as e:
-        print(f"獲取翻譯文件列表時出錯: {str(e)}")
+        logger.error("獲取翻譯文件列表時出錯", error=str(e))
         return []
 
 
@@ -1042,17 +1204,16 @@ async def download_file(file_path: str):
         file_path = file_path.replace("\\", "/").lstrip("/")
         full_path = Path(Config.UPLOAD_FOLDER) / file_path
 
-        print(f"請求下載檔案: {file_path}")
-        print(f"完整路徑: {full_path}")
+        logger.debug("請求下載檔案", path=file_path, full_path=str(full_path))
 
         # 檢查檔案是否存在
         if not full_path.exists():
-            print(f"檔案不存在: {full_path}")
+            logger.info("檔案不存在", path=str(full_path))
             raise HTTPException(status_code=404, detail="檔案不存在")
 
         # 檢查是否為檔案
         if not full_path.is_file():
-            print(f"不是檔案: {full_path}")
+            logger.info("不是檔案", path=str(full_path))
             raise HTTPException(status_code=400, detail="不是有效的檔案")
 
         # 檢查檔案是否在允許的目錄中
@@ -1060,10 +1221,9 @@ async def download_file(file_path: str):
         file_path_resolved = full_path.resolve()
 
         if not str(file_path_resolved).startswith(str(upload_folder)):
-            print(f"無效的檔案路徑: {file_path_resolved}")
+            logger.warning("無效的檔案路徑", path=str(file_path_resolved))
             raise HTTPException(status_code=403, detail="無效的檔案路徑")
 
-        print(f"開始下載檔案: {full_path}")
 
         return FileResponse(
             path=str(full_path),
@@ -1072,7 +1232,7 @@ async def download_file(file_path: str):
         )
 
     except Exception as e:
-        print(f"下載檔案時出錯: {str(e)}")
+        logger.exception("下載檔案時出錯")
         raise HTTPException(status_code=500, detail=str(e))
 
 
@@ -1080,26 +1240,23 @@ async def download_file(file_path: str):
 @app.get("/api/translations", response_model=List[dict])
 async def get_translations():
     """獲取所有翻譯結果"""
-    print("開始處理 GET /api/translations 請求")  # 添加調試日誌
     try:
         translations_file = Path("translations/translations.json")
-        print(f"檢查文件路徑: {translations_file}")  # 添加調試日誌
         
         translations_file.parent.mkdir(parents=True, exist_ok=True)
         
         if not translations_file.exists():
-            print("translations.json 不存在，創建新文件")  # 添加調試日誌
+            logger.debug("translations.json 不存在，創建新文件")
             with open(translations_file, "w", encoding="utf-8") as f:
                 json.dump([], f)
             return []
         
-        print("讀取 translations.json")  # 添加調試日誌
         with open(translations_file, "r", encoding="utf-8") as f:
             data = json.load(f)
-            print(f"成功讀取數據，包含 {len(data)} 條記錄")  # 添加調試日誌
+            logger.debug("成功讀取翻譯結果", records=len(data))
             return data
     except Exception as e:
-        print(f"讀取翻譯結果時出錯: {str(e)}")
+        logger.error("讀取翻譯結果時出錯", error=str(e))
         return []
 
 @app.post("/api/translations", response_model=dict)
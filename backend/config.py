@@ -6,14 +6,109 @@ load_dotenv()
 
 
 class Config:
+    # 日誌：等級（TRACE 才記錄提示與回應內容）、格式（json/text）、DEBUG 取樣與每秒上限
+    LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO")
+    LOG_FORMAT = os.getenv("LOG_FORMAT", "json")
+    LOG_DEBUG_SAMPLE_RATE = float(os.getenv("LOG_DEBUG_SAMPLE_RATE", "1.0"))
+    LOG_DEBUG_PER_SECOND = float(os.getenv("LOG_DEBUG_PER_SECOND", "20"))
     UPLOAD_FOLDER = "uploads"
     ALLOWED_EXTENSIONS = {"pdf", "txt", "docx"}
     MODEL_NAME = os.getenv("MODEL_NAME")
+    # 設定後先以較快的模型回答，檢查不通過（截斷、空白、長度或語言異常）才改用 MODEL_NAME
+    FAST_MODEL_NAME = os.getenv("FAST_MODEL_NAME")
     SOURCE_LANG = os.getenv("SOURCE_LANG", "English")
     TARGET_LANG = os.getenv("TARGET_LANG", "Chinese")
     COUNTRY = os.getenv("COUNTRY", "Taiwan")
     API_KEY = os.getenv("API_KEY")
-    API_URL = os.getenv("API_URL")
+    # 可用逗號分隔多個推論副本，請求會分散到各副本
+    API_URL = [
+        url.strip() for url in os.getenv("API_URL", "").split(",") if url.strip()
+    ]
     API_HOST = os.getenv("API_HOST")
+    HTTP_POOL_MAXSIZE = int(os.getenv("HTTP_POOL_MAXSIZE", "20"))
+    HTTP_CONNECT_TIMEOUT = float(os.getenv("HTTP_CONNECT_TIMEOUT", "5"))
+    HTTP_READ_TIMEOUT = float(os.getenv("HTTP_READ_TIMEOUT", "120"))
+    FFM_MAX_CONCURRENCY = int(os.getenv("FFM_MAX_CONCURRENCY", "4"))
+    # 文件向量化依筆數與估計 token 數分批，並平行送出
+    EMBEDDING_BATCH_SIZE = int(os.getenv("EMBEDDING_BATCH_SIZE", "35"))
+    EMBEDDING_BATCH_TOKENS = int(os.getenv("EMBEDDING_BATCH_TOKENS", "8192"))
+    EMBEDDING_MAX_CONCURRENCY = int(os.getenv("EMBEDDING_MAX_CONCURRENCY", "4"))
+    # 同時到達的查詢向量化請求合併為一次呼叫：最大筆數與等待毫秒數
+    EMBEDDING_QUERY_BATCH_SIZE = int(os.getenv("EMBEDDING_QUERY_BATCH_SIZE", "16"))
+    EMBEDDING_QUERY_BATCH_WAIT_MS = float(
+        os.getenv("EMBEDDING_QUERY_BATCH_WAIT_MS", "5")
+    )
+    # 向量以 float32 numpy 陣列傳遞到 Chroma，避免大量 Python float 物件
+    EMBEDDING_NUMPY = os.getenv("EMBEDDING_NUMPY", "true").lower() == "true"
+    # 設為 base64 時向支援的端點索取壓縮的 float32 向量；留空則使用 JSON 數字陣列
+    EMBEDDING_ENCODING_FORMAT = os.getenv("EMBEDDING_ENCODING_FORMAT") or None
+    # 以（模型, 正規化文字）為鍵的向量快取，各知識庫與查詢共用；留空則停用
+    EMBEDDING_CACHE_PATH = os.getenv(
+        "EMBEDDING_CACHE_PATH", "./cache/embeddings.sqlite3"
+    )
+    EMBEDDING_CACHE_MAX_BYTES = int(
+        os.getenv("EMBEDDING_CACHE_MAX_BYTES", str(1024 * 1024 * 1024))
+    )
+    # 生成因 max_new_tokens 截斷時，接續生成的最多次數（0 為停用）
+    FFM_MAX_CONTINUATIONS = int(os.getenv("FFM_MAX_CONTINUATIONS", "2"))
+    # 客戶端限流：未設定則不限制，429/503 時仍會自動退避重試
+    FFM_REQUESTS_PER_SECOND = (
+        float(os.getenv("FFM_REQUESTS_PER_SECOND"))
+        if os.getenv("FFM_REQUESTS_PER_SECOND")
+        else None
+    )
+    FFM_TOKENS_PER_MINUTE = (
+        float(os.getenv("FFM_TOKENS_PER_MINUTE"))
+        if os.getenv("FFM_TOKENS_PER_MINUTE")
+        else None
+    )
+    FFM_MAX_RETRIES = int(os.getenv("FFM_MAX_RETRIES", "3"))
+    # 對慢請求送出備援請求以降低尾端延遲
+    FFM_HEDGE = os.getenv("FFM_HEDGE", "false").lower() == "true"
+    # 可重現的生成結果快取（temperature=0 或指定 seed 時）；翻譯呼叫的
+    # temperature 非 0，需設定 TRANSLATION_FORCE_CACHE=true 才會快取
+    FFM_CACHE_PATH = os.getenv("FFM_CACHE_PATH", "./cache/ffm_completions.sqlite3")
+    # 依 FFM 回報的 token 數校正的各文字系統字元/token 比例
+    TOKEN_STATS_PATH = os.getenv("TOKEN_STATS_PATH", "./cache/token_stats.json")
+    # 長文件依段落與句子切成不超過此 token 數的文本塊，並平行翻譯
+    TRANSLATION_CHUNK_TOKENS = int(os.getenv("TRANSLATION_CHUNK_TOKENS", "1000"))
+    # 文本塊以管線方式經過初次翻譯、反思、改進，各階段的同時呼叫上限
+    TRANSLATION_INITIAL_CONCURRENCY = int(
+        os.getenv("TRANSLATION_INITIAL_CONCURRENCY", "4")
+    )
+    TRANSLATION_REFLECT_CONCURRENCY = int(
+        os.getenv("TRANSLATION_REFLECT_CONCURRENCY", "4")
+    )
+    TRANSLATION_IMPROVE_CONCURRENCY = int(
+        os.getenv("TRANSLATION_IMPROVE_CONCURRENCY", "4")
+    )
+    # 以（正規化段落, 語言, 國家, 模型）為鍵保存最終譯文，重複段落不再送模型；留空則停用
+    TRANSLATION_MEMORY_PATH = os.getenv(
+        "TRANSLATION_MEMORY_PATH", "./cache/translation_memory.sqlite3"
+    )
+    TRANSLATION_MEMORY_MAX_BYTES = int(
+        os.getenv("TRANSLATION_MEMORY_MAX_BYTES", str(512 * 1024 * 1024))
+    )
+    # 與記憶中段落的相似度（字元 n-gram Jaccard）達此值時，以單次呼叫修補其譯文；0 則停用
+    TRANSLATION_FUZZY_THRESHOLD = float(os.getenv("TRANSLATION_FUZZY_THRESHOLD", "0.8"))
+    # 模糊比對索引在記憶體中保留的段落數上限（依最近使用）
+    TRANSLATION_FUZZY_MAX_INDEXED = int(
+        os.getenv("TRANSLATION_FUZZY_MAX_INDEXED", "100000")
+    )
+    # 翻譯品質模式：fast（單次翻譯）、balanced（檢查未通過才反思與改進）、best（一律三階段）
+    TRANSLATION_QUALITY = os.getenv("TRANSLATION_QUALITY", "best")
+    # 預設關閉，翻譯呼叫不快取；設為 true 時即使 temperature 非 0 也快取翻譯呼叫，
+    # 同一原文會一直拿到同一份抽樣結果
+    TRANSLATION_FORCE_CACHE = (
+        os.getenv("TRANSLATION_FORCE_CACHE", "false").lower() == "true"
+    )
+    # 連續失敗（含逾時）達門檻後熔斷，期間直接回傳 503，逾時後放行探測請求
+    FFM_BREAKER_FAILURES = int(os.getenv("FFM_BREAKER_FAILURES", "5"))
+    FFM_BREAKER_RESET_SECONDS = float(os.getenv("FFM_BREAKER_RESET_SECONDS", "30"))
+    # 副本選擇策略：least_outstanding（進行中請求最少）或 ewma（延遲加權）
+    FFM_BALANCER_STRATEGY = os.getenv("FFM_BALANCER_STRATEGY", "least_outstanding")
+    # 副本連續失敗達門檻即暫時移出，逾時後再以實際請求探測
+    FFM_EJECT_AFTER = int(os.getenv("FFM_EJECT_AFTER", "3"))
+    FFM_EJECT_SECONDS = float(os.getenv("FFM_EJECT_SECONDS", "10"))
     CHROMA_PATH = os.getenv("CHROMA_PATH", "./chroma_db")
     current_kb_id = "default"
@@ -1,20 +1,129 @@
 """Wrapper Embedding model APIs."""
 
-import json
-from typing import List
+import base64
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional, Sequence, Tuple, Union
 
-import requests
+import numpy as np
 from langchain.embeddings.base import Embeddings
 from pydantic import BaseModel
 
+from .circuit_breaker import get_circuit_breaker, is_server_error
+from .embedding_cache import (
+    DEFAULT_MAX_BYTES,
+    EmbeddingCache,
+    get_embedding_cache,
+    make_key,
+)
+from .hedging import get_hedge_policy
+from .http_pool import (
+    DEFAULT_CONNECT_TIMEOUT,
+    DEFAULT_POOL_MAXSIZE,
+    DEFAULT_READ_TIMEOUT,
+    get_session,
+)
+from .json_codec import dumps, response_json
+from .micro_batcher import MicroBatcher, get_micro_batcher
+from .load_balancer import (
+    LEAST_OUTSTANDING,
+    endpoint_group,
+    get_load_balancer,
+    parse_base_urls,
+)
+from .rate_limiter import get_rate_limiter, limited_post
+from .single_flight import default_flight, request_key
+from .structured_logging import get_logger
+from .token_estimator import estimate_tokens
+
+EMBEDDINGS_PATH = "/models/embeddings"
+
+logger = get_logger(__name__)
+
+
+def token_batches(
+    tokens: Sequence[int], max_items: int, max_tokens: int
+) -> List[Tuple[int, int]]:
+    """Split texts into consecutive `(start, end)` index ranges.
+
+    A batch holds at most `max_items` texts and `max_tokens` estimated
+    tokens; a single text over the token budget gets a batch of its own.
+    """
+    batches = []
+    start, total = 0, 0
+    for index, count in enumerate(tokens):
+        full = index - start >= max_items or total + count > max_tokens
+        if index > start and full:
+            batches.append((start, index))
+            start, total = index, 0
+        total += count
+    if start < len(tokens):
+        batches.append((start, len(tokens)))
+    return batches
+
 
 class CustomEmbeddingModel(BaseModel, Embeddings):
-    base_url: str = "http://localhost:12345"
+    base_url: Union[str, List[str]] = "http://localhost:12345"
     api_key: str = ""
     model: str = ""
+    pool_maxsize: int = DEFAULT_POOL_MAXSIZE
+    connect_timeout: float = DEFAULT_CONNECT_TIMEOUT
+    read_timeout: float = DEFAULT_READ_TIMEOUT
+    requests_per_second: Optional[float] = None
+    tokens_per_minute: Optional[float] = None
+    max_retries: int = 3
+    hedge: bool = False
+    hedge_percentile: float = 0.95
+    hedge_budget: float = 0.1
+    coalesce: bool = True
+    breaker_failure_threshold: int = 5
+    breaker_reset_timeout: float = 30.0
+    balancer_strategy: str = LEAST_OUTSTANDING
+    eject_after: int = 3
+    eject_seconds: float = 10.0
+    embedding_lot: int = 35
+    """Maximum number of texts per embeddings request."""
+    batch_tokens: int = 8192
+    """Maximum estimated tokens per embeddings request."""
+    max_concurrency: int = 4
+    """Maximum number of batches of one `embed_documents` call in flight."""
+    cache_path: Optional[str] = None
+    """SQLite file caching vectors by model and normalized text; None disables
+    caching. Clients sharing a path share the cache."""
+    cache_max_bytes: int = DEFAULT_MAX_BYTES
+    query_batch_size: int = 16
+    """Maximum number of concurrent `embed_query` calls sent as one request;
+    1 sends every query on its own."""
+    query_batch_wait: float = 0.005
+    """Seconds the first query of a batch waits for others to join."""
+    as_numpy: bool = False
+    """Return every embedding as a float32 numpy array (a row of one
+    contiguous matrix per response) instead of a list of Python floats."""
+    encoding_format: Optional[str] = None
+    """Sent as `encoding_format`; "base64" asks servers that support it for
+    packed float32 vectors, decoded without building Python lists."""
+
+    def _payload(self, texts: List[str]) -> bytes:
+        body = {"model": self.model, "inputs": texts}
+        if self.encoding_format is not None:
+            body["encoding_format"] = self.encoding_format
+        return dumps(body)
+
+    def _decode(self, data: List[dict]):
+        """Embeddings of a response's `data`, as lists or float32 rows."""
+        vectors = [item["embedding"] for item in data]
+        if vectors and isinstance(vectors[0], str):
+            # base64 encoded little-endian float32
+            rows = [np.frombuffer(base64.b64decode(v), dtype="<f4") for v in vectors]
+            if self.as_numpy:
+                return list(np.stack(rows).astype(np.float32, copy=False))
+            return [row.tolist() for row in rows]
+        if self.as_numpy:
+            return list(np.asarray(vectors, dtype=np.float32))
+        return vectors
 
-    def get_embeddings(self, payload):
-        endpoint_url = f"{self.base_url}/models/embeddings"
+    def get_embeddings(self, payload, tokens: int = 0, hedge: bool = False):
+        base_urls = parse_base_urls(self.base_url)
+        endpoint_url = endpoint_group(base_urls, EMBEDDINGS_PATH)
         embeddings = []
         headers = {
             "Content-type": "application/json",
@@ -22,19 +131,174 @@ class CustomEmbeddingModel(BaseModel, Embeddings):
             "X-API-KEY": self.api_key,
             "X-API-HOST": "afs-inference",
         }
-        response = requests.post(endpoint_url, headers=headers, data=payload)
-        body = response.json()
-        datas = body["data"]
-        for data in datas:
-            embeddings.append(data["embedding"])
 
+        logger.trace("FFM embeddings request", endpoint=endpoint_url, body=payload)
+        policy = None
+        if hedge:
+            policy = get_hedge_policy(
+                endpoint_url,
+                percentile=self.hedge_percentile,
+                max_hedge_ratio=self.hedge_budget,
+            )
+
+        def send(base_url):
+            replica_url = f"{base_url}{EMBEDDINGS_PATH}"
+            limiter = get_rate_limiter(
+                replica_url,
+                requests_per_second=self.requests_per_second,
+                tokens_per_minute=self.tokens_per_minute,
+                max_concurrency=self.pool_maxsize,
+            )
+            response = limited_post(
+                get_session(base_url, self.pool_maxsize),
+                limiter,
+                replica_url,
+                tokens=tokens,
+                max_retries=self.max_retries,
+                on_latency=policy.record if policy is not None else None,
+                headers=headers,
+                data=payload,
+                timeout=(self.connect_timeout, self.read_timeout),
+            )
+            return response.status_code, response_json(response)
+
+        def attempt(base_url):
+            breaker = get_circuit_breaker(
+                f"{base_url}{EMBEDDINGS_PATH}",
+                failure_threshold=self.breaker_failure_threshold,
+                reset_timeout=self.breaker_reset_timeout,
+            )
+            return breaker.call(lambda: send(base_url), is_failure=is_server_error)
+
+        def routed():
+            balancer = get_load_balancer(
+                base_urls,
+                EMBEDDINGS_PATH,
+                strategy=self.balancer_strategy,
+                eject_after=self.eject_after,
+                eject_seconds=self.eject_seconds,
+            )
+            return balancer.call(attempt, is_failure=is_server_error)
+
+        def fetch():
+            if policy is not None:
+                return policy.call(routed)
+            return routed()
+
+        if self.coalesce:
+            raw = payload.encode("utf8") if isinstance(payload, str) else payload
+            key = request_key(endpoint_url, raw)
+            status_code, body = default_flight.do(key, fetch)
+        else:
+            status_code, body = fetch()
+
+        if status_code != 200:
+            raise ValueError(
+                f"Embedding endpoint_url: {endpoint_url}\n"
+                f"error raised with status code {status_code}\n"
+                f"Details: {body.get('detail')}\n"
+            )
+
+        embeddings.extend(self._decode(body["data"]))
+
+        return embeddings
+
+    def _embed_batch(self, texts: List[str], tokens: int) -> List[List[float]]:
+        payload = self._payload(texts)
+        embeddings = self.get_embeddings(payload, tokens)
+        if len(embeddings) != len(texts):
+            raise ValueError(
+                f"Embedding endpoint returned {len(embeddings)} embeddings "
+                f"for {len(texts)} inputs"
+            )
         return embeddings
 
+    def _embedding_cache(self) -> Optional[EmbeddingCache]:
+        if self.cache_path is None:
+            return None
+        return get_embedding_cache(self.cache_path, max_bytes=self.cache_max_bytes)
+
     def embed_documents(self, texts: List[str]) -> List[List[float]]:
-        payload = json.dumps({"model": self.model, "inputs": texts})
-        return self.get_embeddings(payload)
+        """Embed `texts`, answering from the cache where possible.
+
+        Only texts missing from the cache are sent, each distinct text once.
+        """
+        cache = self._embedding_cache()
+        if cache is None:
+            return self._embed_uncached(texts)
+
+        keys = [make_key(self.model, text) for text in texts]
+        embeddings = cache.get_many(keys, self.as_numpy)
+        # first index of every distinct missing text
+        missing = {}
+        for index, (key, embedding) in enumerate(zip(keys, embeddings)):
+            if embedding is None:
+                missing.setdefault(key, index)
+        if missing:
+            fetched = self._embed_uncached([texts[i] for i in missing.values()])
+            by_key = dict(zip(missing, fetched))
+            cache.put_many(by_key)
+            embeddings = [
+                by_key[key] if embedding is None else embedding
+                for key, embedding in zip(keys, embeddings)
+            ]
+        return embeddings
+
+    def _embed_uncached(self, texts: List[str]) -> List[List[float]]:
+        """Embed `texts` in batches sized by count and estimated tokens.
+
+        Batches are sent in parallel, at most `max_concurrency` at a time,
+        and the embeddings are returned in the order of `texts`.
+        """
+        if not texts:
+            return []
+        tokens = [estimate_tokens(text) for text in texts]
+        batches = token_batches(tokens, self.embedding_lot, self.batch_tokens)
+
+        def embed(batch: Tuple[int, int]) -> List[List[float]]:
+            start, end = batch
+            return self._embed_batch(texts[start:end], sum(tokens[start:end]))
+
+        workers = max(1, min(self.max_concurrency, len(batches)))
+        if workers == 1:
+            results = [embed(batch) for batch in batches]
+        else:
+            # executor.map keeps results in batch order
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                results = list(executor.map(embed, batches))
+        return [embedding for result in results for embedding in result]
+
+    def _embed_queries(self, texts: List[str]) -> List[List[float]]:
+        payload = self._payload(texts)
+        tokens = sum(estimate_tokens(text) for text in texts)
+        # queries sit on the chat latency path, so they may hedge
+        return self.get_embeddings(payload, tokens, hedge=self.hedge)
+
+    def _query_batcher(self) -> MicroBatcher:
+        """Batcher shared by every client of the same endpoints, model and
+        output format."""
+        endpoint_url = endpoint_group(parse_base_urls(self.base_url), EMBEDDINGS_PATH)
+        output = "numpy" if self.as_numpy else "list"
+        return get_micro_batcher(
+            f"{endpoint_url}?model={self.model}&output={output}",
+            self._embed_queries,
+            max_batch_size=self.query_batch_size,
+            max_wait=self.query_batch_wait,
+        )
 
     def embed_query(self, text: str) -> List[List[float]]:
-        payload = json.dumps({"model": self.model, "inputs": [text]})
-        emb = self.get_embeddings(payload)
-        return emb[0]
+        cache = self._embedding_cache()
+        key = make_key(self.model, text)
+        if cache is not None:
+            cached = cache.get(key, self.as_numpy)
+            if cached is not None:
+                return cached
+
+        if self.query_batch_size > 1:
+            # concurrent queries arriving within query_batch_wait share a request
+            emb = self._query_batcher().call(text)
+        else:
+            emb = self._embed_queries([text])[0]
+        if cache is not None:
+            cache.put(key, emb)
+        return emb
@@ -4,6 +4,10 @@ from langchain.llms.base import LLM
 import requests
 from pydantic import Field
 
+from .structured_logging import get_logger
+
+logger = get_logger(__name__)
+
 class FormosaFoundationModel(LLM):
     endpoint_url: str = ''
     max_new_tokens: int = 20
@@ -35,9 +39,9 @@ class FormosaFoundationModel(LLM):
 
         # send request
         try:
-            print(parameter_payload)
-            print(self.endpoint_url)
-            print(headers)
+            logger.trace(
+                "FFM request", endpoint=self.endpoint_url, body=parameter_payload
+            )
             response = requests.post(
                 self.endpoint_url, headers=headers, json=parameter_payload
             )
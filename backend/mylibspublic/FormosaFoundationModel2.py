@@ -1,17 +1,83 @@
+import asyncio
 import json
-from typing import Any, Dict, List, Mapping, Optional
-
+from concurrent.futures import ThreadPoolExecutor
+from typing import (
+    Any,
+    AsyncIterator,
+    Dict,
+    Iterator,
+    List,
+    Mapping,
+    Optional,
+    Tuple,
+    Union,
+)
+
+import httpx
 import requests
-from langchain.callbacks.manager import CallbackManagerForLLMRun
+from langchain.callbacks.manager import (
+    AsyncCallbackManagerForLLMRun,
+    CallbackManagerForLLMRun,
+)
 from langchain.llms.base import BaseLLM
 from langchain.schema import Generation, LLMResult
+from langchain.schema.output import GenerationChunk
 from langchain.schema.language_model import BaseLanguageModel
 from pydantic import Field
 
+from .circuit_breaker import (
+    CircuitBreaker,
+    CircuitOpenError,
+    get_circuit_breaker,
+    is_server_error,
+)
+from .completion_cache import (
+    DEFAULT_MAX_BYTES,
+    DEFAULT_TTL,
+    CompletionCache,
+    get_completion_cache,
+    is_reproducible,
+    make_key,
+)
+from .hedging import HedgePolicy, get_hedge_policy
+from .http_pool import (
+    DEFAULT_CONNECT_TIMEOUT,
+    DEFAULT_POOL_MAXSIZE,
+    DEFAULT_READ_TIMEOUT,
+    get_async_client,
+    get_session,
+)
+from .json_codec import dumps, loads, response_json
+from .load_balancer import (
+    LEAST_OUTSTANDING,
+    LoadBalancer,
+    endpoint_group,
+    get_load_balancer,
+    parse_base_urls,
+)
+from .rate_limiter import (
+    RETRYABLE_STATUS,
+    AdaptiveRateLimiter,
+    OverloadedError,
+    alimited_post,
+    get_rate_limiter,
+    limited_post,
+    parse_retry_after,
+    retry_delay,
+)
+from .single_flight import default_flight, request_key
+from .structured_logging import get_logger
+from .token_estimator import default_estimator, estimate_tokens
+
+GENERATE_PATH = "/models/generate"
+
+logger = get_logger(__name__)
+
 
 class _FormosaFoundationCommon(BaseLanguageModel):
-    base_url: str = "http://localhost:12345"
-    """Base url the model is hosted under."""
+    base_url: Union[str, List[str]] = "http://localhost:12345"
+    """Base url the model is hosted under. A list (or comma separated string)
+    of replica base urls spreads calls over all of them."""
 
     model: str = "ffm-mixtral-8x7b-32k-instruct"
     """Model name to use."""
@@ -46,6 +112,63 @@ class _FormosaFoundationCommon(BaseLanguageModel):
 
     ffm_api_key: Optional[str] = None
 
+    pool_maxsize: int = DEFAULT_POOL_MAXSIZE
+    """Maximum number of keep-alive connections kept to `base_url`."""
+
+    connect_timeout: float = DEFAULT_CONNECT_TIMEOUT
+    """Seconds allowed for connecting to the inference endpoint."""
+
+    read_timeout: float = DEFAULT_READ_TIMEOUT
+    """Seconds allowed for the inference endpoint to send its response."""
+
+    requests_per_second: Optional[float] = None
+    """Client side cap on requests/sec to `base_url` (None for no cap)."""
+
+    tokens_per_minute: Optional[float] = None
+    """Client side cap on prompt + generation tokens/min (None for no cap)."""
+
+    max_retries: int = 3
+    """How many times a 429/503 response is retried after backing off."""
+
+    hedge: bool = False
+    """Send a duplicate request when a call outlives `hedge_percentile`."""
+
+    hedge_percentile: float = 0.95
+    """Latency percentile (tracked per endpoint) after which to hedge."""
+
+    hedge_budget: float = 0.1
+    """Maximum fraction of calls that may be hedged."""
+
+    cache_path: Optional[str] = None
+    """SQLite file caching reproducible completions (None disables the cache)."""
+
+    cache_ttl: Optional[float] = DEFAULT_TTL
+    """Seconds a cached completion stays valid (None never expires)."""
+
+    cache_max_bytes: int = DEFAULT_MAX_BYTES
+    """Size above which the least recently used completions are evicted."""
+
+    force_cache: bool = False
+    """Cache completions even when temperature/seed do not make them reproducible."""
+
+    coalesce: bool = True
+    """Share one upstream call between identical concurrent requests."""
+
+    breaker_failure_threshold: int = 5
+    """Consecutive failures or timeouts after which calls fail fast."""
+
+    breaker_reset_timeout: float = 30.0
+    """Seconds an open circuit waits before letting a probe call through."""
+
+    balancer_strategy: str = LEAST_OUTSTANDING
+    """Replica selection: `least_outstanding` or `ewma` (latency weighted)."""
+
+    eject_after: int = 3
+    """Consecutive failures after which a replica is taken out of rotation."""
+
+    eject_seconds: float = 10.0
+    """How long a failing replica is ejected before being probed again."""
+
     @property
     def _default_params(self) -> Dict[str, Any]:
         """Get the default parameters for calling FFM API."""
@@ -58,12 +181,83 @@ class _FormosaFoundationCommon(BaseLanguageModel):
         }
         return {**normal_params, **self.model_kwargs}
 
-    def _call(
+    @property
+    def _base_urls(self) -> List[str]:
+        return parse_base_urls(self.base_url)
+
+    def _load_balancer(self) -> LoadBalancer:
+        return get_load_balancer(
+            self._base_urls,
+            GENERATE_PATH,
+            strategy=self.balancer_strategy,
+            eject_after=self.eject_after,
+            eject_seconds=self.eject_seconds,
+        )
+
+    def _rate_limiter(self, base_url: str) -> AdaptiveRateLimiter:
+        """Limiter shared with every other client of this replica's endpoint."""
+        return get_rate_limiter(
+            f"{base_url}{GENERATE_PATH}",
+            requests_per_second=self.requests_per_second,
+            tokens_per_minute=self.tokens_per_minute,
+            max_concurrency=self.pool_maxsize,
+        )
+
+    def _hedge_policy(self) -> HedgePolicy:
+        # hedges are routed through the balancer, so they may hit another replica
+        return get_hedge_policy(
+            endpoint_group(self._base_urls, GENERATE_PATH),
+            percentile=self.hedge_percentile,
+            max_hedge_ratio=self.hedge_budget,
+        )
+
+    def _circuit_breaker(self, base_url: str) -> CircuitBreaker:
+        return get_circuit_breaker(
+            f"{base_url}{GENERATE_PATH}",
+            failure_threshold=self.breaker_failure_threshold,
+            reset_timeout=self.breaker_reset_timeout,
+        )
+
+    def _completion_cache(self, **kwargs: Any) -> Optional[CompletionCache]:
+        """The cache to use for this call, or None if it must not be cached."""
+        if self.cache_path is None:
+            return None
+        force = kwargs.get("force_cache", self.force_cache)
+        if not force and not is_reproducible({**self._default_params, **kwargs}):
+            return None
+        return get_completion_cache(
+            self.cache_path, max_bytes=self.cache_max_bytes, ttl=self.cache_ttl
+        )
+
+    def _estimate_request_tokens(self, prompt: str, **kwargs: Any) -> int:
+        max_new_tokens = kwargs.get("max_new_tokens", self.max_new_tokens)
+        return estimate_tokens(prompt) + max(0, max_new_tokens)
+
+    @staticmethod
+    def _observe_usage(status_code: int, body: Dict[str, Any]) -> None:
+        """Calibrate the token estimator from a successful generate response.
+
+        Called once per upstream response, so cached and coalesced results are
+        not counted twice.
+        """
+        text = body.get("generated_text") if status_code == 200 else None
+        tokens = body.get("generated_tokens")
+        if text and isinstance(tokens, int):
+            default_estimator.observe(text, tokens)
+
+    def _build_request(
         self,
         prompt,
         stop: Optional[List[str]] = None,
+        stream: bool = False,
         **kwargs: Any,
-    ) -> str:
+    ) -> Tuple[str, Dict[str, str], bytes]:
+        """Assemble the endpoint name, headers and body for a generate call.
+
+        The endpoint name covers every replica; it identifies the call for
+        coalescing and error messages, not the url it is sent to.
+        """
+        kwargs.pop("force_cache", None)
         if self.stop is not None and stop is not None:
             raise ValueError("`stop` found in both the input and default params.")
         elif self.stop is not None:
@@ -76,6 +270,8 @@ class _FormosaFoundationCommon(BaseLanguageModel):
             "inputs": prompt,
             "model": self.model,
         }
+        if stream:
+            parameter_payload["stream"] = True
 
         # HTTP headers for authorization
         headers = {
@@ -83,28 +279,26 @@ class _FormosaFoundationCommon(BaseLanguageModel):
             "Content-Type": "application/json",
             "X-API-HOST": "afs-inference",
         }
-        endpoint_url = f"{self.base_url}/models/generate"
-        # send request
-        try:
-            response = requests.post(
-                url=endpoint_url,
-                headers=headers,
-                data=json.dumps(parameter_payload, ensure_ascii=False).encode("utf8"),
-                stream=False,
-            )
-            response.encoding = "utf-8"
-            generated_text = response.json()
-            if response.status_code != 200:
-                detail = generated_text.get("detail")
-                raise ValueError(
-                    f"FormosaFoundationModel endpoint_url: {endpoint_url}\n"
-                    f"error raised with status code {response.status_code}\n"
-                    f"Details: {detail}\n"
-                )
-
-        except requests.exceptions.RequestException as e:  # This is the correct syntax
+        # requests silently drops None headers, httpx rejects them
+        headers = {k: v for k, v in headers.items() if v is not None}
+        endpoint_url = endpoint_group(self._base_urls, GENERATE_PATH)
+        # sorted keys make the body, and so the cache key, independent of
+        # the order parameters were passed in
+        data = dumps(parameter_payload, sort_keys=True)
+        logger.trace("FFM generate request", endpoint=endpoint_url, body=data)
+        return endpoint_url, headers, data
+
+    @staticmethod
+    def _parse_response(
+        endpoint_url: str, status_code: int, generated_text: Dict[str, Any]
+    ) -> Dict[str, Any]:
+        """Validate a decoded generate response and return it."""
+        if status_code != 200:
+            detail = generated_text.get("detail")
             raise ValueError(
-                f"FormosaFoundationModel error raised by inference endpoint: {e}\n"
+                f"FormosaFoundationModel endpoint_url: {endpoint_url}\n"
+                f"error raised with status code {status_code}\n"
+                f"Details: {detail}\n"
             )
 
         if generated_text.get("detail") is not None:
@@ -120,8 +314,316 @@ class _FormosaFoundationCommon(BaseLanguageModel):
                 f"Response format error: {generated_text}\n"
             )
 
+        logger.trace(
+            "FFM generate response", endpoint=endpoint_url, body=generated_text
+        )
         return generated_text
 
+    def _call(
+        self,
+        prompt,
+        stop: Optional[List[str]] = None,
+        **kwargs: Any,
+    ) -> Dict[str, Any]:
+        # streaming is served by `_stream`; this path always reads one body
+        kwargs.pop("stream", None)
+        cache = self._completion_cache(**kwargs)
+        endpoint_url, headers, data = self._build_request(prompt, stop, **kwargs)
+        if cache is not None:
+            cache_key = make_key(data)
+            cached = cache.get(cache_key)
+            if cached is not None:
+                return cached
+
+        tokens = self._estimate_request_tokens(prompt, **kwargs)
+
+        def send(base_url: str) -> Tuple[int, Dict[str, Any]]:
+            response = limited_post(
+                get_session(base_url, self.pool_maxsize),
+                self._rate_limiter(base_url),
+                f"{base_url}{GENERATE_PATH}",
+                tokens=tokens,
+                max_retries=self.max_retries,
+                # generation time grows with the output, so it is not a load signal
+                latency_signal=False,
+                on_latency=self._hedge_policy().record if self.hedge else None,
+                headers=headers,
+                data=data,
+                stream=False,
+                timeout=(self.connect_timeout, self.read_timeout),
+            )
+            body = response_json(response)
+            self._observe_usage(response.status_code, body)
+            return response.status_code, body
+
+        def attempt(base_url: str) -> Tuple[int, Dict[str, Any]]:
+            return self._circuit_breaker(base_url).call(
+                lambda: send(base_url), is_failure=is_server_error
+            )
+
+        def routed() -> Tuple[int, Dict[str, Any]]:
+            return self._load_balancer().call(attempt, is_failure=is_server_error)
+
+        def fetch() -> Tuple[int, Dict[str, Any]]:
+            if self.hedge:
+                return self._hedge_policy().call(routed)
+            return routed()
+
+        # send request
+        try:
+            if self.coalesce:
+                key = request_key(endpoint_url, data)
+                status_code, generated_text = default_flight.do(key, fetch)
+            else:
+                status_code, generated_text = fetch()
+
+        except requests.exceptions.RequestException as e:  # This is the correct syntax
+            raise ValueError(
+                f"FormosaFoundationModel error raised by inference endpoint: {e}\n"
+            )
+
+        result = self._parse_response(endpoint_url, status_code, generated_text)
+        if cache is not None:
+            cache.put(cache_key, result)
+        return result
+
+    @staticmethod
+    def _parse_stream_line(line: str) -> Optional[Dict[str, Any]]:
+        """Decode one server-sent event line, or None for keep-alives and [DONE]."""
+        if not line or not line.startswith("data:"):
+            return None
+        data = line[len("data:") :].strip()
+        if not data or data == "[DONE]":
+            return None
+        event = loads(data)
+        if event.get("detail") is not None:
+            raise ValueError(
+                f"FormosaFoundationModel error raised by inference API: "
+                f"{event['detail']}\n"
+            )
+        return event
+
+    def _pick_replica(self) -> str:
+        """Reserve a replica whose circuit lets a streaming call through.
+
+        Streams cannot fail over once tokens were yielded, so the choice is
+        made up front: replicas with an open circuit are skipped.
+        """
+        balancer = self._load_balancer()
+        tried: List[str] = []
+        while True:
+            base_url = balancer.pick(exclude=tried)
+            tried.append(base_url)
+            try:
+                self._circuit_breaker(base_url).before_call()
+                return base_url
+            except CircuitOpenError:
+                # the open breaker refused the call: not a new replica failure
+                balancer.release(base_url, None)
+                if len(tried) >= len(balancer.replicas):
+                    raise
+
+    def _stream_events(
+        self,
+        prompt,
+        stop: Optional[List[str]] = None,
+        **kwargs: Any,
+    ) -> Iterator[Dict[str, Any]]:
+        """Yield the decoded events of a streaming generate call."""
+        endpoint_url, headers, data = self._build_request(
+            prompt, stop, stream=True, **kwargs
+        )
+        base_url = self._pick_replica()
+        breaker = self._circuit_breaker(base_url)
+        limiter = self._rate_limiter(base_url)
+        try:
+            limiter.acquire(self._estimate_request_tokens(prompt, **kwargs))
+        except BaseException:
+            breaker.abandon()
+            self._load_balancer().release(base_url, None)
+            raise
+        overloaded, retry_after, healthy = False, None, None
+        try:
+            session = get_session(base_url, self.pool_maxsize)
+            with session.post(
+                url=f"{base_url}{GENERATE_PATH}",
+                headers=headers,
+                data=data,
+                stream=True,
+                timeout=(self.connect_timeout, self.read_timeout),
+            ) as response:
+                response.encoding = "utf-8"
+                healthy = response.status_code < 500
+                if response.status_code != 200:
+                    overloaded = (
+                        not healthy or response.status_code in RETRYABLE_STATUS
+                    )
+                    retry_after = parse_retry_after(response.headers.get("Retry-After"))
+                    if response.status_code in RETRYABLE_STATUS:
+                        raise OverloadedError(
+                            endpoint_url,
+                            response.status_code,
+                            retry_delay(0, retry_after),
+                        )
+                    self._parse_response(
+                        endpoint_url, response.status_code, response.json()
+                    )
+                for line in response.iter_lines(decode_unicode=True):
+                    event = self._parse_stream_line(line)
+                    if event is not None:
+                        yield event
+
+        except requests.exceptions.RequestException as e:
+            overloaded = overloaded or isinstance(e, requests.exceptions.Timeout)
+            healthy = False
+            raise ValueError(
+                f"FormosaFoundationModel error raised by inference endpoint: {e}\n"
+            )
+        finally:
+            # stream duration depends on output length, so it is not a latency signal
+            limiter.release(
+                overloaded=overloaded, retry_after=retry_after, succeeded=healthy
+            )
+            breaker.record(healthy)
+            self._load_balancer().release(base_url, healthy)
+
+    async def _astream_events(
+        self,
+        prompt,
+        stop: Optional[List[str]] = None,
+        **kwargs: Any,
+    ) -> AsyncIterator[Dict[str, Any]]:
+        """Async counterpart of `_stream_events`."""
+        endpoint_url, headers, data = self._build_request(
+            prompt, stop, stream=True, **kwargs
+        )
+        base_url = self._pick_replica()
+        breaker = self._circuit_breaker(base_url)
+        limiter = self._rate_limiter(base_url)
+        try:
+            await limiter.aacquire(self._estimate_request_tokens(prompt, **kwargs))
+        except BaseException:
+            breaker.abandon()
+            self._load_balancer().release(base_url, None)
+            raise
+        overloaded, retry_after, healthy = False, None, None
+        try:
+            client = get_async_client(
+                base_url,
+                self.pool_maxsize,
+                self.connect_timeout,
+                self.read_timeout,
+            )
+            async with client.stream(
+                "POST", f"{base_url}{GENERATE_PATH}", headers=headers, content=data
+            ) as response:
+                healthy = response.status_code < 500
+                if response.status_code != 200:
+                    overloaded = (
+                        not healthy or response.status_code in RETRYABLE_STATUS
+                    )
+                    retry_after = parse_retry_after(response.headers.get("Retry-After"))
+                    if response.status_code in RETRYABLE_STATUS:
+                        raise OverloadedError(
+                            endpoint_url,
+                            response.status_code,
+                            retry_delay(0, retry_after),
+                        )
+                    await response.aread()
+                    self._parse_response(
+                        endpoint_url, response.status_code, response.json()
+                    )
+                async for line in response.aiter_lines():
+                    event = self._parse_stream_line(line)
+                    if event is not None:
+                        yield event
+
+        except (httpx.HTTPError, json.JSONDecodeError) as e:
+            overloaded = overloaded or isinstance(e, httpx.TimeoutException)
+            healthy = False
+            raise ValueError(
+                f"FormosaFoundationModel error raised by inference endpoint: {e}\n"
+            )
+        finally:
+            limiter.release(
+                overloaded=overloaded, retry_after=retry_after, succeeded=healthy
+            )
+            breaker.record(healthy)
+            self._load_balancer().release(base_url, healthy)
+
+    async def _acall(
+        self,
+        prompt,
+        stop: Optional[List[str]] = None,
+        **kwargs: Any,
+    ) -> Dict[str, Any]:
+        """Async counterpart of `_call` that does not block the event loop."""
+        kwargs.pop("stream", None)
+        cache = self._completion_cache(**kwargs)
+        endpoint_url, headers, data = self._build_request(prompt, stop, **kwargs)
+        if cache is not None:
+            cache_key = make_key(data)
+            # SQLite lookups block, keep them off the event loop
+            cached = await asyncio.to_thread(cache.get, cache_key)
+            if cached is not None:
+                return cached
+
+        tokens = self._estimate_request_tokens(prompt, **kwargs)
+
+        async def send(base_url: str) -> Tuple[int, Dict[str, Any]]:
+            client = get_async_client(
+                base_url,
+                self.pool_maxsize,
+                self.connect_timeout,
+                self.read_timeout,
+            )
+            response = await alimited_post(
+                client,
+                self._rate_limiter(base_url),
+                f"{base_url}{GENERATE_PATH}",
+                tokens=tokens,
+                max_retries=self.max_retries,
+                latency_signal=False,
+                on_latency=self._hedge_policy().record if self.hedge else None,
+                headers=headers,
+                content=data,
+            )
+            body = response_json(response)
+            self._observe_usage(response.status_code, body)
+            return response.status_code, body
+
+        async def attempt(base_url: str) -> Tuple[int, Dict[str, Any]]:
+            return await self._circuit_breaker(base_url).acall(
+                lambda: send(base_url), is_failure=is_server_error
+            )
+
+        async def routed() -> Tuple[int, Dict[str, Any]]:
+            return await self._load_balancer().acall(
+                attempt, is_failure=is_server_error
+            )
+
+        async def fetch() -> Tuple[int, Dict[str, Any]]:
+            if self.hedge:
+                return await self._hedge_policy().acall(routed)
+            return await routed()
+
+        try:
+            if self.coalesce:
+                key = request_key(endpoint_url, data)
+                status_code, generated_text = await default_flight.ado(key, fetch)
+            else:
+                status_code, generated_text = await fetch()
+
+        except (httpx.HTTPError, json.JSONDecodeError) as e:
+            raise ValueError(
+                f"FormosaFoundationModel error raised by inference endpoint: {e}\n"
+            )
+
+        result = self._parse_response(endpoint_url, status_code, generated_text)
+        if cache is not None:
+            await asyncio.to_thread(cache.put, cache_key, result)
+        return result
+
 
 class FormosaFoundationModel(BaseLLM, _FormosaFoundationCommon):
     """Formosa Foundation Model
@@ -131,6 +633,13 @@ class FormosaFoundationModel(BaseLLM, _FormosaFoundationCommon):
             ffm = FormosaFoundationModel(model_name="llama2-7b-chat-meta")
     """
 
+    max_concurrency: int = 4
+    """Maximum number of prompts of one `generate` call sent in parallel."""
+
+    max_continuations: int = 0
+    """How many times a generation stopped by `max_new_tokens` is continued,
+    by sending the prompt followed by the partial output. 0 disables it."""
+
     @property
     def _llm_type(self) -> str:
         return "FormosaFoundationModel"
@@ -140,7 +649,7 @@ class FormosaFoundationModel(BaseLLM, _FormosaFoundationCommon):
         """Get the identifying parameters."""
 
         return {
-            **{"model": self.model, "base_url": self.base_url},
+            **{"model": self.model, "base_url": self._base_urls},
             **self._default_params,
         }
 
@@ -166,25 +675,139 @@ class FormosaFoundationModel(BaseLLM, _FormosaFoundationCommon):
                 response = FormosaFoundationModel("Tell me a joke.")
         """
 
-        generations = []
-        token_usage = 0
-        for prompt in prompts:
-            final_chunk = super()._call(
+        def call(prompt: str) -> Dict[str, Any]:
+            chunk = super(FormosaFoundationModel, self)._call(
                 prompt,
                 stop=stop,
                 **kwargs,
             )
-            generations.append(
-                [
-                    Generation(
-                        text=final_chunk["generated_text"],
-                        generation_info=dict(
-                            finish_reason=final_chunk["finish_reason"]
-                        ),
+            for _ in range(self.max_continuations):
+                if chunk.get("finish_reason") != "length":
+                    break
+                tail = super(FormosaFoundationModel, self)._call(
+                    prompt + chunk["generated_text"],
+                    stop=stop,
+                    **kwargs,
+                )
+                chunk = self._join_continuation(chunk, tail)
+            return chunk
+
+        workers = max(1, min(self.max_concurrency, len(prompts)))
+        if workers == 1:
+            final_chunks = [call(prompt) for prompt in prompts]
+        else:
+            # executor.map keeps results in prompt order
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                final_chunks = list(executor.map(call, prompts))
+
+        return self._to_llm_result(final_chunks)
+
+    async def _agenerate(
+        self,
+        prompts: List[str],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[AsyncCallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> LLMResult:
+        """Async call out to FormosaFoundationModel's generate endpoint."""
+
+        semaphore = asyncio.Semaphore(max(1, self.max_concurrency))
+
+        async def call(prompt: str) -> Dict[str, Any]:
+            async with semaphore:
+                chunk = await super(FormosaFoundationModel, self)._acall(
+                    prompt,
+                    stop=stop,
+                    **kwargs,
+                )
+                for _ in range(self.max_continuations):
+                    if chunk.get("finish_reason") != "length":
+                        break
+                    tail = await super(FormosaFoundationModel, self)._acall(
+                        prompt + chunk["generated_text"],
+                        stop=stop,
+                        **kwargs,
                     )
-                ]
-            )
-            token_usage += final_chunk["generated_tokens"]
+                    chunk = self._join_continuation(chunk, tail)
+                return chunk
+
+        final_chunks = await asyncio.gather(*(call(prompt) for prompt in prompts))
+        return self._to_llm_result(final_chunks)
+
+    @staticmethod
+    def _join_continuation(
+        head: Dict[str, Any], tail: Dict[str, Any]
+    ) -> Dict[str, Any]:
+        """Append a continuation to the generation it continues."""
+        return {
+            **tail,
+            "generated_text": head["generated_text"] + tail["generated_text"],
+            "generated_tokens": head["generated_tokens"] + tail["generated_tokens"],
+            "continuations": head.get("continuations", 0) + 1,
+        }
 
+    def _to_llm_result(self, final_chunks: List[Dict[str, Any]]) -> LLMResult:
+        generations = [self._to_generations(chunk) for chunk in final_chunks]
+        token_usage = sum(chunk["generated_tokens"] for chunk in final_chunks)
         llm_output = {"token_usage": token_usage, "model": self.model}
         return LLMResult(generations=generations, llm_output=llm_output)
+
+    def _stream(
+        self,
+        prompt: str,
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[CallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> Iterator[GenerationChunk]:
+        """Yield text chunks as the FFM server produces them.
+
+        Example:
+            .. code-block:: python
+
+                for token in ffm.stream("Tell me a joke."):
+                    print(token, end="")
+        """
+        for event in self._stream_events(prompt, stop=stop, **kwargs):
+            chunk = self._to_generation_chunk(event)
+            if run_manager:
+                run_manager.on_llm_new_token(chunk.text, chunk=chunk)
+            yield chunk
+
+    async def _astream(
+        self,
+        prompt: str,
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[AsyncCallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> AsyncIterator[GenerationChunk]:
+        """Async version of `_stream`."""
+        async for event in self._astream_events(prompt, stop=stop, **kwargs):
+            chunk = self._to_generation_chunk(event)
+            if run_manager:
+                await run_manager.on_llm_new_token(chunk.text, chunk=chunk)
+            yield chunk
+
+    @staticmethod
+    def _to_generation_chunk(event: Dict[str, Any]) -> GenerationChunk:
+        generation_info = None
+        if event.get("finish_reason") is not None:
+            generation_info = dict(
+                finish_reason=event["finish_reason"],
+                generated_tokens=event.get("generated_tokens"),
+            )
+        return GenerationChunk(
+            text=event.get("generated_text") or "",
+            generation_info=generation_info,
+        )
+
+    @staticmethod
+    def _to_generations(final_chunk: Dict[str, Any]) -> List[Generation]:
+        return [
+            Generation(
+                text=final_chunk["generated_text"],
+                generation_info=dict(
+                    finish_reason=final_chunk["finish_reason"],
+                    continuations=final_chunk.get("continuations", 0),
+                ),
+            )
+        ]
@@ -0,0 +1,175 @@
+"""Circuit breaker that fails fast while an inference endpoint is down.
+
+closed     calls pass through; consecutive failures are counted.
+open       calls raise `CircuitOpenError` immediately until `reset_timeout`.
+half_open  a limited number of probe calls pass; one success closes the
+           circuit again, one failure re-opens it.
+"""
+
+import threading
+import time
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple, TypeVar
+
+from .registry import Registry
+
+T = TypeVar("T")
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class CircuitOpenError(RuntimeError):
+    """Raised instead of calling an endpoint whose circuit is open."""
+
+    def __init__(self, endpoint_url: str, retry_after: float):
+        super().__init__(
+            f"Inference endpoint {endpoint_url} is unavailable (circuit open), "
+            f"retry in {retry_after:.0f}s"
+        )
+        self.endpoint_url = endpoint_url
+        self.retry_after = retry_after
+
+
+def _never_fails(result: Any) -> bool:
+    return False
+
+
+def is_server_error(result: Tuple[int, Any]) -> bool:
+    """`is_failure` for calls returning `(status_code, body)`.
+
+    Only 5xx counts: 4xx means the endpoint is up and rejected the request,
+    and 429s are left to the rate limiter. A 429 or 503 still returned after
+    the limiter's retries is raised as `OverloadedError` and counts like any
+    other exception.
+    """
+    return result[0] >= 500
+
+
+class CircuitBreaker:
+    """Consecutive-failure circuit breaker for one endpoint."""
+
+    def __init__(
+        self,
+        endpoint_url: str,
+        failure_threshold: int = 5,
+        reset_timeout: float = 30.0,
+        half_open_max_calls: int = 1,
+    ):
+        self.endpoint_url = endpoint_url
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.half_open_max_calls = half_open_max_calls
+        self.state = CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probes = 0
+        self._rejected = 0
+        self._lock = threading.Lock()
+
+    def before_call(self) -> None:
+        """Raise `CircuitOpenError` unless a call may go through now."""
+        with self._lock:
+            if self.state == CLOSED:
+                return
+            now = time.monotonic()
+            if self.state == OPEN:
+                remaining = self._opened_at + self.reset_timeout - now
+                if remaining > 0:
+                    self._rejected += 1
+                    raise CircuitOpenError(self.endpoint_url, remaining)
+                self.state = HALF_OPEN
+                self._probes = 0
+            if self._probes >= self.half_open_max_calls:
+                self._rejected += 1
+                raise CircuitOpenError(self.endpoint_url, self.reset_timeout)
+            self._probes += 1
+
+    def record_success(self) -> None:
+        with self._lock:
+            self._failures = 0
+            self.state = CLOSED
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self._failures += 1
+            if self.state == HALF_OPEN or self._failures >= self.failure_threshold:
+                self.state = OPEN
+                self._opened_at = time.monotonic()
+
+    def abandon(self) -> None:
+        """Forget a call that ended without a verdict (e.g. it was cancelled)."""
+        with self._lock:
+            if self.state == HALF_OPEN:
+                self._probes = max(0, self._probes - 1)
+
+    def record(self, healthy: Optional[bool]) -> None:
+        """Record the outcome of a call let through by `before_call`."""
+        if healthy is None:
+            self.abandon()
+        elif healthy:
+            self.record_success()
+        else:
+            self.record_failure()
+
+    def call(
+        self, fn: Callable[[], T], is_failure: Callable[[T], bool] = _never_fails
+    ) -> T:
+        """Run `fn` under the breaker. Exceptions and `is_failure` results count."""
+        self.before_call()
+        healthy = None
+        try:
+            result = fn()
+            healthy = not is_failure(result)
+            return result
+        except Exception:
+            healthy = False
+            raise
+        finally:
+            self.record(healthy)
+
+    async def acall(
+        self,
+        factory: Callable[[], Awaitable[T]],
+        is_failure: Callable[[T], bool] = _never_fails,
+    ) -> T:
+        """Async version of `call`."""
+        self.before_call()
+        healthy = None
+        try:
+            result = await factory()
+            healthy = not is_failure(result)
+            return result
+        except Exception:
+            healthy = False
+            raise
+        finally:
+            self.record(healthy)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            retry_in: Optional[float] = None
+            if self.state == OPEN:
+                retry_in = max(
+                    0.0, self._opened_at + self.reset_timeout - time.monotonic()
+                )
+            return {
+                "state": self.state,
+                "consecutive_failures": self._failures,
+                "rejected": self._rejected,
+                "retry_in": retry_in,
+            }
+
+
+_breakers: Registry[CircuitBreaker] = Registry()
+
+
+def get_circuit_breaker(endpoint_url: str, **settings: Any) -> CircuitBreaker:
+    """Return the breaker shared by every client of `endpoint_url`."""
+    key = endpoint_url.rstrip("/")
+    return _breakers.get(key, lambda: CircuitBreaker(key, **settings))
+
+
+def circuit_breaker_stats() -> Dict[str, Dict[str, Any]]:
+    """State of every endpoint's breaker, keyed by endpoint url."""
+    return {url: breaker.stats() for url, breaker in _breakers.items()}
@@ -0,0 +1,89 @@
+"""Disk backed cache for deterministic FFM completions.
+
+Entries are keyed by the SHA-256 of the full generate request body, i.e. the
+model, the complete prompt and every generation parameter. Storage is a
+single SQLite file with TTL expiry and least-recently-used eviction once the
+entry count or total size exceeds its limits.
+"""
+
+import hashlib
+import time
+from typing import Any, Dict, Optional
+
+from .json_codec import dumps, loads
+from .registry import Registry
+from .sqlite_lru import SQLiteLRUStore
+
+DEFAULT_MAX_ENTRIES = 10000
+DEFAULT_MAX_BYTES = 256 * 1024 * 1024
+DEFAULT_TTL = 30 * 24 * 3600.0
+
+
+def is_reproducible(params: Dict[str, Any]) -> bool:
+    """True when the generation parameters pin the output down."""
+    return params.get("temperature") == 0 or params.get("seed") is not None
+
+
+def make_key(request_body: bytes) -> str:
+    return hashlib.sha256(request_body).hexdigest()
+
+
+class CompletionCache(SQLiteLRUStore):
+    """SQLite key/value store of completion responses with LRU eviction."""
+
+    _table = "completions"
+    _columns = ("key", "value", "size", "created", "accessed")
+    _schema = (
+        "CREATE TABLE IF NOT EXISTS completions ("
+        " key TEXT PRIMARY KEY,"
+        " value TEXT NOT NULL,"
+        " size INTEGER NOT NULL,"
+        " created REAL NOT NULL,"
+        " accessed REAL NOT NULL)",
+        "CREATE INDEX IF NOT EXISTS completions_accessed ON completions (accessed)",
+        "CREATE INDEX IF NOT EXISTS completions_created ON completions (created)",
+    )
+
+    def __init__(
+        self,
+        path: str,
+        max_entries: int = DEFAULT_MAX_ENTRIES,
+        max_bytes: int = DEFAULT_MAX_BYTES,
+        ttl: Optional[float] = DEFAULT_TTL,
+    ):
+        super().__init__(path, max_entries, max_bytes)
+        self.ttl = ttl
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value, created FROM completions WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None or (self.ttl is not None and now - row[1] > self.ttl):
+                self._count_lookups(0, 1)
+                return None
+            self._touch([key], now)
+            self._count_lookups(1, 1)
+        return loads(row[0])
+
+    def put(self, key: str, value: Dict[str, Any]) -> None:
+        data = dumps(value)
+        now = time.time()
+        with self._lock, self._conn:
+            if self.ttl is not None:
+                self.evictions += self._delete_where("created < ?", (now - self.ttl,))
+            self._insert([(key, data.decode("utf8"), len(data), now, now)])
+
+
+_caches: Registry[CompletionCache] = Registry()
+
+
+def get_completion_cache(path: str, **settings: Any) -> CompletionCache:
+    """Return the process wide cache stored at `path`."""
+    return _caches.get(path, lambda: CompletionCache(path, **settings))
+
+
+def completion_cache_stats() -> Dict[str, Dict[str, Any]]:
+    """Hit/miss counters of every open cache, keyed by path."""
+    return {path: cache.stats() for path, cache in _caches.items()}
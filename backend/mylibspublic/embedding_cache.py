@@ -0,0 +1,115 @@
+"""Content addressed, disk backed cache of embedding vectors.
+
+Entries are keyed by the SHA-256 of the embedding model and the normalized
+text, so the same content embedded for another knowledge base, uploaded
+again or queried twice is looked up instead of sent to the endpoint.
+Vectors are stored as packed float32 blobs in a single SQLite file, with
+least-recently-used eviction once the entry count or total size exceeds
+its limits.
+"""
+
+import hashlib
+import re
+import time
+import unicodedata
+from typing import Any, Dict, List, Optional, Sequence, Union
+
+import numpy as np
+
+from .registry import Registry
+from .sqlite_lru import SQLiteLRUStore
+
+DEFAULT_MAX_ENTRIES = 1000000
+DEFAULT_MAX_BYTES = 1024 * 1024 * 1024
+
+_WHITESPACE = re.compile(r"\s+")
+
+Vector = Union[List[float], np.ndarray]
+
+
+def normalize_text(text: str) -> str:
+    """Canonical form of `text` for cache keys: NFC, whitespace collapsed."""
+    return _WHITESPACE.sub(" ", unicodedata.normalize("NFC", text)).strip()
+
+
+def make_key(model: str, text: str) -> str:
+    digest = hashlib.sha256(model.encode("utf8"))
+    digest.update(b"\0")
+    digest.update(normalize_text(text).encode("utf8"))
+    return digest.hexdigest()
+
+
+def pack_vector(vector: Vector) -> bytes:
+    return np.asarray(vector, dtype="<f4").tobytes()
+
+
+def unpack_vector(blob: bytes, as_numpy: bool = False) -> Vector:
+    """Decode a stored vector; numpy arrays are read-only views of `blob`."""
+    vector = np.frombuffer(blob, dtype="<f4")
+    return vector if as_numpy else vector.tolist()
+
+
+class EmbeddingCache(SQLiteLRUStore):
+    """SQLite store of float32 embedding vectors with LRU eviction."""
+
+    _table = "embeddings"
+    _columns = ("key", "vector", "size", "accessed")
+    _schema = (
+        "CREATE TABLE IF NOT EXISTS embeddings ("
+        " key TEXT PRIMARY KEY,"
+        " vector BLOB NOT NULL,"
+        " size INTEGER NOT NULL,"
+        " accessed REAL NOT NULL)",
+        "CREATE INDEX IF NOT EXISTS embeddings_accessed ON embeddings (accessed)",
+    )
+
+    def __init__(
+        self,
+        path: str,
+        max_entries: int = DEFAULT_MAX_ENTRIES,
+        max_bytes: int = DEFAULT_MAX_BYTES,
+    ):
+        super().__init__(path, max_entries, max_bytes)
+
+    def get_many(
+        self, keys: Sequence[str], as_numpy: bool = False
+    ) -> List[Optional[Vector]]:
+        """The cached vector of each key, or None where it is missing."""
+        now = time.time()
+        with self._lock:
+            found: Dict[str, bytes] = dict(self._select("vector", keys))
+            if found:
+                self._touch(found, now)
+            self._count_lookups(sum(1 for key in keys if key in found), len(keys))
+        return [
+            unpack_vector(found[key], as_numpy) if key in found else None
+            for key in keys
+        ]
+
+    def get(self, key: str, as_numpy: bool = False) -> Optional[Vector]:
+        return self.get_many([key], as_numpy)[0]
+
+    def put_many(self, items: Dict[str, Vector]) -> None:
+        now = time.time()
+        rows = []
+        for key, vector in items.items():
+            blob = pack_vector(vector)
+            rows.append((key, blob, len(blob), now))
+        with self._lock, self._conn:
+            self._insert(rows)
+
+    def put(self, key: str, vector: Vector) -> None:
+        self.put_many({key: vector})
+
+
+_caches: Registry[EmbeddingCache] = Registry()
+
+
+def get_embedding_cache(path: str, **settings: Any) -> EmbeddingCache:
+    """Return the process wide cache stored at `path`."""
+    return _caches.get(path, lambda: EmbeddingCache(path, **settings))
+
+
+def embedding_cache_stats() -> Dict[str, Dict[str, Any]]:
+    """Hit/miss counters of every open cache, keyed by path."""
+    return {path: cache.stats() for path, cache in _caches.items()}
@@ -1,3 +1,4 @@
+import functools
 import os
 import sys
 from dotenv import load_dotenv
@@ -8,37 +9,47 @@ parent_dir = os.path.dirname(current_dir)
 sys.path.append(parent_dir)
 
 from mylibspublic.FormosaFoundationModel2 import FormosaFoundationModel
+from mylibspublic.http_pool import (
+    DEFAULT_CONNECT_TIMEOUT,
+    DEFAULT_POOL_MAXSIZE,
+    DEFAULT_READ_TIMEOUT,
+)
+from mylibspublic.load_balancer import LEAST_OUTSTANDING, parse_base_urls
+from mylibspublic.model_cascade import (
+    FormosaCascadeModel,
+    routing_decision,
+    translation_checks,
+)
+from mylibspublic.structured_logging import configure_logging, get_logger
 
-print("Debug: Starting ffm_completion.py")
+logger = get_logger(__name__)
 
 # 加載環境變量
 load_dotenv()
-print("Debug: Loaded environment variables")
 
-def get_ffm_completion(
-    user_prompt,
-    system_message="You are a helpful assistant.",
-    model=os.getenv("MODEL_NAME"),
-    temperature=0.5,
-    max_tokens=350,
-):
-    print("Debug: Entering get_ffm_completion function")
-    
+def _optional_float(name):
+    value = os.getenv(name)
+    return float(value) if value else None
+
+
+def _build_ffm(model, temperature, max_tokens, hedge=False):
     # 從環境變量中獲取 API 密鑰和 URL
     API_KEY = os.getenv("API_KEY")
-    API_URL = os.getenv("API_URL")
+    # API_URL may list several replicas separated by commas
+    API_URL = parse_base_urls(os.getenv("API_URL", ""))
     API_HOST = os.getenv("API_HOST")
 
-    # 添加調試信息
-    print(f"Debug: API_KEY: {API_KEY[:5]}...{API_KEY[-5:] if API_KEY else None}")
-    print(f"Debug: API_URL: {API_URL}")
-    print(f"Debug: API_HOST: {API_HOST}")
-
     if not API_KEY or not API_URL or not API_HOST:
         raise ValueError("API_KEY, API_URL, or API_HOST is missing in the environment variables.")
 
-    print("Debug: Creating FormosaFoundationModel instance")
-    ffm = FormosaFoundationModel(
+    logger.debug(
+        "Creating FormosaFoundationModel",
+        model=model,
+        temperature=temperature,
+        max_tokens=max_tokens,
+        base_url=API_URL,
+    )
+    return FormosaFoundationModel(
         base_url=API_URL,
         max_new_tokens=max_tokens,
         temperature=temperature,
@@ -47,22 +58,130 @@ def get_ffm_completion(
         frequence_penalty=1.0,
         ffm_api_key=API_KEY,
         model=model,
+        pool_maxsize=int(os.getenv("HTTP_POOL_MAXSIZE", DEFAULT_POOL_MAXSIZE)),
+        connect_timeout=float(
+            os.getenv("HTTP_CONNECT_TIMEOUT", DEFAULT_CONNECT_TIMEOUT)
+        ),
+        read_timeout=float(os.getenv("HTTP_READ_TIMEOUT", DEFAULT_READ_TIMEOUT)),
+        requests_per_second=_optional_float("FFM_REQUESTS_PER_SECOND"),
+        tokens_per_minute=_optional_float("FFM_TOKENS_PER_MINUTE"),
+        max_retries=int(os.getenv("FFM_MAX_RETRIES", "3")),
+        hedge=hedge,
+        breaker_failure_threshold=int(os.getenv("FFM_BREAKER_FAILURES", "5")),
+        breaker_reset_timeout=float(os.getenv("FFM_BREAKER_RESET_SECONDS", "30")),
+        balancer_strategy=os.getenv("FFM_BALANCER_STRATEGY", LEAST_OUTSTANDING),
+        eject_after=int(os.getenv("FFM_EJECT_AFTER", "3")),
+        eject_seconds=float(os.getenv("FFM_EJECT_SECONDS", "10")),
+        max_continuations=int(os.getenv("FFM_MAX_CONTINUATIONS", "2")),
+        cache_path=os.getenv("FFM_CACHE_PATH", "./cache/ffm_completions.sqlite3")
+        or None,
     )
 
+
+@functools.lru_cache(maxsize=32)
+def get_ffm_client(model, temperature, max_tokens=350, hedge=False):
+    """Return the shared FFM client for these generation settings.
+
+    Clients are built once per (model, temperature, max_tokens, hedge); the
+    HTTP pool, limiter and caches behind them are shared per endpoint anyway.
+    When FAST_MODEL_NAME is set the client is a cascade that tries that model
+    first and escalates to `model`.
+    Call `get_ffm_client.cache_clear()` after changing the environment.
+    """
+    ffm = _build_ffm(model, temperature, max_tokens, hedge)
+    fast_model = os.getenv("FAST_MODEL_NAME")
+    if not fast_model or fast_model == model:
+        return ffm
+    return FormosaCascadeModel(
+        fast=_build_ffm(fast_model, temperature, max_tokens, hedge), strong=ffm
+    )
+
+
+def _generation_kwargs(ffm, max_tokens, force_cache, source_text, target_lang):
+    # the token budget is sent per call so differently sized chunks share a client
+    kwargs = {"max_new_tokens": max_tokens, "force_cache": force_cache}
+    # a cascade judges translations against their source text
+    if isinstance(ffm, FormosaCascadeModel) and source_text is not None:
+        kwargs["source_text"] = source_text
+        kwargs["checks"] = translation_checks(target_lang)
+    return kwargs
+
+
+def _completion_text(ffm, result, routing, generation_info):
+    generation = result.generations[0][0]
+    if routing is not None:
+        routing.append(routing_decision(ffm, generation))
+    if generation_info is not None:
+        generation_info.update(generation.generation_info or {})
+    logger.debug("Received FFM response", chars=len(generation.text))
+    logger.trace("FFM response", text=generation.text)
+    return generation.text
+
+
+def get_ffm_completion(
+    user_prompt,
+    system_message="You are a helpful assistant.",
+    model=os.getenv("MODEL_NAME"),
+    temperature=0.5,
+    max_tokens=350,
+    hedge=False,
+    force_cache=False,
+    source_text=None,
+    target_lang=None,
+    routing=None,
+    generation_info=None,
+):
+    """Complete `user_prompt` and return the generated text.
+
+    `source_text` and `target_lang` mark the call as a translation, which
+    lets a model cascade check the answer against them. If `routing` is a
+    list, the routing decision of the call is appended to it; if
+    `generation_info` is a dict, it is updated with the generation's info
+    (e.g. `finish_reason`).
+    """
+    ffm = get_ffm_client(model, temperature, hedge=hedge)
+
     # Combine system message and user prompt
     full_prompt = f"{system_message}\n\nHuman: {user_prompt}\n\nAssistant:"
-    print(f"Debug: Full prompt: {full_prompt}")
+    logger.debug("Calling FFM", model=model, prompt_chars=len(full_prompt))
+    logger.trace("FFM prompt", prompt=full_prompt)
 
     # Get the response from the model
-    print("Debug: Calling FFM model")
-    response = ffm(full_prompt)
-    print(f"Debug: Received response: {response[:50]}...")  # 只打印前50個字符
+    kwargs = _generation_kwargs(
+        ffm, max_tokens, force_cache, source_text, target_lang
+    )
+    result = ffm.generate([full_prompt], **kwargs)
+    return _completion_text(ffm, result, routing, generation_info)
 
-    return response
+
+async def aget_ffm_completion(
+    user_prompt,
+    system_message="You are a helpful assistant.",
+    model=os.getenv("MODEL_NAME"),
+    temperature=0.5,
+    max_tokens=350,
+    hedge=False,
+    force_cache=False,
+    source_text=None,
+    target_lang=None,
+    routing=None,
+    generation_info=None,
+):
+    """Async version of `get_ffm_completion` for use inside the event loop."""
+    ffm = get_ffm_client(model, temperature, hedge=hedge)
+
+    full_prompt = f"{system_message}\n\nHuman: {user_prompt}\n\nAssistant:"
+    logger.debug("Calling FFM", model=model, prompt_chars=len(full_prompt))
+    logger.trace("FFM prompt", prompt=full_prompt)
+    kwargs = _generation_kwargs(
+        ffm, max_tokens, force_cache, source_text, target_lang
+    )
+    result = await ffm.agenerate([full_prompt], **kwargs)
+    return _completion_text(ffm, result, routing, generation_info)
 
 # Example usage
 if __name__ == "__main__":
-    print("Debug: Running main block")
+    configure_logging("TRACE", "text")
     user_prompt = "請問台灣最高的山是？"
     response = get_ffm_completion(user_prompt)
-    print(f"Final response: {response}")
\ No newline at end of file
+    print(f"Final response: {response}")
@@ -0,0 +1,180 @@
+"""Hedged requests to cut tail latency of FFM calls.
+
+If a call has not answered within the endpoint's observed latency percentile,
+a duplicate is sent and whichever finishes first wins. A budget caps the
+fraction of calls that may be hedged so a slow endpoint is not hit with
+twice the load. Callers `record` the upstream time of each request they
+send, so waiting for a rate limiter or retry backoff does not inflate the
+percentile.
+"""
+
+import asyncio
+import threading
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from typing import Any, Awaitable, Callable, Dict, Optional, TypeVar
+
+from .registry import Registry
+
+T = TypeVar("T")
+
+_executor = ThreadPoolExecutor(max_workers=32, thread_name_prefix="ffm-hedge")
+
+
+def _spawn(fn: Callable[[], T]) -> "Future[T]":
+    """Run `fn` on a thread of its own, so it never queues behind other calls."""
+    future: "Future[T]" = Future()
+
+    def run() -> None:
+        if not future.set_running_or_notify_cancel():
+            return
+        try:
+            future.set_result(fn())
+        except BaseException as error:
+            future.set_exception(error)
+
+    threading.Thread(target=run, name="ffm-hedge-primary", daemon=True).start()
+    return future
+
+
+class HedgePolicy:
+    """Online latency percentile and hedge budget for one endpoint."""
+
+    def __init__(
+        self,
+        percentile: float = 0.95,
+        max_hedge_ratio: float = 0.1,
+        window: int = 256,
+        min_samples: int = 20,
+    ):
+        self.percentile = percentile
+        self.max_hedge_ratio = max_hedge_ratio
+        self.min_samples = min_samples
+        self._latencies = deque(maxlen=window)
+        self._calls = 0
+        self._hedged = 0
+        self._hedge_wins = 0
+        self._lock = threading.Lock()
+
+    def record(self, latency: float) -> None:
+        """Add the upstream time of one request to the latency window."""
+        with self._lock:
+            self._latencies.append(latency)
+
+    def delay(self) -> Optional[float]:
+        """Seconds to wait before hedging, or None while still warming up."""
+        with self._lock:
+            if len(self._latencies) < self.min_samples:
+                return None
+            ordered = sorted(self._latencies)
+        index = min(len(ordered) - 1, int(self.percentile * len(ordered)))
+        return ordered[index]
+
+    def _start_call(self) -> None:
+        with self._lock:
+            self._calls += 1
+
+    def _spend(self) -> bool:
+        """Reserve a hedge if it keeps hedged/total within the budget."""
+        with self._lock:
+            if self._hedged + 1 > self.max_hedge_ratio * self._calls:
+                return False
+            self._hedged += 1
+            return True
+
+    def _won(self) -> None:
+        with self._lock:
+            self._hedge_wins += 1
+
+    def call(self, fn: Callable[[], T]) -> T:
+        """Run `fn`, hedging with a second `fn()` if the first is slow.
+
+        A thread blocked in a socket read cannot be interrupted, so the losing
+        request is cancelled if it has not started yet and otherwise left to
+        finish in the background with its result discarded. The first call
+        runs on a thread of its own, so the hedge delay starts when it does.
+        """
+        self._start_call()
+        delay = self.delay()
+        if delay is None:
+            return fn()
+
+        primary = _spawn(fn)
+        done, _ = wait([primary], timeout=delay)
+        if done or not self._spend():
+            return primary.result()
+
+        hedge = _executor.submit(fn)
+        pending = {primary, hedge}
+        error: Optional[BaseException] = None
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    self._finish(future, hedge, pending)
+                    return future.result()
+                error = error or future.exception()
+        raise error
+
+    def _finish(self, winner: Future, hedge: Future, pending: set) -> None:
+        if winner is hedge:
+            self._won()
+        for future in pending:
+            future.cancel()
+
+    async def acall(self, factory: Callable[[], Awaitable[T]]) -> T:
+        """Async version of `call`; the losing request is cancelled."""
+        self._start_call()
+        delay = self.delay()
+        if delay is None:
+            return await factory()
+
+        primary = asyncio.ensure_future(factory())
+        tasks = {primary}
+        try:
+            done, _ = await asyncio.wait(tasks, timeout=delay)
+            if done or not self._spend():
+                return await primary
+
+            hedge = asyncio.ensure_future(factory())
+            tasks.add(hedge)
+            pending = set(tasks)
+            error: Optional[BaseException] = None
+            while pending:
+                done, pending = await asyncio.wait(
+                    pending, return_when=asyncio.FIRST_COMPLETED
+                )
+                for task in done:
+                    if task.exception() is None:
+                        if task is hedge:
+                            self._won()
+                        return task.result()
+                    error = error or task.exception()
+            raise error
+        finally:
+            for task in tasks:
+                if not task.done():
+                    task.cancel()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            calls, hedged, wins = self._calls, self._hedged, self._hedge_wins
+        return {
+            "calls": calls,
+            "hedged": hedged,
+            "hedge_wins": wins,
+            "hedge_delay": self.delay(),
+        }
+
+
+_policies: Registry[HedgePolicy] = Registry()
+
+
+def get_hedge_policy(endpoint_url: str, **settings: Any) -> HedgePolicy:
+    """Return the policy shared by every client of `endpoint_url`."""
+    return _policies.get(endpoint_url.rstrip("/"), lambda: HedgePolicy(**settings))
+
+
+def hedge_stats() -> Dict[str, Dict[str, Any]]:
+    """Snapshot of every endpoint's hedge policy, keyed by endpoint url."""
+    return {url: policy.stats() for url, policy in _policies.items()}
@@ -0,0 +1,108 @@
+"""Shared keep-alive HTTP connection pools for the FFM clients."""
+
+import asyncio
+import threading
+from typing import Dict, Tuple
+from urllib.parse import urlsplit
+
+import httpx
+import requests
+from requests.adapters import HTTPAdapter
+
+DEFAULT_POOL_MAXSIZE = 20
+"""Maximum number of keep-alive connections kept per host."""
+
+DEFAULT_CONNECT_TIMEOUT = 5.0
+"""Seconds allowed for establishing the TCP/TLS connection."""
+
+DEFAULT_READ_TIMEOUT = 120.0
+"""Seconds allowed between bytes of the response (generation can be slow)."""
+
+_sessions: Dict[Tuple[str, int], requests.Session] = {}
+_async_clients: Dict[Tuple[str, int, float, float, int], httpx.AsyncClient] = {}
+_lock = threading.Lock()
+
+
+def endpoint_origin(base_url: str) -> str:
+    """Reduce a base url to scheme://host:port so sub paths share one pool."""
+    parts = urlsplit(base_url)
+    if not parts.scheme or not parts.netloc:
+        return base_url.rstrip("/")
+    return f"{parts.scheme}://{parts.netloc}"
+
+
+def get_session(
+    base_url: str, pool_maxsize: int = DEFAULT_POOL_MAXSIZE
+) -> requests.Session:
+    """Return the process wide session for `base_url`.
+
+    Sessions are created lazily, one per (origin, pool size), and keep their
+    connections alive between calls so only the first request to a host pays
+    for the TCP and TLS handshake.
+    """
+    key = (endpoint_origin(base_url), pool_maxsize)
+    session = _sessions.get(key)
+    if session is not None:
+        return session
+
+    with _lock:
+        session = _sessions.get(key)
+        if session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(
+                pool_connections=1, pool_maxsize=pool_maxsize, pool_block=False
+            )
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+            _sessions[key] = session
+    return session
+
+
+def close_sessions() -> None:
+    """Close every pooled session, e.g. on application shutdown."""
+    with _lock:
+        for session in _sessions.values():
+            session.close()
+        _sessions.clear()
+
+
+def get_async_client(
+    base_url: str,
+    pool_maxsize: int = DEFAULT_POOL_MAXSIZE,
+    connect_timeout: float = DEFAULT_CONNECT_TIMEOUT,
+    read_timeout: float = DEFAULT_READ_TIMEOUT,
+) -> httpx.AsyncClient:
+    """Return the pooled async client for `base_url` on the running event loop.
+
+    httpx connections are bound to the loop that opened them, so clients are
+    keyed by loop as well as by origin and pool settings.
+    """
+    loop_id = id(asyncio.get_running_loop())
+    origin = endpoint_origin(base_url)
+    key = (origin, pool_maxsize, connect_timeout, read_timeout, loop_id)
+    client = _async_clients.get(key)
+    if client is not None and not client.is_closed:
+        return client
+
+    with _lock:
+        client = _async_clients.get(key)
+        if client is None or client.is_closed:
+            client = httpx.AsyncClient(
+                limits=httpx.Limits(
+                    max_connections=pool_maxsize,
+                    max_keepalive_connections=pool_maxsize,
+                ),
+                timeout=httpx.Timeout(read_timeout, connect=connect_timeout),
+            )
+            _async_clients[key] = client
+    return client
+
+
+async def aclose_clients() -> None:
+    """Close the async clients owned by the running event loop."""
+    loop_id = id(asyncio.get_running_loop())
+    with _lock:
+        keys = [key for key in _async_clients if key[-1] == loop_id]
+        clients = [_async_clients.pop(key) for key in keys]
+    for client in clients:
+        await client.aclose()
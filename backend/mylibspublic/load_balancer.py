@@ -0,0 +1,241 @@
+"""Spread calls over several replicas of an inference endpoint.
+
+Each call goes to the healthy replica with the fewest outstanding requests
+(`least_outstanding`) or the lowest latency EWMA weighted by its outstanding
+requests (`ewma`). A replica that fails `eject_after` times in a row is
+ejected for `eject_seconds`, doubling on every repeated ejection. Once the
+ejection expires the next call routed to it acts as the probe: one success
+restores it, one failure ejects it again. A call refused by a replica's
+open circuit breaker fails over without counting against the replica.
+
+Rate limiters, hedging state and circuit breakers remain keyed by the full
+replica endpoint url, so every replica keeps its own view of capacity.
+"""
+
+import random
+import threading
+import time
+from typing import (
+    Any,
+    Awaitable,
+    Callable,
+    Dict,
+    List,
+    Optional,
+    Sequence,
+    TypeVar,
+    Union,
+)
+
+from .circuit_breaker import CircuitOpenError
+from .registry import Registry
+
+T = TypeVar("T")
+
+LEAST_OUTSTANDING = "least_outstanding"
+EWMA = "ewma"
+
+
+def parse_base_urls(value: Union[str, Sequence[str]]) -> List[str]:
+    """Normalise a base url, a comma separated list or a sequence of urls."""
+    if isinstance(value, str):
+        value = value.split(",")
+    return [url.strip().rstrip("/") for url in value if url and url.strip()]
+
+
+def endpoint_group(base_urls: Sequence[str], path: str) -> str:
+    """Name identifying `path` served by the replicas in `base_urls`."""
+    return ",".join(f"{url}{path}" for url in base_urls)
+
+
+def _never_fails(result: Any) -> bool:
+    return False
+
+
+class Replica:
+    """Routing state of one replica. Guarded by the owning balancer."""
+
+    def __init__(self, url: str):
+        self.url = url
+        self.outstanding = 0
+        self.latency: Optional[float] = None
+        self.failures = 0
+        self.ejections = 0
+        self.ejected_until = 0.0
+        self.requests = 0
+
+    def stats(self, now: float) -> Dict[str, Any]:
+        return {
+            "outstanding": self.outstanding,
+            "latency_ewma": self.latency,
+            "consecutive_failures": self.failures,
+            "ejected_for": max(0.0, self.ejected_until - now),
+            "requests": self.requests,
+        }
+
+
+class LoadBalancer:
+    """Chooses a replica per call and ejects replicas that keep failing."""
+
+    def __init__(
+        self,
+        base_urls: Sequence[str],
+        strategy: str = LEAST_OUTSTANDING,
+        eject_after: int = 3,
+        eject_seconds: float = 10.0,
+        max_eject_seconds: float = 300.0,
+        decay: float = 0.3,
+    ):
+        if not base_urls:
+            raise ValueError("LoadBalancer needs at least one base url")
+        if strategy not in (LEAST_OUTSTANDING, EWMA):
+            raise ValueError(f"Unknown load balancing strategy: {strategy}")
+        self.replicas = [Replica(url) for url in base_urls]
+        self.strategy = strategy
+        self.eject_after = eject_after
+        self.eject_seconds = eject_seconds
+        self.max_eject_seconds = max_eject_seconds
+        self.decay = decay
+        self._lock = threading.Lock()
+
+    def _score(self, replica: Replica) -> float:
+        if self.strategy == EWMA:
+            # replicas without samples score 0 so they get measured first
+            return (replica.latency or 0.0) * (replica.outstanding + 1)
+        return replica.outstanding
+
+    def pick(self, exclude: Sequence[str] = ()) -> str:
+        """Reserve the best replica not in `exclude` and return its url.
+
+        Every `pick` must be paired with a `release`. When all candidates are
+        ejected the one whose ejection ends first is used rather than failing.
+        """
+        with self._lock:
+            now = time.monotonic()
+            candidates = [r for r in self.replicas if r.url not in exclude]
+            if not candidates:
+                raise ValueError("No replica left to try")
+            healthy = [r for r in candidates if r.ejected_until <= now]
+            if healthy:
+                # random tie break keeps idle replicas evenly used
+                replica = min(healthy, key=lambda r: (self._score(r), random.random()))
+            else:
+                replica = min(candidates, key=lambda r: r.ejected_until)
+            replica.outstanding += 1
+            replica.requests += 1
+            return replica.url
+
+    def release(
+        self, url: str, healthy: Optional[bool], latency: Optional[float] = None
+    ) -> None:
+        """Return a replica picked by `pick`; `healthy=None` records nothing."""
+        with self._lock:
+            replica = next(r for r in self.replicas if r.url == url)
+            replica.outstanding = max(0, replica.outstanding - 1)
+            if healthy is None:
+                return
+            now = time.monotonic()
+            if healthy:
+                replica.failures = 0
+                replica.ejections = 0
+                if latency is not None:
+                    if replica.latency is None:
+                        replica.latency = latency
+                    else:
+                        replica.latency += self.decay * (latency - replica.latency)
+                return
+            replica.failures += 1
+            if replica.failures >= self.eject_after and replica.ejected_until <= now:
+                replica.ejections += 1
+                backoff = self.eject_seconds * 2 ** (replica.ejections - 1)
+                replica.ejected_until = now + min(self.max_eject_seconds, backoff)
+
+    def call(
+        self,
+        fn: Callable[[str], T],
+        is_failure: Callable[[T], bool] = _never_fails,
+    ) -> T:
+        """Run `fn(base_url)`, failing over to untried replicas on failure."""
+        tried: List[str] = []
+        while True:
+            url = self.pick(exclude=tried)
+            tried.append(url)
+            last_chance = len(tried) >= len(self.replicas)
+            start = time.monotonic()
+            healthy = None
+            try:
+                result = fn(url)
+                healthy = not is_failure(result)
+            except CircuitOpenError:
+                # the replica's breaker is already open: not a new failure
+                if last_chance:
+                    raise
+                continue
+            except Exception:
+                healthy = False
+                if last_chance:
+                    raise
+                continue
+            finally:
+                self.release(url, healthy, time.monotonic() - start)
+            if healthy or last_chance:
+                return result
+
+    async def acall(
+        self,
+        factory: Callable[[str], Awaitable[T]],
+        is_failure: Callable[[T], bool] = _never_fails,
+    ) -> T:
+        """Async version of `call`."""
+        tried: List[str] = []
+        while True:
+            url = self.pick(exclude=tried)
+            tried.append(url)
+            last_chance = len(tried) >= len(self.replicas)
+            start = time.monotonic()
+            healthy = None
+            try:
+                result = await factory(url)
+                healthy = not is_failure(result)
+            except CircuitOpenError:
+                # the replica's breaker is already open: not a new failure
+                if last_chance:
+                    raise
+                continue
+            except Exception:
+                healthy = False
+                if last_chance:
+                    raise
+                continue
+            finally:
+                self.release(url, healthy, time.monotonic() - start)
+            if healthy or last_chance:
+                return result
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            now = time.monotonic()
+            return {
+                "strategy": self.strategy,
+                "replicas": {r.url: r.stats(now) for r in self.replicas},
+            }
+
+
+_balancers: Registry[LoadBalancer] = Registry()
+
+
+def get_load_balancer(
+    base_urls: Sequence[str], path: str, **settings: Any
+) -> LoadBalancer:
+    """Return the balancer shared by every client of `path` on `base_urls`."""
+    return _balancers.get(
+        (tuple(base_urls), path), lambda: LoadBalancer(base_urls, **settings)
+    )
+
+
+def load_balancer_stats() -> Dict[str, Dict[str, Any]]:
+    """Replica state of every balancer, keyed by endpoint group."""
+    return {
+        endpoint_group(urls, path): balancer.stats()
+        for (urls, path), balancer in _balancers.items()
+    }
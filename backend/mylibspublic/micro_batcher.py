@@ -0,0 +1,112 @@
+"""Collect concurrent single-item calls into one batched call.
+
+`MicroBatcher.call(item)` blocks until `fn` has processed `item` as part of
+a batch. The first caller of a batch waits up to `max_wait` seconds for more
+callers to join. Whoever completes the batch — the caller that fills it to
+`max_batch_size`, or the first caller once the wait is over — runs `fn` on
+all items and hands each caller its own result. No background thread is
+involved, and batches that are closed run concurrently.
+"""
+
+import threading
+import time
+from collections import Counter
+from concurrent.futures import Future
+from typing import Any, Callable, Dict, Generic, Hashable, List, Tuple, TypeVar
+
+from .registry import Registry
+
+T = TypeVar("T")
+R = TypeVar("R")
+
+
+class MicroBatcher(Generic[T, R]):
+    def __init__(
+        self,
+        fn: Callable[[List[T]], List[R]],
+        max_batch_size: int = 16,
+        max_wait: float = 0.005,
+    ):
+        self.fn = fn
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait = max_wait
+        self._pending: List[Tuple[T, Future]] = []
+        self._cond = threading.Condition()
+        self._counters: Counter = Counter()
+
+    def call(self, item: T) -> R:
+        future: Future = Future()
+        with self._cond:
+            batch = self._pending
+            batch.append((item, future))
+            if len(batch) >= self.max_batch_size:
+                self._pending = []
+                self._cond.notify_all()
+                run = True
+            elif len(batch) == 1:
+                # first caller: wait for the batch to fill or the time to pass
+                deadline = time.monotonic() + self.max_wait
+                while self._pending is batch:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._cond.wait(remaining)
+                run = self._pending is batch
+                if run:
+                    self._pending = []
+            else:
+                run = False
+
+        if run:
+            self._run(batch)
+        return future.result()
+
+    def _run(self, batch: List[Tuple[T, Future]]) -> None:
+        with self._cond:
+            self._counters["batches"] += 1
+            self._counters["items"] += len(batch)
+        try:
+            results = self.fn([item for item, _ in batch])
+            if len(results) != len(batch):
+                raise ValueError(
+                    f"batched call returned {len(results)} results "
+                    f"for {len(batch)} items"
+                )
+        except BaseException as e:
+            for _, future in batch:
+                future.set_exception(e)
+            if not isinstance(e, Exception):
+                raise
+            return
+        for (_, future), result in zip(batch, results):
+            future.set_result(result)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._cond:
+            batches = self._counters["batches"]
+            items = self._counters["items"]
+            return {
+                "batches": batches,
+                "items": items,
+                "mean_batch_size": items / batches if batches else 0.0,
+                "pending": len(self._pending),
+            }
+
+
+_batchers: Registry[MicroBatcher] = Registry()
+
+
+def get_micro_batcher(
+    key: Hashable, fn: Callable[[List[Any]], List[Any]], **settings: Any
+) -> MicroBatcher:
+    """Return the process wide batcher for `key`.
+
+    `fn` only applies when the batcher is first created, so every caller
+    sharing a key must batch the same kind of call.
+    """
+    return _batchers.get(key, lambda: MicroBatcher(fn, **settings))
+
+
+def micro_batch_stats() -> Dict[str, Dict[str, Any]]:
+    """Batch counts and sizes of every batcher, keyed by its key."""
+    return {str(key): batcher.stats() for key, batcher in _batchers.items()}
@@ -0,0 +1,148 @@
+"""MinHash signatures with LSH banding for near-duplicate text lookup.
+
+Texts are reduced to sets of character shingles: bigrams inside CJK runs,
+where a single character already carries a word's meaning, and trigrams
+elsewhere, so a changed date, number or name only touches a few shingles.
+Each set is summarized by a MinHash signature whose bands are hashed into
+buckets; texts sharing a bucket with the query are candidates, ranked by
+the share of equal signature values. A lookup touches a handful of buckets
+rather than every stored text; the caller confirms a match by the exact
+Jaccard similarity of the few best candidates.
+"""
+
+import re
+import zlib
+from typing import Dict, FrozenSet, Hashable, List, Optional, Set, Tuple
+
+import numpy as np
+
+from .embedding_cache import normalize_text
+
+# largest prime below 2**32: a * h + b stays below 2**64 for 32-bit a, b, h
+_PRIME = np.uint64(4294967291)
+
+# kana, CJK ideographs (with extension A and compatibility forms), hangul
+_CJK = re.compile(
+    r"[\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff\uac00-\ud7af]+"
+)
+
+
+def _ngrams(text: str, n: int) -> List[str]:
+    text = text.strip()
+    if len(text) <= n:
+        return [text] if text else []
+    return [text[i : i + n] for i in range(len(text) - n + 1)]
+
+
+def shingles(text: str) -> FrozenSet[str]:
+    """Character shingles of `text`: bigrams for CJK runs, trigrams otherwise."""
+    text = normalize_text(text).lower()
+    grams: Set[str] = set()
+    position = 0
+    for match in _CJK.finditer(text):
+        grams.update(_ngrams(text[position : match.start()], 3))
+        grams.update(_ngrams(match.group(0), 2))
+        position = match.end()
+    grams.update(_ngrams(text[position:], 3))
+    return frozenset(grams)
+
+
+def jaccard(a: FrozenSet[str], b: FrozenSet[str]) -> float:
+    if not a and not b:
+        return 1.0
+    return len(a & b) / len(a | b)
+
+
+class MinHashIndex:
+    """In-memory LSH index of MinHash signatures.
+
+    Only each text's signature is kept, `num_perm` 32-bit values, so callers
+    verify the returned candidates against the texts themselves. With the
+    default 16 bands of 4 rows, texts at 0.8 similarity become candidates
+    with a probability above 99.9%. Once `max_entries` texts are indexed,
+    the earliest added are dropped first.
+    """
+
+    def __init__(
+        self,
+        num_perm: int = 64,
+        bands: int = 16,
+        seed: int = 1,
+        max_entries: Optional[int] = None,
+    ):
+        if num_perm % bands:
+            raise ValueError("num_perm must be a multiple of bands")
+        rng = np.random.default_rng(seed)
+        self.bands = bands
+        self.max_entries = max_entries
+        self._rows = num_perm // bands
+        self._a = rng.integers(1, int(_PRIME), num_perm, dtype=np.uint64)
+        self._b = rng.integers(0, int(_PRIME), num_perm, dtype=np.uint64)
+        self._buckets: List[Dict[bytes, Set[Hashable]]] = [{} for _ in range(bands)]
+        self._signatures: Dict[Hashable, np.ndarray] = {}
+
+    def __len__(self) -> int:
+        return len(self._signatures)
+
+    def signature(self, grams: FrozenSet[str]) -> np.ndarray:
+        hashes = np.fromiter(
+            (zlib.crc32(gram.encode("utf8")) for gram in grams),
+            dtype=np.uint64,
+            count=len(grams),
+        )
+        minima = ((np.outer(hashes, self._a) + self._b) % _PRIME).min(axis=0)
+        # every value is below _PRIME, so 32 bits hold it
+        return minima.astype(np.uint32)
+
+    def _bands(self, signature: np.ndarray) -> List[bytes]:
+        return [
+            signature[band * self._rows : (band + 1) * self._rows].tobytes()
+            for band in range(self.bands)
+        ]
+
+    def add(self, key: Hashable, text: str) -> None:
+        grams = shingles(text)
+        if not grams or key in self._signatures:
+            return
+        if self.max_entries is not None and len(self._signatures) >= self.max_entries:
+            self.discard(next(iter(self._signatures)))
+        signature = self.signature(grams)
+        self._signatures[key] = signature
+        for buckets, band in zip(self._buckets, self._bands(signature)):
+            buckets.setdefault(band, set()).add(key)
+
+    def discard(self, key: Hashable) -> None:
+        signature = self._signatures.pop(key, None)
+        if signature is None:
+            return
+        for buckets, band in zip(self._buckets, self._bands(signature)):
+            keys = buckets[band]
+            keys.discard(key)
+            if not keys:
+                del buckets[band]
+
+    def candidates(
+        self, grams: FrozenSet[str], min_similarity: float = 0.0, limit: int = 8
+    ) -> List[Tuple[Hashable, float]]:
+        """Indexed keys sharing a band with `grams`, most similar first.
+
+        Similarities are MinHash estimates; keys estimated below
+        `min_similarity` are left out, and at most `limit` are returned.
+        """
+        if not grams or not self._signatures:
+            return []
+        signature = self.signature(grams)
+        keys: Set[Hashable] = set()
+        for buckets, band in zip(self._buckets, self._bands(signature)):
+            keys.update(buckets.get(band, ()))
+        if not keys:
+            return []
+        ordered = list(keys)
+        stacked = np.stack([self._signatures[key] for key in ordered])
+        similarities = (stacked == signature).mean(axis=1)
+        best = np.argsort(-similarities, kind="stable")[:limit]
+        return [
+            (ordered[i], float(similarities[i]))
+            for i in best
+            if similarities[i] >= min_similarity
+        ]
@@ -0,0 +1,357 @@
+"""Route generations to a fast model first and escalate when its answer fails.
+
+`FormosaCascadeModel` sends every prompt to `fast`. If any check rejects the
+answer, the prompt is sent again to `strong` and that answer is returned.
+A check is a callable `(source_text, text, generation_info) -> reason` that
+returns None when the answer is acceptable. `source_text` is the text being
+translated or answered, when the caller passes it.
+
+Each generation's `generation_info["routing"]` records the model that
+answered, whether it escalated, and why.
+"""
+
+import re
+import threading
+from collections import Counter
+from typing import (
+    Any,
+    AsyncIterator,
+    Callable,
+    Dict,
+    Iterator,
+    List,
+    Mapping,
+    Optional,
+    Sequence,
+)
+
+from langchain.callbacks.manager import (
+    AsyncCallbackManagerForLLMRun,
+    CallbackManagerForLLMRun,
+)
+from langchain.llms.base import BaseLLM
+from langchain.schema import Generation, LLMResult
+from langchain.schema.output import GenerationChunk
+from pydantic import Field
+
+from .FormosaFoundationModel2 import FormosaFoundationModel
+from .token_budget import expansion_ratio, is_cjk_language
+from .token_estimator import estimate_tokens
+
+Check = Callable[[Optional[str], str, Dict[str, Any]], Optional[str]]
+
+_CJK_CHAR = re.compile(r"[\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uac00-\ud7af]")
+_LATIN_WORD = re.compile(r"[A-Za-z\u00c0-\u024f]+")
+
+
+def empty(
+    source_text: Optional[str], text: str, info: Dict[str, Any]
+) -> Optional[str]:
+    return "empty" if not text.strip() else None
+
+
+def truncated(
+    source_text: Optional[str], text: str, info: Dict[str, Any]
+) -> Optional[str]:
+    return "truncated" if info.get("finish_reason") == "length" else None
+
+
+def length_ratio(
+    min_ratio: float = 0.1, max_ratio: float = 5.0, min_source_chars: int = 20
+) -> Check:
+    """Reject answers whose length is implausible relative to the source."""
+
+    def check(
+        source_text: Optional[str], text: str, info: Dict[str, Any]
+    ) -> Optional[str]:
+        if not source_text or len(source_text) < min_source_chars:
+            return None
+        ratio = len(text.strip()) / len(source_text)
+        if ratio < min_ratio or ratio > max_ratio:
+            return "length_ratio"
+        return None
+
+    return check
+
+
+def target_language(language: str, min_share: float = 0.5) -> Check:
+    """Reject answers mostly written in the wrong script for `language`.
+
+    CJK characters and Latin words are counted as one unit each, so a Chinese
+    answer quoting a few English terms still passes.
+    """
+    expect_cjk = is_cjk_language(language)
+
+    def check(
+        source_text: Optional[str], text: str, info: Dict[str, Any]
+    ) -> Optional[str]:
+        cjk = len(_CJK_CHAR.findall(text))
+        latin = len(_LATIN_WORD.findall(text))
+        if cjk + latin == 0:
+            return None
+        share = (cjk if expect_cjk else latin) / (cjk + latin)
+        return "wrong_language" if share < min_share else None
+
+    return check
+
+
+def expected_length(
+    source_lang: str,
+    target_lang: str,
+    tolerance: float = 2.0,
+    min_source_tokens: int = 8,
+) -> Check:
+    """Reject answers whose token count strays from the expected expansion.
+
+    The expected length is the source's estimated tokens times the expansion
+    ratio between the two languages; answers more than `tolerance` times
+    shorter or longer than that are rejected.
+    """
+    ratio = expansion_ratio(source_lang, target_lang)
+
+    def check(
+        source_text: Optional[str], text: str, info: Dict[str, Any]
+    ) -> Optional[str]:
+        source_tokens = estimate_tokens(source_text or "")
+        if source_tokens < min_source_tokens:
+            return None
+        observed = estimate_tokens(text) / (source_tokens * ratio)
+        if observed < 1 / tolerance or observed > tolerance:
+            return "length_ratio"
+        return None
+
+    return check
+
+
+def source_residue(source_lang: str, target_lang: str, max_share: float = 0.2) -> Check:
+    """Reject answers that leave part of the source untranslated.
+
+    Between a CJK and a non-CJK language, more than `max_share` of the
+    answer's units (CJK characters and Latin words) in the source script
+    counts as residue. Within the same script only an answer that repeats
+    the source verbatim is rejected.
+    """
+    source_cjk = is_cjk_language(source_lang)
+    same_script = source_cjk == is_cjk_language(target_lang)
+
+    def check(
+        source_text: Optional[str], text: str, info: Dict[str, Any]
+    ) -> Optional[str]:
+        if same_script:
+            copied = bool(source_text) and " ".join(text.split()) == " ".join(
+                source_text.split()
+            )
+            return "source_residue" if copied else None
+        cjk = len(_CJK_CHAR.findall(text))
+        latin = len(_LATIN_WORD.findall(text))
+        if cjk + latin == 0:
+            return None
+        share = (cjk if source_cjk else latin) / (cjk + latin)
+        return "source_residue" if share > max_share else None
+
+    return check
+
+
+DEFAULT_CHECKS: Sequence[Check] = (empty, truncated)
+
+
+def translation_checks(target_lang: Optional[str] = None) -> List[Check]:
+    """Checks for a translation of a known source text into `target_lang`."""
+    checks = [*DEFAULT_CHECKS, length_ratio()]
+    if target_lang:
+        checks.append(target_language(target_lang))
+    return checks
+
+
+def reflection_checks(source_lang: str, target_lang: str) -> List[Check]:
+    """Checks that send a first-pass translation on to reflection."""
+    return [
+        *DEFAULT_CHECKS,
+        expected_length(source_lang, target_lang),
+        source_residue(source_lang, target_lang),
+    ]
+
+
+def routing_decision(llm: BaseLLM, generation: Generation) -> Dict[str, Any]:
+    """The routing record of `generation`, also for non-cascading models."""
+    info = generation.generation_info or {}
+    if "routing" in info:
+        return info["routing"]
+    return {"model": getattr(llm, "model", None), "escalated": False, "reasons": []}
+
+
+_counters: Dict[str, Counter] = {}
+_lock = threading.Lock()
+
+
+def _record(route: str, reasons: List[str]) -> None:
+    with _lock:
+        counter = _counters.setdefault(route, Counter())
+        counter["calls"] += 1
+        if reasons:
+            counter["escalated"] += 1
+            counter.update(f"reason:{reason}" for reason in reasons)
+
+
+def cascade_stats() -> Dict[str, Dict[str, int]]:
+    """Call and escalation counts of every cascade, keyed by `fast->strong`."""
+    with _lock:
+        return {route: dict(counter) for route, counter in _counters.items()}
+
+
+class FormosaCascadeModel(BaseLLM):
+    """Fast-then-strong model cascade.
+
+    Example:
+        .. code-block:: python
+
+            llm = FormosaCascadeModel(fast=small_ffm, strong=large_ffm)
+            checks = translation_checks("Chinese")
+            llm.invoke(prompt, source_text=text, checks=checks)
+    """
+
+    fast: FormosaFoundationModel
+    """Model every prompt is sent to first."""
+
+    strong: FormosaFoundationModel
+    """Model answering the prompts whose fast answer failed a check."""
+
+    checks: List[Check] = Field(default_factory=lambda: list(DEFAULT_CHECKS))
+    """Default checks; a call may pass `checks=` to override them."""
+
+    @property
+    def _llm_type(self) -> str:
+        return "FormosaCascadeModel"
+
+    @property
+    def _identifying_params(self) -> Mapping[str, Any]:
+        return {"fast": self.fast.model, "strong": self.strong.model}
+
+    @property
+    def _route(self) -> str:
+        return f"{self.fast.model}->{self.strong.model}"
+
+    def _failed_checks(
+        self,
+        checks: Sequence[Check],
+        source_text: Optional[str],
+        generation: Generation,
+    ) -> List[str]:
+        info = generation.generation_info or {}
+        reasons = []
+        for check in checks:
+            reason = check(source_text, generation.text, info)
+            if reason is not None:
+                reasons.append(reason)
+        return reasons
+
+    def _escalations(
+        self, first: LLMResult, checks: Sequence[Check], source_text: Optional[str]
+    ) -> Dict[int, List[str]]:
+        """Indices of the prompts whose fast answer failed, with the reasons."""
+        escalations = {}
+        for index, generations in enumerate(first.generations):
+            reasons = self._failed_checks(checks, source_text, generations[0])
+            if reasons:
+                escalations[index] = reasons
+        return escalations
+
+    def _merge(
+        self,
+        first: LLMResult,
+        escalations: Dict[int, List[str]],
+        second: Optional[LLMResult],
+    ) -> LLMResult:
+        generations = [list(g) for g in first.generations]
+        token_usage = first.llm_output["token_usage"]
+        if second is not None:
+            token_usage += second.llm_output["token_usage"]
+            for index, replacement in zip(escalations, second.generations):
+                generations[index] = list(replacement)
+
+        for index, candidates in enumerate(generations):
+            reasons = escalations.get(index, [])
+            routing = {
+                "model": self.strong.model if reasons else self.fast.model,
+                "escalated": bool(reasons),
+                "reasons": reasons,
+            }
+            for generation in candidates:
+                generation.generation_info = {
+                    **(generation.generation_info or {}),
+                    "routing": routing,
+                }
+            _record(self._route, reasons)
+
+        llm_output = {
+            "token_usage": token_usage,
+            "model": self._route,
+            "escalated": len(escalations),
+        }
+        return LLMResult(generations=generations, llm_output=llm_output)
+
+    def _generate(
+        self,
+        prompts: List[str],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[CallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> LLMResult:
+        source_text = kwargs.pop("source_text", None)
+        checks = kwargs.pop("checks", None) or self.checks
+
+        first = self.fast._generate(prompts, stop=stop, **kwargs)
+        escalations = self._escalations(first, checks, source_text)
+        second = None
+        if escalations:
+            retry = [prompts[index] for index in escalations]
+            second = self.strong._generate(retry, stop=stop, **kwargs)
+        return self._merge(first, escalations, second)
+
+    async def _agenerate(
+        self,
+        prompts: List[str],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[AsyncCallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> LLMResult:
+        source_text = kwargs.pop("source_text", None)
+        checks = kwargs.pop("checks", None) or self.checks
+
+        first = await self.fast._agenerate(prompts, stop=stop, **kwargs)
+        escalations = self._escalations(first, checks, source_text)
+        second = None
+        if escalations:
+            retry = [prompts[index] for index in escalations]
+            second = await self.strong._agenerate(retry, stop=stop, **kwargs)
+        return self._merge(first, escalations, second)
+
+    # Streamed tokens cannot be taken back, so streaming skips the cascade and
+    # goes straight to the strong model.
+
+    def _stream(
+        self,
+        prompt: str,
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[CallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> Iterator[GenerationChunk]:
+        kwargs.pop("source_text", None)
+        kwargs.pop("checks", None)
+        yield from self.strong._stream(
+            prompt, stop=stop, run_manager=run_manager, **kwargs
+        )
+
+    async def _astream(
+        self,
+        prompt: str,
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[AsyncCallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> AsyncIterator[GenerationChunk]:
+        kwargs.pop("source_text", None)
+        kwargs.pop("checks", None)
+        async for chunk in self.strong._astream(
+            prompt, stop=stop, run_manager=run_manager, **kwargs
+        ):
+            yield chunk
@@ -0,0 +1,370 @@
+"""Client side rate limiting and adaptive concurrency for the FFM endpoints.
+
+One `AdaptiveRateLimiter` is shared by every client calling the same
+endpoint url (generation and embeddings are limited separately). It combines:
+
+* token buckets for requests per second and tokens per minute, and
+* an AIMD concurrency window that halves on 429/5xx, timeouts or rising
+  latency and grows by roughly one slot per round trip while the endpoint
+  is healthy.
+
+Latency is only a load signal when response time does not depend on the
+output; generate calls pass `latency_signal=False` so long generations do
+not shrink the window. `Retry-After` headers pause all callers of the
+endpoint until the server says it is ready again, up to `MAX_RETRY_AFTER`.
+Once the retries are used up the call raises `OverloadedError`.
+"""
+
+import asyncio
+import email.utils
+import random
+import threading
+import time
+from typing import Any, Callable, Dict, Optional
+
+import httpx
+import requests
+
+from .registry import Registry
+
+RETRYABLE_STATUS = (429, 503)
+"""Status codes that signal the endpoint is overloaded and are retried."""
+
+MAX_RETRY_AFTER = 60.0
+"""Longest pause or backoff honoured for a `Retry-After` header, in seconds."""
+
+_POLL_INTERVAL = 0.02
+
+
+class OverloadedError(RuntimeError):
+    """Raised when an endpoint still answers 429/503 after every retry."""
+
+    def __init__(self, endpoint_url: str, status_code: int, retry_after: float):
+        super().__init__(
+            f"Inference endpoint {endpoint_url} is overloaded "
+            f"(status code {status_code}), retry in {retry_after:.0f}s"
+        )
+        self.endpoint_url = endpoint_url
+        self.status_code = status_code
+        self.retry_after = retry_after
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """Convert a Retry-After header (seconds or HTTP date) into seconds."""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        retry_at = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(0.0, retry_at.timestamp() - time.time())
+
+
+class TokenBucket:
+    """Classic token bucket. Not thread safe; guarded by the owning limiter."""
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float) -> None:
+        refill = (now - self.updated) * self.rate
+        self.tokens = min(self.capacity, self.tokens + refill)
+        self.updated = now
+
+    def wait_time(self, amount: float, now: float) -> float:
+        """Seconds until `amount` tokens are available (0 if available now)."""
+        self._refill(now)
+        amount = min(amount, self.capacity)
+        if self.tokens >= amount:
+            return 0.0
+        return (amount - self.tokens) / self.rate
+
+    def take(self, amount: float) -> None:
+        self.tokens -= min(amount, self.capacity)
+
+
+class AdaptiveRateLimiter:
+    """Token buckets plus an AIMD concurrency window for one endpoint."""
+
+    def __init__(
+        self,
+        requests_per_second: Optional[float] = None,
+        tokens_per_minute: Optional[float] = None,
+        initial_concurrency: int = 4,
+        min_concurrency: int = 1,
+        max_concurrency: int = 32,
+        latency_tolerance: float = 2.0,
+        backoff_ratio: float = 0.5,
+        min_latency_samples: int = 20,
+    ):
+        self._request_bucket = (
+            TokenBucket(requests_per_second, max(1.0, requests_per_second))
+            if requests_per_second
+            else None
+        )
+        self._token_bucket = (
+            TokenBucket(tokens_per_minute / 60.0, tokens_per_minute)
+            if tokens_per_minute
+            else None
+        )
+        self.min_concurrency = min_concurrency
+        self.max_concurrency = max(min_concurrency, max_concurrency)
+        self.limit = float(
+            min(self.max_concurrency, max(min_concurrency, initial_concurrency))
+        )
+        self.latency_tolerance = latency_tolerance
+        self.backoff_ratio = backoff_ratio
+        self.min_latency_samples = min_latency_samples
+
+        self.in_flight = 0
+        self._paused_until = 0.0
+        self._last_decrease = 0.0
+        self._latency_samples = 0
+        self._short_latency: Optional[float] = None
+        self._long_latency: Optional[float] = None
+        self._counters = {"acquired": 0, "overloaded": 0, "decreased": 0}
+        self._cond = threading.Condition()
+
+    def _try_acquire(self, tokens: float) -> float:
+        """Take a slot and budget if possible; otherwise return seconds to wait."""
+        now = time.monotonic()
+        if now < self._paused_until:
+            return self._paused_until - now
+        if self.in_flight >= int(self.limit):
+            return _POLL_INTERVAL
+        wait = 0.0
+        if self._request_bucket is not None:
+            wait = max(wait, self._request_bucket.wait_time(1, now))
+        if self._token_bucket is not None and tokens:
+            wait = max(wait, self._token_bucket.wait_time(tokens, now))
+        if wait > 0:
+            return wait
+        if self._request_bucket is not None:
+            self._request_bucket.take(1)
+        if self._token_bucket is not None and tokens:
+            self._token_bucket.take(tokens)
+        self.in_flight += 1
+        self._counters["acquired"] += 1
+        return 0.0
+
+    def acquire(self, tokens: float = 0) -> None:
+        """Block the calling thread until a request may be sent."""
+        with self._cond:
+            while True:
+                wait = self._try_acquire(tokens)
+                if wait <= 0:
+                    return
+                self._cond.wait(timeout=wait)
+
+    async def aacquire(self, tokens: float = 0) -> None:
+        """Wait, without blocking the event loop, until a request may be sent."""
+        while True:
+            with self._cond:
+                wait = self._try_acquire(tokens)
+            if wait <= 0:
+                return
+            await asyncio.sleep(wait)
+
+    def release(
+        self,
+        latency: Optional[float] = None,
+        overloaded: bool = False,
+        retry_after: Optional[float] = None,
+        succeeded: bool = False,
+    ) -> None:
+        """Return a slot and feed the outcome back into the AIMD window.
+
+        `latency` is observed as a load signal; `succeeded` without a latency
+        counts a healthy round trip whose duration says nothing about load.
+        """
+        with self._cond:
+            self.in_flight = max(0, self.in_flight - 1)
+            now = time.monotonic()
+            if overloaded:
+                self._counters["overloaded"] += 1
+                self._decrease(now)
+                if retry_after:
+                    pause = min(retry_after, MAX_RETRY_AFTER)
+                    self._paused_until = max(self._paused_until, now + pause)
+            elif latency is not None:
+                self._observe_latency(latency, now)
+            elif succeeded:
+                self._increase()
+            self._cond.notify_all()
+
+    def _increase(self) -> None:
+        # additive increase: about one extra slot per window of round trips
+        self.limit = min(self.max_concurrency, self.limit + 1.0 / self.limit)
+
+    def _observe_latency(self, latency: float, now: float) -> None:
+        self._latency_samples += 1
+        if self._short_latency is None:
+            self._short_latency = self._long_latency = latency
+        else:
+            self._short_latency += 0.2 * (latency - self._short_latency)
+            self._long_latency += 0.02 * (latency - self._long_latency)
+
+        # the long term baseline is meaningless until enough samples arrived
+        warmed_up = self._latency_samples >= self.min_latency_samples
+        if warmed_up and (
+            self._short_latency > self._long_latency * self.latency_tolerance
+        ):
+            self._decrease(now)
+        else:
+            self._increase()
+
+    def _decrease(self, now: float) -> None:
+        # back off at most once per observed round trip so a burst of
+        # failures from the same window does not collapse the limit to 1
+        cooldown = max(self._short_latency or 0.0, 0.5)
+        if now - self._last_decrease < cooldown:
+            return
+        self._last_decrease = now
+        self._counters["decreased"] += 1
+        self.limit = max(self.min_concurrency, self.limit * self.backoff_ratio)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._cond:
+            return {
+                "limit": round(self.limit, 2),
+                "in_flight": self.in_flight,
+                "paused_for": max(0.0, self._paused_until - time.monotonic()),
+                "latency_ewma": self._short_latency,
+                **self._counters,
+            }
+
+
+_limiters: Registry[AdaptiveRateLimiter] = Registry()
+
+
+def get_rate_limiter(endpoint_url: str, **settings: Any) -> AdaptiveRateLimiter:
+    """Return the limiter shared by every client of `endpoint_url`."""
+    return _limiters.get(
+        endpoint_url.rstrip("/"), lambda: AdaptiveRateLimiter(**settings)
+    )
+
+
+def limiter_stats() -> Dict[str, Dict[str, Any]]:
+    """Snapshot of every endpoint limiter, keyed by endpoint url."""
+    return {url: limiter.stats() for url, limiter in _limiters.items()}
+
+
+def retry_delay(attempt: int, retry_after: Optional[float]) -> float:
+    """Seconds to wait before retry `attempt`, honouring a Retry-After."""
+    if retry_after is not None:
+        return min(retry_after, MAX_RETRY_AFTER)
+    return min(30.0, 0.5 * 2**attempt) * (0.5 + random.random() / 2)
+
+
+def _release_response(
+    limiter: AdaptiveRateLimiter,
+    status_code: int,
+    latency: float,
+    latency_signal: bool,
+) -> None:
+    """Release the slot of a request that is not retried."""
+    if status_code >= 500:
+        # server errors signal load even when they are not worth retrying
+        limiter.release(overloaded=True)
+    elif latency_signal:
+        limiter.release(latency=latency)
+    else:
+        limiter.release(succeeded=True)
+
+
+def limited_post(
+    session: requests.Session,
+    limiter: AdaptiveRateLimiter,
+    url: str,
+    tokens: float = 0,
+    max_retries: int = 3,
+    latency_signal: bool = True,
+    on_latency: Optional[Callable[[float], None]] = None,
+    **kwargs: Any,
+) -> requests.Response:
+    """POST through `limiter`, retrying 429/503 with backoff and Retry-After.
+
+    Raises `OverloadedError` when the endpoint is still overloaded after
+    `max_retries` retries.
+
+    Pass `latency_signal=False` when the response time depends on the output
+    length (text generation), so only errors and timeouts shrink the window.
+    `on_latency` is called with the time the returned request took upstream
+    when it succeeded, without the waits for the limiter or retry backoff.
+    """
+    attempt = 0
+    while True:
+        limiter.acquire(tokens)
+        start = time.monotonic()
+        try:
+            response = session.post(url, **kwargs)
+        except requests.exceptions.Timeout:
+            limiter.release(overloaded=True)
+            raise
+        except BaseException:
+            limiter.release()
+            raise
+
+        if response.status_code not in RETRYABLE_STATUS:
+            latency = time.monotonic() - start
+            _release_response(limiter, response.status_code, latency, latency_signal)
+            if on_latency is not None and response.status_code < 400:
+                on_latency(latency)
+            return response
+
+        retry_after = parse_retry_after(response.headers.get("Retry-After"))
+        limiter.release(overloaded=True, retry_after=retry_after)
+        delay = retry_delay(attempt, retry_after)
+        response.close()
+        if attempt >= max_retries:
+            raise OverloadedError(url, response.status_code, delay)
+        time.sleep(delay)
+        attempt += 1
+
+
+async def alimited_post(
+    client: httpx.AsyncClient,
+    limiter: AdaptiveRateLimiter,
+    url: str,
+    tokens: float = 0,
+    max_retries: int = 3,
+    latency_signal: bool = True,
+    on_latency: Optional[Callable[[float], None]] = None,
+    **kwargs: Any,
+) -> httpx.Response:
+    """Async counterpart of `limited_post`."""
+    attempt = 0
+    while True:
+        await limiter.aacquire(tokens)
+        start = time.monotonic()
+        try:
+            response = await client.post(url, **kwargs)
+        except httpx.TimeoutException:
+            limiter.release(overloaded=True)
+            raise
+        except BaseException:
+            limiter.release()
+            raise
+
+        if response.status_code not in RETRYABLE_STATUS:
+            latency = time.monotonic() - start
+            _release_response(limiter, response.status_code, latency, latency_signal)
+            if on_latency is not None and response.status_code < 400:
+                on_latency(latency)
+            return response
+
+        retry_after = parse_retry_after(response.headers.get("Retry-After"))
+        limiter.release(overloaded=True, retry_after=retry_after)
+        delay = retry_delay(attempt, retry_after)
+        await response.aclose()
+        if attempt >= max_retries:
+            raise OverloadedError(url, response.status_code, delay)
+        await asyncio.sleep(delay)
+        attempt += 1
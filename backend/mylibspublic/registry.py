@@ -0,0 +1,41 @@
+"""Process wide instances shared by every client of the same key.
+
+Rate limiters, circuit breakers, hedge policies, load balancers, batchers and
+caches hold state that must be shared per endpoint or per file, whichever
+client instance happens to use it. A `Registry` creates each instance on the
+first request for its key and hands out the same one afterwards.
+"""
+
+import threading
+from typing import Callable, Dict, Generic, Hashable, List, Tuple, TypeVar
+
+T = TypeVar("T")
+
+
+class Registry(Generic[T]):
+    """Thread safe map from key to a lazily created shared instance."""
+
+    def __init__(self) -> None:
+        self._instances: Dict[Hashable, T] = {}
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable, create: Callable[[], T]) -> T:
+        """Return the instance for `key`, calling `create` if there is none.
+
+        Whatever `create` would configure only applies to the first caller;
+        later callers get the existing instance unchanged.
+        """
+        instance = self._instances.get(key)
+        if instance is not None:
+            return instance
+        with self._lock:
+            instance = self._instances.get(key)
+            if instance is None:
+                instance = create()
+                self._instances[key] = instance
+        return instance
+
+    def items(self) -> List[Tuple[Hashable, T]]:
+        """Snapshot of every (key, instance) pair created so far."""
+        with self._lock:
+            return list(self._instances.items())
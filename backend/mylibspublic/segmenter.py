@@ -0,0 +1,141 @@
+"""Split documents into token bounded chunks at natural boundaries.
+
+Text is cut at paragraph breaks first, then at sentence ends (Latin and
+CJK punctuation), and only a single sentence longer than the budget is cut
+mid-sentence. Each chunk keeps the whitespace that followed it, so joining
+`chunk + separator` for every chunk restores the original layout, and
+joining translated chunks the same way preserves paragraphs.
+"""
+
+import re
+from typing import List, NamedTuple
+
+from .token_estimator import estimate_tokens
+
+_PARAGRAPH_BREAK = re.compile(r"(\n[ \t]*\n\s*)")
+_SENTENCE_END = re.compile(r"(?<=[.!?;。！？；])(\s+)|(?<=[。！？；])()")
+
+
+class Chunk(NamedTuple):
+    text: str
+    """Chunk content, without surrounding whitespace."""
+    separator: str
+    """Whitespace that followed the chunk in the source."""
+
+
+def _split_keep(pattern: re.Pattern, text: str) -> List[Chunk]:
+    """Split `text` at `pattern`, pairing every piece with the match after it."""
+    pieces = []
+    start = 0
+    for match in pattern.finditer(text):
+        if match.start() == start and not match.group(0):
+            continue
+        pieces.append(Chunk(text[start : match.start()], match.group(0)))
+        start = match.end()
+    if start < len(text):
+        pieces.append(Chunk(text[start:], ""))
+    return pieces
+
+
+def _hard_split(sentence: Chunk, max_tokens: int) -> List[Chunk]:
+    """Cut an over-long sentence into roughly equal, budget sized parts."""
+    text = sentence.text
+    parts = -(-estimate_tokens(text) // max_tokens)
+    size = -(-len(text) // parts)
+    texts = []
+    start = 0
+    while start < len(text):
+        end = min(start + size, len(text))
+        if end < len(text):
+            # prefer cutting after a space over cutting inside a word
+            space = text.rfind(" ", start + size // 2, end)
+            if space != -1:
+                end = space + 1
+        texts.append(text[start:end])
+        start = end
+    return [Chunk(t, "") for t in texts[:-1]] + [Chunk(texts[-1], sentence.separator)]
+
+
+def _strip(chunks: List[Chunk]) -> List[Chunk]:
+    """Drop empty chunks and move surrounding whitespace into the separators.
+
+    Leading whitespace goes to the separator of the chunk before, so cuts
+    inside a sentence keep their spaces; before the first chunk it is lost.
+    """
+    stripped: List[Chunk] = []
+    for chunk in chunks:
+        text = chunk.text.strip()
+        start = len(chunk.text) - len(chunk.text.lstrip())
+        leading = chunk.text[:start] if text else chunk.text + chunk.separator
+        if leading and stripped:
+            previous = stripped[-1]
+            stripped[-1] = Chunk(previous.text, previous.separator + leading)
+        if text:
+            trailing = chunk.text[start + len(text) :]
+            stripped.append(Chunk(text, trailing + chunk.separator))
+    return stripped
+
+
+def split_paragraphs(text: str) -> List[Chunk]:
+    """Non-empty paragraphs of `text`, each with the whitespace that followed it."""
+    return _strip(_split_keep(_PARAGRAPH_BREAK, text))
+
+
+def ends_paragraph(chunk: Chunk) -> bool:
+    """Whether the whitespace after `chunk` is a paragraph break."""
+    return _PARAGRAPH_BREAK.search(chunk.separator) is not None
+
+
+def split_sentences(text: str) -> List[Chunk]:
+    """Sentences of `text`, each with the whitespace that followed it."""
+    sentences = []
+    for paragraph in _split_keep(_PARAGRAPH_BREAK, text):
+        parts = _split_keep(_SENTENCE_END, paragraph.text)
+        if parts:
+            last = parts[-1]
+            parts[-1] = Chunk(last.text, last.separator + paragraph.separator)
+        sentences.extend(parts)
+    return sentences
+
+
+def split_text(text: str, max_tokens: int) -> List[Chunk]:
+    """Pack the sentences of `text` into chunks of at most `max_tokens`.
+
+    Paragraph breaks close a chunk only when the next paragraph would not
+    fit, so short paragraphs are translated together with their context.
+    """
+    chunks: List[Chunk] = []
+    current: List[Chunk] = []
+    tokens = 0
+
+    def flush() -> None:
+        nonlocal current, tokens
+        if current:
+            body = "".join(s.text + s.separator for s in current[:-1])
+            body += current[-1].text
+            chunks.append(Chunk(body, current[-1].separator))
+        current, tokens = [], 0
+
+    for sentence in split_sentences(text):
+        if not sentence.text.strip():
+            if current:
+                last = current[-1]
+                current[-1] = Chunk(last.text, last.separator + sentence.text)
+            continue
+        count = estimate_tokens(sentence.text)
+        if count > max_tokens:
+            flush()
+            for part in _hard_split(sentence, max_tokens):
+                chunks.append(part)
+            continue
+        if tokens + count > max_tokens:
+            flush()
+        current.append(sentence)
+        tokens += count
+    flush()
+    return _strip(chunks)
+
+
+def join_chunks(texts: List[str], chunks: List[Chunk]) -> str:
+    """Reassemble processed `texts` with the separators of their `chunks`."""
+    return "".join(text + chunk.separator for text, chunk in zip(texts, chunks))
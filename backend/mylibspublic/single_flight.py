@@ -0,0 +1,84 @@
+"""Coalesce identical in-flight requests into a single upstream call.
+
+While a request for a key is running, any identical request waits for it
+and receives the same result (or exception) instead of calling the
+endpoint again. Nothing is kept once the call finishes; see
+`completion_cache` for persistence.
+"""
+
+import asyncio
+import hashlib
+import threading
+from concurrent.futures import Future
+from typing import Any, Awaitable, Callable, Dict, Tuple, TypeVar
+
+T = TypeVar("T")
+
+
+def request_key(endpoint_url: str, body: bytes) -> str:
+    """Identify a request by its endpoint and exact body."""
+    digest = hashlib.sha256(endpoint_url.encode("utf8"))
+    digest.update(b"\0")
+    digest.update(body)
+    return digest.hexdigest()
+
+
+class SingleFlight:
+    """Deduplicates concurrent calls that share a key."""
+
+    def __init__(self):
+        self._calls: Dict[str, Future] = {}
+        self._tasks: Dict[Tuple[int, str], asyncio.Future] = {}
+        self._lock = threading.Lock()
+        self.leaders = 0
+        self.shared = 0
+
+    def do(self, key: str, fn: Callable[[], T]) -> T:
+        """Run `fn` unless an identical call is in flight, then share its result."""
+        with self._lock:
+            future = self._calls.get(key)
+            leader = future is None
+            if leader:
+                future = Future()
+                self._calls[key] = future
+                self.leaders += 1
+            else:
+                self.shared += 1
+        if not leader:
+            return future.result()
+
+        try:
+            future.set_result(fn())
+        except BaseException as e:
+            future.set_exception(e)
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+        return future.result()
+
+    async def ado(self, key: str, factory: Callable[[], Awaitable[T]]) -> T:
+        """Async version of `do`; futures are tracked per event loop."""
+        task_key = (id(asyncio.get_running_loop()), key)
+        with self._lock:
+            task = self._tasks.get(task_key)
+            if task is not None:
+                self.shared += 1
+            else:
+                task = asyncio.ensure_future(factory())
+                self._tasks[task_key] = task
+                self.leaders += 1
+                task.add_done_callback(lambda _: self._tasks.pop(task_key, None))
+        # shield so one cancelled waiter does not cancel the shared call
+        return await asyncio.shield(task)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "in_flight": len(self._calls) + len(self._tasks),
+                "leaders": self.leaders,
+                "shared": self.shared,
+            }
+
+
+default_flight = SingleFlight()
+"""Group shared by the FFM generation and embedding clients."""
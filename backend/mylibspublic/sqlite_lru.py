@@ -0,0 +1,152 @@
+"""Base class of the disk backed caches: one SQLite table with LRU eviction.
+
+Every row has a `key` primary key, its `size` in bytes and the time it was
+last `accessed`. The store keeps running totals of the entry count and size,
+read once when the file is opened, so writes never scan the table; once
+either total exceeds its limit the least recently used rows are deleted
+through the index on `accessed`. Subclasses declare their table, columns
+and schema and encode their own values.
+"""
+
+import sqlite3
+import threading
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Sequence, Tuple
+
+# stay well below SQLite's limit on bound parameters
+_LOOKUP_CHUNK = 500
+
+
+class SQLiteLRUStore:
+    """SQLite table bounded by entry count and total size.
+
+    Subclasses set `_table`, `_columns` (in insert order, including `key`,
+    `size` and `accessed`) and `_schema`, the statements creating the table
+    and its indexes. Methods starting with an underscore expect the caller
+    to hold `_lock`.
+    """
+
+    _table: str
+    _columns: Tuple[str, ...]
+    _schema: Tuple[str, ...]
+
+    def __init__(self, path: str, max_entries: int, max_bytes: int):
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        self.path = path
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        self._size_column = self._columns.index("size")
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        with self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            for statement in self._schema:
+                self._conn.execute(statement)
+        self._count, self._bytes = self._conn.execute(
+            f"SELECT COUNT(*), COALESCE(SUM(size), 0) FROM {self._table}"
+        ).fetchone()
+
+    def _select(self, columns: str, keys: Iterable[str]) -> List[Tuple[Any, ...]]:
+        """`key` and `columns` of every stored row among `keys`."""
+        unique = list(dict.fromkeys(keys))
+        rows: List[Tuple[Any, ...]] = []
+        for start in range(0, len(unique), _LOOKUP_CHUNK):
+            chunk = unique[start : start + _LOOKUP_CHUNK]
+            marks = ",".join("?" * len(chunk))
+            rows.extend(
+                self._conn.execute(
+                    f"SELECT key, {columns} FROM {self._table} WHERE key IN ({marks})",
+                    chunk,
+                )
+            )
+        return rows
+
+    def _touch(self, keys: Iterable[str], now: float) -> None:
+        """Mark `keys` as used at `now`."""
+        with self._conn:
+            self._conn.executemany(
+                f"UPDATE {self._table} SET accessed = ? WHERE key = ?",
+                [(now, key) for key in keys],
+            )
+
+    def _count_lookups(self, hits: int, lookups: int) -> None:
+        self.hits += hits
+        self.misses += lookups - hits
+
+    def _insert(self, rows: Sequence[Tuple[Any, ...]]) -> None:
+        """Insert or replace `rows`, then evict down to the limits.
+
+        Run inside a transaction (`with self._conn`).
+        """
+        replaced: Dict[str, int] = dict(self._select("size", (r[0] for r in rows)))
+        columns = ", ".join(self._columns)
+        marks = ", ".join("?" * len(self._columns))
+        self._conn.executemany(
+            f"INSERT OR REPLACE INTO {self._table} ({columns}) VALUES ({marks})", rows
+        )
+        sizes = {row[0]: row[self._size_column] for row in rows}
+        self._count += len(sizes.keys() - replaced.keys())
+        self._bytes += sum(sizes.values()) - sum(replaced.values())
+        self._evict()
+
+    def _delete_where(self, condition: str, parameters: Sequence[Any]) -> int:
+        """Delete the rows matching `condition` and return how many there were."""
+        count, size = self._conn.execute(
+            f"SELECT COUNT(*), COALESCE(SUM(size), 0) FROM {self._table}"
+            f" WHERE {condition}",
+            parameters,
+        ).fetchone()
+        if count:
+            self._conn.execute(
+                f"DELETE FROM {self._table} WHERE {condition}", parameters
+            )
+            self._count -= count
+            self._bytes -= size
+        return count
+
+    def _evict(self) -> None:
+        while self._count > self.max_entries or self._bytes > self.max_bytes:
+            # enough of the least recently used rows to fix the entry count, or
+            # their average size worth of rows to fix the total size
+            excess = max(self._count - self.max_entries, 1)
+            if self._bytes > self.max_bytes:
+                average = max(self._bytes // max(self._count, 1), 1)
+                excess = max(excess, -(-(self._bytes - self.max_bytes) // average))
+            victims = self._conn.execute(
+                f"SELECT key, size FROM {self._table} ORDER BY accessed LIMIT ?",
+                (excess,),
+            ).fetchall()
+            if not victims:
+                self._count = self._bytes = 0
+                return
+            self._conn.executemany(
+                f"DELETE FROM {self._table} WHERE key = ?",
+                [(key,) for key, _ in victims],
+            )
+            self._count -= len(victims)
+            self._bytes -= sum(size for _, size in victims)
+            self.evictions += len(victims)
+            self._evicted([key for key, _ in victims])
+
+    def _evicted(self, keys: List[str]) -> None:
+        """Called with the keys of every batch of evicted rows."""
+
+    def clear(self) -> None:
+        with self._lock, self._conn:
+            self._conn.execute(f"DELETE FROM {self._table}")
+            self._count = self._bytes = 0
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": self._count,
+                "bytes": self._bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
@@ -0,0 +1,204 @@
+"""Structured, low-overhead logging for the backend and the FFM clients.
+
+Built on the standard `logging` module so third-party handlers keep working:
+
+* `get_logger(name)` returns a logger whose keyword arguments become
+  structured fields, e.g. `log.info("translated", chars=n, model=m)`.
+  Message arguments are formatted lazily, and nothing is formatted or
+  serialized for records below the configured level.
+* `TRACE` sits below DEBUG and is the only level at which payload bodies
+  (prompts, generated text, request bodies) are logged.
+* DEBUG and TRACE records can be sampled and rate limited per call site, so
+  enabling them under load does not flood stdout.
+* `JsonFormatter` writes one JSON object per line.
+
+`configure_logging()` installs all of it on the root logger, reading its
+defaults from `LOG_LEVEL`, `LOG_FORMAT`, `LOG_DEBUG_SAMPLE_RATE` and
+`LOG_DEBUG_PER_SECOND`.
+"""
+
+import json
+import logging
+import os
+import random
+import sys
+import threading
+import time
+from typing import Any, Dict, Optional, Tuple
+
+TRACE = 5
+"""Level below DEBUG for payload bodies."""
+
+logging.addLevelName(TRACE, "TRACE")
+
+_RECORD_KWARGS = ("exc_info", "stack_info", "stacklevel", "extra")
+
+# attributes every LogRecord has; anything else was passed through `extra`
+_STANDARD_ATTRS = frozenset(
+    vars(logging.LogRecord("", 0, "", 0, "", None, None)).keys()
+) | {"message", "asctime", "fields"}
+
+
+class StructuredLogger(logging.LoggerAdapter):
+    """Logger adapter that turns keyword arguments into structured fields."""
+
+    def __init__(self, logger: logging.Logger):
+        super().__init__(logger, {})
+
+    def process(
+        self, msg: Any, kwargs: Dict[str, Any]
+    ) -> Tuple[Any, Dict[str, Any]]:
+        fields = {k: kwargs.pop(k) for k in list(kwargs) if k not in _RECORD_KWARGS}
+        if fields:
+            extra = dict(kwargs.get("extra") or {})
+            extra["fields"] = {**extra.get("fields", {}), **fields}
+            kwargs["extra"] = extra
+        return msg, kwargs
+
+    def trace(self, msg: Any, *args: Any, **kwargs: Any) -> None:
+        """Log at TRACE level; use it for payload bodies only."""
+        if self.isEnabledFor(TRACE):
+            kwargs.setdefault("stacklevel", 2)
+            self.log(TRACE, msg, *args, **kwargs)
+
+
+def get_logger(name: str) -> StructuredLogger:
+    return StructuredLogger(logging.getLogger(name))
+
+
+class SamplingFilter(logging.Filter):
+    """Sample and rate limit records at or below `max_level`.
+
+    Each record passes with probability `sample_rate`, and at most
+    `per_second` records per call site (file and line) pass each second.
+    Records above `max_level` always pass. Suppressed records are counted
+    and the count is attached to the next record let through.
+    """
+
+    def __init__(
+        self,
+        sample_rate: float = 1.0,
+        per_second: Optional[float] = None,
+        max_level: int = logging.DEBUG,
+    ):
+        super().__init__()
+        self.sample_rate = sample_rate
+        self.per_second = per_second
+        self.max_level = max_level
+        self._windows: Dict[Tuple[str, int], list] = {}
+        self._lock = threading.Lock()
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno > self.max_level:
+            return True
+        if self.sample_rate < 1.0 and random.random() >= self.sample_rate:
+            return False
+        if self.per_second is None:
+            return True
+
+        site = (record.pathname, record.lineno)
+        now = int(time.monotonic())
+        with self._lock:
+            window = self._windows.setdefault(site, [now, 0, 0])
+            if window[0] != now:
+                suppressed = window[2]
+                window[:] = [now, 0, 0]
+                if suppressed:
+                    record.suppressed = suppressed
+            if window[1] >= self.per_second:
+                window[2] += 1
+                return False
+            window[1] += 1
+        return True
+
+
+class JsonFormatter(logging.Formatter):
+    """Format records as single-line JSON objects."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry: Dict[str, Any] = {
+            "ts": round(record.created, 3),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        entry.update(getattr(record, "fields", {}))
+        for key, value in vars(record).items():
+            if key not in _STANDARD_ATTRS:
+                entry[key] = value
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=_json_default)
+
+
+class TextFormatter(logging.Formatter):
+    """Human readable format with structured fields appended as key=value."""
+
+    def __init__(self):
+        super().__init__("%(asctime)s %(levelname)s %(name)s: %(message)s")
+
+    def format(self, record: logging.LogRecord) -> str:
+        line = super().format(record)
+        fields = getattr(record, "fields", None)
+        if fields:
+            line += " " + " ".join(f"{k}={_short(v)}" for k, v in fields.items())
+        return line
+
+
+def _json_default(value: Any) -> Any:
+    if isinstance(value, (bytes, bytearray)):
+        return value.decode("utf8", errors="replace")
+    if isinstance(value, (set, frozenset, tuple)):
+        return list(value)
+    return str(value)
+
+
+def _short(value: Any, limit: int = 200) -> str:
+    if isinstance(value, str):
+        text = value
+    else:
+        text = json.dumps(value, ensure_ascii=False, default=_json_default)
+    return text if len(text) <= limit else f"{text[:limit]}…"
+
+
+def _level(value: Any) -> int:
+    if isinstance(value, int):
+        return value
+    name = str(value).strip().upper()
+    if name.isdigit():
+        return int(name)
+    return TRACE if name == "TRACE" else logging.getLevelName(name)
+
+
+def configure_logging(
+    level: Any = None,
+    fmt: Optional[str] = None,
+    debug_sample_rate: Optional[float] = None,
+    debug_per_second: Optional[float] = None,
+    stream=None,
+) -> None:
+    """Install a single stderr handler on the root logger.
+
+    Arguments left as None are read from the environment: `LOG_LEVEL`
+    (default INFO), `LOG_FORMAT` ("json" or "text", default json),
+    `LOG_DEBUG_SAMPLE_RATE` (default 1.0) and `LOG_DEBUG_PER_SECOND`
+    (per call site, default 20, 0 disables the limit).
+    """
+    if level is None:
+        level = os.getenv("LOG_LEVEL", "INFO")
+    if fmt is None:
+        fmt = os.getenv("LOG_FORMAT", "json")
+    if debug_sample_rate is None:
+        debug_sample_rate = float(os.getenv("LOG_DEBUG_SAMPLE_RATE", "1.0"))
+    if debug_per_second is None:
+        debug_per_second = float(os.getenv("LOG_DEBUG_PER_SECOND", "20"))
+
+    handler = logging.StreamHandler(stream or sys.stderr)
+    handler.setFormatter(JsonFormatter() if fmt == "json" else TextFormatter())
+    handler.addFilter(SamplingFilter(debug_sample_rate, debug_per_second or None))
+
+    root = logging.getLogger()
+    for existing in list(root.handlers):
+        root.removeHandler(existing)
+    root.addHandler(handler)
+    root.setLevel(_level(level))
@@ -0,0 +1,62 @@
+"""Size generation budgets from the text being processed.
+
+A translation needs roughly as many output tokens as the source has,
+scaled by how much the target language expands in tokens. Reserving a
+fixed `max_new_tokens` either truncates long chunks or holds far more
+budget than short ones need.
+"""
+
+from typing import Optional
+
+from .token_estimator import estimate_tokens
+
+_CJK_LANGUAGE_NAMES = ("chinese", "japanese", "korean", "中文", "日文", "韓文")
+_CJK_LANGUAGE_CODES = ("zh", "ja", "ko")
+
+DEFAULT_MARGIN = 1.25
+DEFAULT_MIN_TOKENS = 64
+DEFAULT_MAX_TOKENS = 4096
+
+
+def is_cjk_language(language: str) -> bool:
+    language = language.strip().lower()
+    if language.split("-")[0] in _CJK_LANGUAGE_CODES:
+        return True
+    return any(language.startswith(name) for name in _CJK_LANGUAGE_NAMES)
+
+
+def expansion_ratio(
+    source_lang: Optional[str] = None, target_lang: Optional[str] = None
+) -> float:
+    """Expected target tokens per source token for a translation."""
+    if not source_lang or not target_lang:
+        return 1.2
+    source_cjk = is_cjk_language(source_lang)
+    target_cjk = is_cjk_language(target_lang)
+    if target_cjk and not source_cjk:
+        # CJK scripts spend about one token per character
+        return 1.6
+    if source_cjk and not target_cjk:
+        return 0.9
+    return 1.1
+
+
+def size_max_new_tokens(
+    source_text: str,
+    source_lang: Optional[str] = None,
+    target_lang: Optional[str] = None,
+    ratio: Optional[float] = None,
+    margin: float = DEFAULT_MARGIN,
+    min_tokens: int = DEFAULT_MIN_TOKENS,
+    max_tokens: int = DEFAULT_MAX_TOKENS,
+) -> int:
+    """`max_new_tokens` for producing the counterpart of `source_text`.
+
+    `ratio` overrides the language based expansion ratio; `margin` leaves
+    head room for estimation error. Generations that still hit the limit are
+    continued, see `FormosaFoundationModel.max_continuations`.
+    """
+    if ratio is None:
+        ratio = expansion_ratio(source_lang, target_lang)
+    budget = int(estimate_tokens(source_text) * ratio * margin)
+    return max(min_tokens, min(max_tokens, budget))
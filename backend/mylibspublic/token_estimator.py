@@ -0,0 +1,182 @@
+"""Token estimates for arbitrary text, calibrated from FFM token usage.
+
+Text is split into script classes (Han, kana, Hangul, Latin and other),
+each with its own characters-per-token ratio, so mixed Chinese/English text
+is estimated per run instead of by one global average. Every generate
+response reports `generated_tokens`; comparing that with the estimate for
+the generated text nudges the ratios of the classes involved. The ratios
+can be persisted to a JSON file so the calibration survives restarts; the
+periodic saves while observing are written from a background thread.
+"""
+
+import json
+import math
+import os
+import threading
+from pathlib import Path
+from typing import Any, Dict, Optional
+
+HAN = "han"
+KANA = "kana"
+HANGUL = "hangul"
+LATIN = "latin"
+OTHER = "other"
+
+DEFAULT_CHARS_PER_TOKEN = {
+    HAN: 1.2,
+    KANA: 1.0,
+    HANGUL: 1.0,
+    LATIN: 4.0,
+    OTHER: 2.0,
+}
+"""Starting ratios before any calibration, per script class."""
+
+_MIN_RATIO = 0.2
+_MAX_RATIO = 12.0
+
+
+def script_class(char: str) -> str:
+    code = ord(char)
+    if code < 0x250:
+        # ASCII, Latin-1 and Latin Extended, including spaces and punctuation
+        return LATIN
+    if 0x4E00 <= code <= 0x9FFF or 0x3400 <= code <= 0x4DBF:
+        return HAN
+    if 0xF900 <= code <= 0xFAFF:
+        return HAN
+    if 0x3000 <= code <= 0x303F or 0xFF00 <= code <= 0xFFEF:
+        # CJK punctuation and full width forms are spent like ideographs
+        return HAN
+    if 0x3040 <= code <= 0x30FF:
+        return KANA
+    if 0xAC00 <= code <= 0xD7AF or 0x1100 <= code <= 0x11FF:
+        return HANGUL
+    return OTHER
+
+
+def count_scripts(text: str) -> Dict[str, int]:
+    counts: Dict[str, int] = {}
+    for char in text:
+        cls = script_class(char)
+        counts[cls] = counts.get(cls, 0) + 1
+    return counts
+
+
+class TokenEstimator:
+    """Per-script chars-per-token ratios with online calibration."""
+
+    def __init__(
+        self,
+        path: Optional[str] = None,
+        learning_rate: float = 0.1,
+        save_every: int = 50,
+    ):
+        self.path = path
+        self.learning_rate = learning_rate
+        self.save_every = save_every
+        self.ratios = dict(DEFAULT_CHARS_PER_TOKEN)
+        self.samples = {cls: 0 for cls in DEFAULT_CHARS_PER_TOKEN}
+        self._unsaved = 0
+        self._saving = False
+        self._lock = threading.Lock()
+        if path is not None:
+            self.load(path)
+
+    def _contributions(self, counts: Dict[str, int]) -> Dict[str, float]:
+        return {cls: n / self.ratios[cls] for cls, n in counts.items()}
+
+    def estimate(self, text: str) -> int:
+        """Estimated token count of `text` (at least 1)."""
+        counts = count_scripts(text)
+        with self._lock:
+            tokens = sum(self._contributions(counts).values())
+        return max(1, math.ceil(tokens))
+
+    def observe(self, text: str, tokens: int) -> None:
+        """Calibrate from `text` that the server reported as `tokens` tokens.
+
+        The error is split over the script classes by their share of the
+        estimate and applied as a multiplicative step in log space.
+        """
+        if not text or tokens <= 0:
+            return
+        counts = count_scripts(text)
+        with self._lock:
+            contributions = self._contributions(counts)
+            estimate = sum(contributions.values())
+            error = math.log(estimate / tokens)
+            for cls, contribution in contributions.items():
+                weight = contribution / estimate
+                step = math.exp(self.learning_rate * weight * error)
+                ratio = self.ratios[cls] * step
+                self.ratios[cls] = min(_MAX_RATIO, max(_MIN_RATIO, ratio))
+                self.samples[cls] += 1
+            self._unsaved += 1
+            save = (
+                self.path is not None
+                and self._unsaved >= self.save_every
+                and not self._saving
+            )
+            self._saving = self._saving or save
+        if save:
+            # observe runs on the event loop; keep the file write off it
+            threading.Thread(
+                target=self._background_save, name="token-estimator-save", daemon=True
+            ).start()
+
+    def _background_save(self) -> None:
+        try:
+            self.save()
+        except OSError:
+            # the next periodic save, or the one at shutdown, tries again
+            pass
+        finally:
+            with self._lock:
+                self._saving = False
+
+    def load(self, path: str) -> None:
+        """Use `path` for persistence and load the ratios saved there, if any."""
+        with self._lock:
+            self.path = path
+            try:
+                with open(path, encoding="utf8") as f:
+                    saved = json.load(f)
+            except (OSError, ValueError):
+                return
+            for cls, ratio in saved.get("ratios", {}).items():
+                if cls in self.ratios:
+                    self.ratios[cls] = min(_MAX_RATIO, max(_MIN_RATIO, float(ratio)))
+            for cls, count in saved.get("samples", {}).items():
+                if cls in self.samples:
+                    self.samples[cls] = int(count)
+
+    def save(self) -> None:
+        """Write the ratios to `path` atomically; no-op without a path."""
+        with self._lock:
+            if self.path is None:
+                return
+            data = {"ratios": dict(self.ratios), "samples": dict(self.samples)}
+            self._unsaved = 0
+            path = self.path
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "w", encoding="utf8") as f:
+            json.dump(data, f, indent=2)
+        os.replace(tmp_path, path)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "path": self.path,
+                "chars_per_token": {k: round(v, 3) for k, v in self.ratios.items()},
+                "samples": dict(self.samples),
+            }
+
+
+default_estimator = TokenEstimator()
+"""Estimator shared by the FFM clients; call `load()` to persist it."""
+
+
+def estimate_tokens(text: str) -> int:
+    """Token estimate of `text` from the shared, calibrated estimator."""
+    return default_estimator.estimate(text)
@@ -0,0 +1,292 @@
+"""Persistent translation memory of previously translated segments.
+
+Segments are keyed by the SHA-256 of the normalized source text together
+with the source language, target language, country and model, and map to
+the final translation produced for them. Boilerplate that recurs across
+documents (headers, disclaimers, legal clauses) is then looked up instead
+of being sent through the model again. Storage is a single SQLite file with
+least-recently-used eviction once the entry count or total size exceeds its
+limits.
+
+Segments that have no exact entry can be matched against similar stored
+segments through a MinHash index over their source text, one per language
+pair, country and model. Indexes are built in a background thread when
+first needed (or ahead of time through `prepare_fuzzy_index`); until one is
+ready, fuzzy lookups in its scope find nothing.
+"""
+
+import hashlib
+import threading
+import time
+from typing import Any, Dict, List, NamedTuple, Optional, Sequence, Set, Tuple
+
+from .embedding_cache import normalize_text
+from .minhash import MinHashIndex, jaccard, shingles
+from .registry import Registry
+from .sqlite_lru import SQLiteLRUStore
+
+DEFAULT_MAX_ENTRIES = 1000000
+DEFAULT_MAX_BYTES = 512 * 1024 * 1024
+DEFAULT_MAX_INDEXED = 100000
+
+# MinHash estimates over 64 values are off by about 0.05, so candidates a
+# little below the threshold still get the exact check
+_CANDIDATE_SLACK = 0.15
+
+Scope = Tuple[str, str, str, str]
+
+
+class FuzzyMatch(NamedTuple):
+    source: str
+    """Stored source segment that resembles the looked up one."""
+    translation: str
+    """Stored translation of `source`."""
+    similarity: float
+    """Jaccard similarity of the two segments' character shingles."""
+
+
+def make_key(
+    source: str, source_lang: str, target_lang: str, country: str, model: str
+) -> str:
+    digest = hashlib.sha256()
+    for part in (model, source_lang, target_lang, country):
+        digest.update(part.encode("utf8"))
+        digest.update(b"\0")
+    digest.update(normalize_text(source).encode("utf8"))
+    return digest.hexdigest()
+
+
+class TranslationMemory(SQLiteLRUStore):
+    """SQLite store of segment translations with LRU eviction."""
+
+    _table = "segments"
+    _columns = (
+        "key",
+        "source",
+        "translation",
+        "source_lang",
+        "target_lang",
+        "country",
+        "model",
+        "size",
+        "accessed",
+    )
+    _schema = (
+        "CREATE TABLE IF NOT EXISTS segments ("
+        " key TEXT PRIMARY KEY,"
+        " source TEXT NOT NULL,"
+        " translation TEXT NOT NULL,"
+        " source_lang TEXT NOT NULL,"
+        " target_lang TEXT NOT NULL,"
+        " country TEXT NOT NULL,"
+        " model TEXT NOT NULL,"
+        " size INTEGER NOT NULL,"
+        " accessed REAL NOT NULL)",
+        "CREATE INDEX IF NOT EXISTS segments_accessed ON segments (accessed)",
+        "CREATE INDEX IF NOT EXISTS segments_languages"
+        " ON segments (source_lang, target_lang, country, model)",
+    )
+
+    def __init__(
+        self,
+        path: str,
+        max_entries: int = DEFAULT_MAX_ENTRIES,
+        max_bytes: int = DEFAULT_MAX_BYTES,
+        max_indexed: Optional[int] = DEFAULT_MAX_INDEXED,
+    ):
+        self.max_indexed = max_indexed
+        self.fuzzy_hits = 0
+        self._indexes: Dict[Scope, MinHashIndex] = {}
+        self._building: Set[Scope] = set()
+        super().__init__(path, max_entries, max_bytes)
+
+    def lookup(
+        self,
+        segments: Sequence[str],
+        source_lang: str,
+        target_lang: str,
+        country: str,
+        model: str,
+    ) -> List[Optional[str]]:
+        """The stored translation of each segment, or None where it is missing."""
+        keys = [
+            make_key(segment, source_lang, target_lang, country, model)
+            for segment in segments
+        ]
+        now = time.time()
+        with self._lock:
+            found: Dict[str, str] = dict(self._select("translation", keys))
+            if found:
+                self._touch(found, now)
+            self._count_lookups(sum(1 for key in keys if key in found), len(keys))
+        return [found.get(key) for key in keys]
+
+    def store(
+        self,
+        translations: Dict[str, str],
+        source_lang: str,
+        target_lang: str,
+        country: str,
+        model: str,
+    ) -> None:
+        """Remember the translation of each source segment in `translations`."""
+        now = time.time()
+        rows = []
+        scope = (source_lang, target_lang, country, model)
+        for source, translation in translations.items():
+            key = make_key(source, source_lang, target_lang, country, model)
+            size = len(source.encode("utf8")) + len(translation.encode("utf8"))
+            rows.append(
+                (
+                    key,
+                    source,
+                    translation,
+                    source_lang,
+                    target_lang,
+                    country,
+                    model,
+                    size,
+                    now,
+                )
+            )
+        with self._lock, self._conn:
+            index = self._indexes.get(scope)
+            if index is not None:
+                for row in rows:
+                    index.add(row[0], row[1])
+            self._insert(rows)
+
+    def prepare_fuzzy_index(
+        self, source_lang: str, target_lang: str, country: str, model: str
+    ) -> None:
+        """Start building the MinHash index of a scope in a background thread."""
+        with self._lock:
+            self._start_build((source_lang, target_lang, country, model))
+
+    def _start_build(self, scope: Scope) -> None:
+        if scope in self._indexes or scope in self._building:
+            return
+        self._building.add(scope)
+        threading.Thread(
+            target=self._build_index,
+            args=(scope,),
+            name="translation-memory-index",
+            daemon=True,
+        ).start()
+
+    def _build_index(self, scope: Scope) -> None:
+        index = MinHashIndex(max_entries=self.max_indexed)
+        try:
+            with self._lock:
+                snapshot = time.time()
+                rows = self._conn.execute(
+                    "SELECT key, source FROM segments WHERE source_lang = ?"
+                    " AND target_lang = ? AND country = ? AND model = ?"
+                    " ORDER BY accessed DESC LIMIT ?",
+                    (*scope, self.max_indexed or -1),
+                ).fetchall()
+            # oldest first, so the size cap drops the least recently used
+            for key, source in reversed(rows):
+                index.add(key, source)
+            with self._lock:
+                # segments stored while the index was being built
+                recent = self._conn.execute(
+                    "SELECT key, source FROM segments WHERE source_lang = ?"
+                    " AND target_lang = ? AND country = ? AND model = ?"
+                    " AND accessed >= ? ORDER BY accessed",
+                    (*scope, snapshot),
+                ).fetchall()
+                for key, source in recent:
+                    index.add(key, source)
+                self._indexes[scope] = index
+        finally:
+            with self._lock:
+                self._building.discard(scope)
+
+    def fuzzy_lookup(
+        self,
+        segments: Sequence[str],
+        source_lang: str,
+        target_lang: str,
+        country: str,
+        model: str,
+        threshold: float,
+    ) -> List[Optional[FuzzyMatch]]:
+        """The closest stored segment to each segment.
+
+        None where no stored segment reaches a similarity of `threshold`, and
+        for every segment while the scope's index is still being built.
+        """
+        scope = (source_lang, target_lang, country, model)
+        grams = [shingles(segment) for segment in segments]
+        rows: Dict[str, Tuple[str, str]] = {}
+        with self._lock:
+            index = self._indexes.get(scope)
+            if index is None:
+                self._start_build(scope)
+                return [None] * len(segments)
+            candidates = [
+                index.candidates(g, threshold - _CANDIDATE_SLACK) for g in grams
+            ]
+            for key, source, translation in self._select(
+                "source, translation", (key for c in candidates for key, _ in c)
+            ):
+                rows[key] = (source, translation)
+
+        # confirm candidates by the exact similarity of their stored sources
+        matches: List[Optional[FuzzyMatch]] = []
+        matched = []
+        for segment_grams, segment_candidates in zip(grams, candidates):
+            best, best_key = None, None
+            for key, _ in segment_candidates:
+                if key not in rows:
+                    continue
+                source, translation = rows[key]
+                similarity = jaccard(segment_grams, shingles(source))
+                if similarity >= threshold and (
+                    best is None or similarity > best.similarity
+                ):
+                    best, best_key = FuzzyMatch(source, translation, similarity), key
+            matches.append(best)
+            if best_key is not None:
+                matched.append(best_key)
+
+        if matched:
+            now = time.time()
+            with self._lock:
+                self._touch(matched, now)
+                self.fuzzy_hits += len(matched)
+        return matches
+
+    def _evicted(self, keys: List[str]) -> None:
+        for index in self._indexes.values():
+            for key in keys:
+                index.discard(key)
+
+    def clear(self) -> None:
+        super().clear()
+        with self._lock:
+            self._indexes.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        stats = super().stats()
+        with self._lock:
+            stats.update(
+                fuzzy_hits=self.fuzzy_hits,
+                indexed=sum(len(index) for index in self._indexes.values()),
+                indexes_building=len(self._building),
+            )
+        return stats
+
+
+_memories: Registry[TranslationMemory] = Registry()
+
+
+def get_translation_memory(path: str, **settings: Any) -> TranslationMemory:
+    """Return the process wide translation memory stored at `path`."""
+    return _memories.get(path, lambda: TranslationMemory(path, **settings))
+
+
+def translation_memory_stats() -> Dict[str, Dict[str, Any]]:
+    """Hit/miss counters of every open translation memory, keyed by path."""
+    return {path: memory.stats() for path, memory in _memories.items()}
@@ -1,17 +1,48 @@
+import asyncio
 import uuid
 from pathlib import Path
-from typing import Dict, Optional
+from typing import AsyncIterator, Dict, List, Optional, Tuple, Union
 
 from config import Config
 from langchain_community.vectorstores import Chroma
 from mylibspublic.FormosaEmbedding2 import CustomEmbeddingModel
 from mylibspublic.FormosaFoundationModel2 import FormosaFoundationModel
+from mylibspublic.model_cascade import FormosaCascadeModel, routing_decision
+from mylibspublic.structured_logging import get_logger
+from mylibspublic.token_estimator import default_estimator
+
+FFMClient = Union[FormosaFoundationModel, FormosaCascadeModel]
+
+logger = get_logger(__name__)
 
 
 def initialize_vector_store(persist_directory: str) -> Chroma:
     """初始化向量存儲"""
     embedding_model = CustomEmbeddingModel(
-        base_url=Config.API_URL, api_key=Config.API_KEY, model="ffm-embedding"
+        base_url=Config.API_URL,
+        api_key=Config.API_KEY,
+        model="ffm-embedding",
+        embedding_lot=Config.EMBEDDING_BATCH_SIZE,
+        batch_tokens=Config.EMBEDDING_BATCH_TOKENS,
+        max_concurrency=Config.EMBEDDING_MAX_CONCURRENCY,
+        query_batch_size=Config.EMBEDDING_QUERY_BATCH_SIZE,
+        query_batch_wait=Config.EMBEDDING_QUERY_BATCH_WAIT_MS / 1000,
+        as_numpy=Config.EMBEDDING_NUMPY,
+        encoding_format=Config.EMBEDDING_ENCODING_FORMAT,
+        cache_path=Config.EMBEDDING_CACHE_PATH or None,
+        cache_max_bytes=Config.EMBEDDING_CACHE_MAX_BYTES,
+        pool_maxsize=Config.HTTP_POOL_MAXSIZE,
+        connect_timeout=Config.HTTP_CONNECT_TIMEOUT,
+        read_timeout=Config.HTTP_READ_TIMEOUT,
+        requests_per_second=Config.FFM_REQUESTS_PER_SECOND,
+        tokens_per_minute=Config.FFM_TOKENS_PER_MINUTE,
+        max_retries=Config.FFM_MAX_RETRIES,
+        hedge=Config.FFM_HEDGE,
+        breaker_failure_threshold=Config.FFM_BREAKER_FAILURES,
+        breaker_reset_timeout=Config.FFM_BREAKER_RESET_SECONDS,
+        balancer_strategy=Config.FFM_BALANCER_STRATEGY,
+        eject_after=Config.FFM_EJECT_AFTER,
+        eject_seconds=Config.FFM_EJECT_SECONDS,
     )
 
     vector_store = Chroma(
@@ -25,13 +56,39 @@ def initialize_vector_store(persist_directory: str) -> Chroma:
 
 def initialize_rag():
     """初始化 RAG 系統"""
+    # 載入先前校正的 token 估算比例，之後依 FFM 回報的用量持續更新
+    if Config.TOKEN_STATS_PATH:
+        default_estimator.load(Config.TOKEN_STATS_PATH)
+
     default_vector_store = initialize_vector_store(
         str(Path(Config.CHROMA_PATH) / "default")
     )
 
     ffm = FormosaFoundationModel(
-        base_url=Config.API_URL, ffm_api_key=Config.API_KEY, model=Config.MODEL_NAME
+        base_url=Config.API_URL,
+        ffm_api_key=Config.API_KEY,
+        model=Config.MODEL_NAME,
+        max_concurrency=Config.FFM_MAX_CONCURRENCY,
+        max_continuations=Config.FFM_MAX_CONTINUATIONS,
+        pool_maxsize=Config.HTTP_POOL_MAXSIZE,
+        connect_timeout=Config.HTTP_CONNECT_TIMEOUT,
+        read_timeout=Config.HTTP_READ_TIMEOUT,
+        requests_per_second=Config.FFM_REQUESTS_PER_SECOND,
+        tokens_per_minute=Config.FFM_TOKENS_PER_MINUTE,
+        max_retries=Config.FFM_MAX_RETRIES,
+        hedge=Config.FFM_HEDGE,
+        breaker_failure_threshold=Config.FFM_BREAKER_FAILURES,
+        breaker_reset_timeout=Config.FFM_BREAKER_RESET_SECONDS,
+        balancer_strategy=Config.FFM_BALANCER_STRATEGY,
+        eject_after=Config.FFM_EJECT_AFTER,
+        eject_seconds=Config.FFM_EJECT_SECONDS,
+        cache_path=Config.FFM_CACHE_PATH or None,
     )
+    # 設定快速模型時，先由快速模型回答，必要時再升級到 MODEL_NAME
+    if Config.FAST_MODEL_NAME and Config.FAST_MODEL_NAME != Config.MODEL_NAME:
+        ffm = FormosaCascadeModel(
+            fast=ffm.copy(update={"model": Config.FAST_MODEL_NAME}), strong=ffm
+        )
 
     return default_vector_store, ffm
 
@@ -53,11 +110,11 @@ def add_translated_content_to_vector_store(
 
         vector_store.persist()
 
-        print(f"已添加文檔，ID: {doc_id}")
+        logger.debug("已添加文檔", doc_id=doc_id)
         return doc_id
 
     except Exception as e:
-        print(f"添加文檔時出錯: {str(e)}")
+        logger.error("添加文檔時出錯", error=str(e))
         raise e
 
 
@@ -71,14 +128,15 @@ def delete_from_vector_store(vector_store: Chroma, metadata_filter: Dict) -> boo
             # 刪除文檔
             vector_store.delete(ids=matching_docs["ids"])
             vector_store.persist()
-            print(f"已刪除文檔，IDs: {matching_docs['ids']}")
+            logger.debug("已刪除文檔", count=len(matching_docs["ids"]))
+            logger.trace("已刪除文檔", doc_ids=matching_docs["ids"])
             return True
         else:
-            print("未找到匹配的文檔")
+            logger.debug("未找到匹配的文檔")
             return False
 
     except Exception as e:
-        print(f"刪除文檔時出錯: {str(e)}")
+        logger.error("刪除文檔時出錯", error=str(e))
         # 嘗試關閉和重新初始化 vector store
         try:
             vector_store._client.close()
@@ -94,14 +152,14 @@ def reset_vector_store(vector_store: Chroma) -> bool:
         if all_docs and all_docs["ids"]:
             vector_store.delete(ids=all_docs["ids"])
             vector_store.persist()
-            print("已清空向量數據庫")
+            logger.info("已清空向量數據庫", count=len(all_docs["ids"]))
             try:
                 vector_store._client.close()
             except:
                 pass
         return True
     except Exception as e:
-        print(f"重置數據庫時出錯: {str(e)}")
+        logger.error("重置數據庫時出錯", error=str(e))
         try:
             vector_store._client.close()
         except:
@@ -124,21 +182,18 @@ def add_content_to_vector_store(
 
         vector_store.persist()
 
-        print(f"已添加文檔，ID: {doc_id}")
+        logger.debug("已添加文檔", doc_id=doc_id)
         return doc_id
 
     except Exception as e:
-        print(f"添加文檔時出錯: {str(e)}")
+        logger.error("添加文檔時出錯", error=str(e))
         raise e
 
 
-def query_knowledge_base(
-    vector_store: Chroma,
-    ffm: FormosaFoundationModel,
-    query: str,
-    model_settings: Optional[Dict] = None,
+def _retrieve_and_build_prompt(
+    vector_store: Chroma, query: str, model_settings: Optional[Dict] = None
 ) -> str:
-    """查詢知識庫"""
+    """檢索相關文檔並建立回答提示"""
     # 獲取參數
     if model_settings:
         top_k = model_settings.get("parameters", {}).get("topK", 3)
@@ -149,9 +204,6 @@ def query_knowledge_base(
         top_k = 3
         similarity_threshold = 0.7
 
-    # 將 stream 參數設置為 true
-    stream = True
-
     # 使用向量存儲來檢索相關文檔
     docs = vector_store.similarity_search_with_score(query, k=top_k)
 
@@ -171,22 +223,82 @@ def query_knowledge_base(
 {query}
 
 回答:"""
+    return prompt
+
+
+def _generation_parameters(
+    ffm: FFMClient, model_settings: Optional[Dict] = None
+) -> Tuple[FFMClient, Dict]:
+    """依模型設定取得此次請求使用的模型與生成參數"""
+    if not model_settings:
+        return ffm, {}
+
+    model_name = model_settings.get("model_name")
+    # 指定模型時使用副本，不修改各請求共用的模型（串接模型時指定的是升級用的大模型）
+    if model_name:
+        if isinstance(ffm, FormosaCascadeModel):
+            strong = ffm.strong.copy(update={"model": model_name})
+            ffm = ffm.copy(update={"strong": strong})
+        else:
+            ffm = ffm.copy(update={"model": model_name})
+
+    return ffm, model_settings.get("parameters", {})
+
+
+def _answer_text(ffm: FFMClient, result, routing: Optional[List[Dict]]) -> str:
+    """取出回答文字，並記錄路由決策"""
+    generation = result.generations[0][0]
+    if routing is not None:
+        routing.append(routing_decision(ffm, generation))
+    return generation.text
+
+
+def query_knowledge_base(
+    vector_store: Chroma,
+    ffm: FFMClient,
+    query: str,
+    model_settings: Optional[Dict] = None,
+    routing: Optional[List[Dict]] = None,
+) -> str:
+    """查詢知識庫"""
+    prompt = _retrieve_and_build_prompt(vector_store, query, model_settings)
 
     # 使用 FFM 生成回答
-    if model_settings:
-        model_name = model_settings.get("model_name")
-        parameters = model_settings.get("parameters", {})
+    ffm, parameters = _generation_parameters(ffm, model_settings)
+    return _answer_text(ffm, ffm.generate([prompt], **parameters), routing)
 
-        # 更新模型設定
-        if model_name:
-            ffm.model = model_name
 
-        # 將 stream 參數設置為 true，並轉換為 JSON 格式
-        response = ffm(prompt, **parameters, stream=stream)
-    else:
-        response = ffm(prompt)
+async def aquery_knowledge_base(
+    vector_store: Chroma,
+    ffm: FFMClient,
+    query: str,
+    model_settings: Optional[Dict] = None,
+    routing: Optional[List[Dict]] = None,
+) -> str:
+    """非同步查詢知識庫，檢索在執行緒池中進行，生成直接 await FFM"""
+    prompt = await asyncio.to_thread(
+        _retrieve_and_build_prompt, vector_store, query, model_settings
+    )
+
+    ffm, parameters = _generation_parameters(ffm, model_settings)
+    result = await ffm.agenerate([prompt], **parameters)
+    return _answer_text(ffm, result, routing)
+
+
+async def astream_query_knowledge_base(
+    vector_store: Chroma,
+    ffm: FFMClient,
+    query: str,
+    model_settings: Optional[Dict] = None,
+) -> AsyncIterator[str]:
+    """串流查詢知識庫，逐段產出 FFM 生成的回答"""
+    prompt = await asyncio.to_thread(
+        _retrieve_and_build_prompt, vector_store, query, model_settings
+    )
 
-    return response
+    ffm, parameters = _generation_parameters(ffm, model_settings)
+    async for token in ffm.astream(prompt, **parameters):
+        yield token
 
 
 if __name__ == "__main__":
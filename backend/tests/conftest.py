@@ -0,0 +1,5 @@
+import sys
+from pathlib import Path
+
+# the modules under test are imported the way app.py imports them
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
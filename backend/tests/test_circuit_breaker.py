@@ -0,0 +1,112 @@
+import asyncio
+import time
+import unittest
+
+from mylibspublic.circuit_breaker import (
+    CLOSED,
+    HALF_OPEN,
+    OPEN,
+    CircuitBreaker,
+    CircuitOpenError,
+    is_server_error,
+)
+
+RESET = 0.05
+
+
+def failing():
+    raise ConnectionError("down")
+
+
+class TestCircuitBreaker(unittest.TestCase):
+    def open_breaker(self):
+        breaker = CircuitBreaker("http://ffm", failure_threshold=2, reset_timeout=RESET)
+        for _ in range(2):
+            with self.assertRaises(ConnectionError):
+                breaker.call(failing)
+        self.assertEqual(breaker.state, OPEN)
+        return breaker
+
+    def test_opens_after_consecutive_failures(self):
+        breaker = CircuitBreaker("http://ffm", failure_threshold=3)
+        breaker.record_failure()
+        breaker.record_failure()
+        breaker.record_success()
+        breaker.record_failure()
+        breaker.record_failure()
+        self.assertEqual(breaker.state, CLOSED)
+        breaker.record_failure()
+        self.assertEqual(breaker.state, OPEN)
+
+    def test_server_error_results_count_as_failures(self):
+        breaker = CircuitBreaker("http://ffm", failure_threshold=2)
+        for status in (500, 429, 503, 200, 502, 502):
+            breaker.call(lambda: (status, {}), is_failure=is_server_error)
+        self.assertEqual(breaker.state, OPEN)
+
+    def test_open_circuit_rejects_without_calling(self):
+        breaker = self.open_breaker()
+        calls = []
+        with self.assertRaises(CircuitOpenError) as raised:
+            breaker.call(lambda: calls.append(1))
+        self.assertEqual(calls, [])
+        self.assertGreater(raised.exception.retry_after, 0)
+        self.assertEqual(breaker.stats()["rejected"], 1)
+
+    def test_half_open_lets_one_probe_through(self):
+        breaker = self.open_breaker()
+        time.sleep(RESET * 1.5)
+        breaker.before_call()
+        self.assertEqual(breaker.state, HALF_OPEN)
+        with self.assertRaises(CircuitOpenError):
+            breaker.before_call()
+        breaker.record(True)
+        self.assertEqual(breaker.state, CLOSED)
+        self.assertEqual(breaker.call(lambda: "ok"), "ok")
+
+    def test_failed_probe_reopens(self):
+        breaker = self.open_breaker()
+        time.sleep(RESET * 1.5)
+        with self.assertRaises(ConnectionError):
+            breaker.call(failing)
+        self.assertEqual(breaker.state, OPEN)
+        with self.assertRaises(CircuitOpenError):
+            breaker.before_call()
+
+    def test_abandoned_probe_frees_its_slot(self):
+        breaker = self.open_breaker()
+        time.sleep(RESET * 1.5)
+        breaker.before_call()
+        breaker.abandon()
+        self.assertEqual(breaker.state, HALF_OPEN)
+        # the next call becomes the probe instead of being rejected
+        breaker.before_call()
+        breaker.record(None)
+        breaker.before_call()
+        breaker.record(True)
+        self.assertEqual(breaker.state, CLOSED)
+
+    def test_abandon_is_a_no_op_when_closed(self):
+        breaker = CircuitBreaker("http://ffm", failure_threshold=1)
+        breaker.abandon()
+        self.assertEqual(breaker.state, CLOSED)
+        self.assertEqual(breaker.stats()["consecutive_failures"], 0)
+
+    def test_acall(self):
+        breaker = CircuitBreaker("http://ffm", failure_threshold=1)
+
+        async def ok():
+            return 200, {}
+
+        async def down():
+            raise ConnectionError("down")
+
+        self.assertEqual(asyncio.run(breaker.acall(ok)), (200, {}))
+        with self.assertRaises(ConnectionError):
+            asyncio.run(breaker.acall(down))
+        with self.assertRaises(CircuitOpenError):
+            asyncio.run(breaker.acall(ok))
+
+
+if __name__ == "__main__":
+    unittest.main()
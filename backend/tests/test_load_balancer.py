@@ -0,0 +1,104 @@
+import asyncio
+import unittest
+
+from mylibspublic.circuit_breaker import CircuitOpenError
+from mylibspublic.load_balancer import (
+    EWMA,
+    LoadBalancer,
+    endpoint_group,
+    parse_base_urls,
+)
+
+
+def open_on(*urls):
+    """Fake replica call whose breaker is open on `urls`."""
+
+    def call(url):
+        if url in urls:
+            raise CircuitOpenError(url, 5)
+        return f"ok {url}"
+
+    return call
+
+
+class TestLoadBalancer(unittest.TestCase):
+    def test_fails_over_on_circuit_open_without_counting_a_failure(self):
+        balancer = LoadBalancer(["a", "b"], eject_after=1)
+        for _ in range(4):
+            self.assertEqual(balancer.call(open_on("a")), "ok b")
+        replicas = balancer.stats()["replicas"]
+        self.assertEqual(replicas["a"]["consecutive_failures"], 0)
+        self.assertEqual(replicas["a"]["ejected_for"], 0)
+        self.assertEqual(replicas["a"]["outstanding"], 0)
+        self.assertEqual(replicas["b"]["outstanding"], 0)
+
+    def test_raises_circuit_open_when_every_replica_is_open(self):
+        balancer = LoadBalancer(["a", "b"])
+        with self.assertRaises(CircuitOpenError):
+            balancer.call(open_on("a", "b"))
+        for replica in balancer.stats()["replicas"].values():
+            self.assertEqual(replica["consecutive_failures"], 0)
+            self.assertEqual(replica["outstanding"], 0)
+
+    def test_acall_fails_over_on_circuit_open(self):
+        balancer = LoadBalancer(["a", "b"])
+
+        async def call(url):
+            return open_on("a")(url)
+
+        for _ in range(3):
+            self.assertEqual(asyncio.run(balancer.acall(call)), "ok b")
+        self.assertEqual(balancer.stats()["replicas"]["a"]["consecutive_failures"], 0)
+
+    def test_failures_eject_a_replica(self):
+        balancer = LoadBalancer(["a", "b"], eject_after=2, eject_seconds=60)
+        attempts = []
+
+        def call(url):
+            attempts.append(url)
+            if url == "a":
+                raise ConnectionError("down")
+            return "ok"
+
+        # a request in flight on "b" makes "a" the first choice
+        held = balancer.pick(exclude=["a"])
+        for _ in range(2):
+            self.assertEqual(balancer.call(call), "ok")
+        self.assertEqual(attempts, ["a", "b", "a", "b"])
+        self.assertGreater(balancer.stats()["replicas"]["a"]["ejected_for"], 50)
+        # ejected, "a" is no longer tried even though "b" is busier
+        self.assertEqual(balancer.call(call), "ok")
+        self.assertEqual(attempts[4:], ["b"])
+        balancer.release(held, True)
+
+    def test_failure_results_fail_over(self):
+        balancer = LoadBalancer(["a", "b"])
+        result = balancer.call(lambda url: url, is_failure=lambda url: url == "a")
+        self.assertEqual(result, "b")
+
+    def test_last_replica_result_is_returned_even_if_failed(self):
+        balancer = LoadBalancer(["a"])
+        self.assertEqual(balancer.call(lambda url: 503, is_failure=bool), 503)
+
+    def test_picks_least_outstanding(self):
+        balancer = LoadBalancer(["a", "b"])
+        first = balancer.pick()
+        second = balancer.pick()
+        self.assertNotEqual(first, second)
+        balancer.release(first, True)
+        self.assertEqual(balancer.pick(), first)
+
+    def test_ewma_prefers_the_faster_replica(self):
+        balancer = LoadBalancer(["a", "b"], strategy=EWMA)
+        balancer.release(balancer.pick(exclude=["b"]), True, latency=1.0)
+        balancer.release(balancer.pick(exclude=["a"]), True, latency=0.1)
+        self.assertEqual(balancer.pick(), "b")
+
+    def test_parse_base_urls(self):
+        urls = parse_base_urls(" http://a/ ,http://b,, ")
+        self.assertEqual(urls, ["http://a", "http://b"])
+        self.assertEqual(endpoint_group(urls, "/p"), "http://a/p,http://b/p")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,73 @@
+import threading
+import time
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+
+from mylibspublic.micro_batcher import MicroBatcher
+
+
+class Recorder:
+    """Batched fake call that remembers every batch it was given."""
+
+    def __init__(self, transform=lambda item: item * 10):
+        self.transform = transform
+        self.batches = []
+        self.lock = threading.Lock()
+
+    def __call__(self, items):
+        with self.lock:
+            self.batches.append(list(items))
+        return [self.transform(item) for item in items]
+
+
+class TestMicroBatcher(unittest.TestCase):
+    def test_each_caller_gets_its_own_result(self):
+        fn = Recorder()
+        batcher = MicroBatcher(fn, max_batch_size=8, max_wait=0.05)
+        with ThreadPoolExecutor(20) as pool:
+            results = list(pool.map(batcher.call, range(20)))
+        self.assertEqual(results, [item * 10 for item in range(20)])
+        batched = sorted(item for batch in fn.batches for item in batch)
+        self.assertEqual(batched, list(range(20)))
+        self.assertTrue(all(len(batch) <= 8 for batch in fn.batches))
+        self.assertLess(len(fn.batches), 20)
+        stats = batcher.stats()
+        self.assertEqual(stats["items"], 20)
+        self.assertEqual(stats["pending"], 0)
+
+    def test_full_batch_runs_without_waiting(self):
+        fn = Recorder()
+        batcher = MicroBatcher(fn, max_batch_size=4, max_wait=10)
+        start = time.monotonic()
+        with ThreadPoolExecutor(4) as pool:
+            results = list(pool.map(batcher.call, "abcd"))
+        self.assertLess(time.monotonic() - start, 5)
+        self.assertEqual(results, ["a" * 10, "b" * 10, "c" * 10, "d" * 10])
+        self.assertEqual(len(fn.batches), 1)
+
+    def test_lone_caller_runs_after_max_wait(self):
+        fn = Recorder()
+        batcher = MicroBatcher(fn, max_batch_size=4, max_wait=0.01)
+        self.assertEqual(batcher.call(3), 30)
+        self.assertEqual(fn.batches, [[3]])
+
+    def test_error_reaches_every_caller_in_the_batch(self):
+        def fail(items):
+            raise ConnectionError("down")
+
+        batcher = MicroBatcher(fail, max_batch_size=3, max_wait=10)
+        with ThreadPoolExecutor(3) as pool:
+            futures = [pool.submit(batcher.call, item) for item in range(3)]
+        for future in futures:
+            self.assertIsInstance(future.exception(), ConnectionError)
+
+    def test_wrong_result_count_fails_the_batch(self):
+        batcher = MicroBatcher(lambda items: items[:1], max_batch_size=2, max_wait=10)
+        with ThreadPoolExecutor(2) as pool:
+            futures = [pool.submit(batcher.call, item) for item in range(2)]
+        for future in futures:
+            self.assertIsInstance(future.exception(), ValueError)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,70 @@
+import random
+import unittest
+
+from mylibspublic.minhash import MinHashIndex, jaccard, shingles
+
+WORDS = (
+    "contract party agreement payment invoice delivery notice period term "
+    "clause liability warranty service customer supplier schedule amount"
+).split()
+
+
+def sentence(rng: random.Random) -> str:
+    words = " ".join(rng.choice(WORDS) for _ in range(rng.randint(12, 20)))
+    return f"{words} dated {rng.randint(1, 28)} March {rng.randint(1990, 2030)}."
+
+
+def edit(rng: random.Random, text: str) -> str:
+    """Replace one word, the kind of change a patched segment has."""
+    words = text.split()
+    words[rng.randrange(len(words))] = rng.choice(WORDS)
+    return " ".join(words)
+
+
+class TestMinHash(unittest.TestCase):
+    def test_near_duplicates_are_candidates(self):
+        rng = random.Random(0)
+        index = MinHashIndex()
+        texts = [sentence(rng) for _ in range(300)]
+        for key, text in enumerate(texts):
+            index.add(key, text)
+
+        found = total = 0
+        for key, text in enumerate(texts):
+            query = shingles(edit(rng, text))
+            if jaccard(query, shingles(text)) < 0.8:
+                continue
+            total += 1
+            candidates = index.candidates(query, min_similarity=0.65)
+            found += key in [candidate for candidate, _ in candidates]
+        self.assertGreater(total, 100)
+        self.assertGreaterEqual(found / total, 0.98)
+
+    def test_cjk_segment_with_changed_date(self):
+        index = MinHashIndex()
+        index.add("a", "本合約自二〇二三年一月一日起生效，有效期間為三年。")
+        index.add("b", "乙方應於收到發票後三十日內付款。")
+        query = shingles("本合約自二〇二四年一月一日起生效，有效期間為三年。")
+        self.assertEqual(index.candidates(query, min_similarity=0.5)[0][0], "a")
+
+    def test_unrelated_text_is_not_a_candidate(self):
+        index = MinHashIndex()
+        index.add("a", "The supplier shall deliver the goods within ten days.")
+        query = shingles("乙方應於收到發票後三十日內付款。")
+        self.assertEqual(index.candidates(query, min_similarity=0.3), [])
+
+    def test_discard_and_size_cap(self):
+        index = MinHashIndex(max_entries=2)
+        index.add("a", "first text in the index")
+        index.add("b", "second text in the index")
+        index.add("c", "third text in the index")
+        self.assertEqual(len(index), 2)
+        keys = [key for key, _ in index.candidates(shingles("first text in the index"))]
+        self.assertNotIn("a", keys)
+        index.discard("b")
+        index.discard("missing")
+        self.assertEqual(len(index), 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
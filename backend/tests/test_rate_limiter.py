@@ -0,0 +1,120 @@
+import threading
+import unittest
+
+from mylibspublic.rate_limiter import (
+    AdaptiveRateLimiter,
+    OverloadedError,
+    limited_post,
+    parse_retry_after,
+)
+
+
+class FakeResponse:
+    def __init__(self, status_code, retry_after=None):
+        self.status_code = status_code
+        self.headers = {} if retry_after is None else {"Retry-After": retry_after}
+        self.closed = False
+
+    def close(self):
+        self.closed = True
+
+
+class FakeSession:
+    """Answers with the given status codes in turn."""
+
+    def __init__(self, *status_codes):
+        self.responses = [FakeResponse(code, "0") for code in status_codes]
+        self.posts = 0
+
+    def post(self, url, **kwargs):
+        response = self.responses[self.posts]
+        self.posts += 1
+        return response
+
+
+class TestAIMD(unittest.TestCase):
+    def test_successes_grow_the_window_additively(self):
+        limiter = AdaptiveRateLimiter(initial_concurrency=4, max_concurrency=5)
+        expected = 4.0
+        for _ in range(3):
+            limiter.acquire()
+            limiter.release(succeeded=True)
+            expected += 1 / expected
+        self.assertAlmostEqual(limiter.limit, expected)
+        for _ in range(20):
+            limiter.acquire()
+            limiter.release(succeeded=True)
+        self.assertEqual(limiter.limit, 5)
+
+    def test_overload_halves_the_window_once_per_round_trip(self):
+        limiter = AdaptiveRateLimiter(initial_concurrency=8, min_concurrency=3)
+        limiter.release(overloaded=True)
+        self.assertEqual(limiter.limit, 4)
+        # the rest of the burst falls within the cooldown
+        limiter.release(overloaded=True)
+        self.assertEqual(limiter.limit, 4)
+        limiter._last_decrease = 0.0
+        limiter.release(overloaded=True)
+        self.assertEqual(limiter.limit, 3)
+        self.assertEqual(limiter.stats()["overloaded"], 3)
+        self.assertEqual(limiter.stats()["decreased"], 2)
+
+    def test_rising_latency_shrinks_the_window(self):
+        limiter = AdaptiveRateLimiter(initial_concurrency=8, min_latency_samples=5)
+        for _ in range(5):
+            limiter.release(latency=0.1)
+        grown = limiter.limit
+        self.assertGreater(grown, 8)
+        limiter.release(latency=10.0)
+        self.assertLess(limiter.limit, grown / 1.5)
+
+    def test_retry_after_pauses_every_caller(self):
+        limiter = AdaptiveRateLimiter()
+        limiter.release(overloaded=True, retry_after=5.0)
+        self.assertGreater(limiter.stats()["paused_for"], 4)
+        self.assertGreater(limiter._try_acquire(0), 4)
+
+    def test_acquire_waits_for_a_free_slot(self):
+        limiter = AdaptiveRateLimiter(initial_concurrency=1)
+        limiter.acquire()
+        acquired = threading.Event()
+        waiter = threading.Thread(
+            target=lambda: (limiter.acquire(), acquired.set()), daemon=True
+        )
+        waiter.start()
+        self.assertFalse(acquired.wait(0.1))
+        limiter.release(succeeded=True)
+        self.assertTrue(acquired.wait(1))
+        self.assertEqual(limiter.in_flight, 1)
+
+
+class TestLimitedPost(unittest.TestCase):
+    def test_retries_overloaded_responses(self):
+        session = FakeSession(429, 503, 200)
+        limiter = AdaptiveRateLimiter()
+        response = limited_post(session, limiter, "http://ffm", max_retries=3)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(session.posts, 3)
+        self.assertTrue(all(r.closed for r in session.responses[:2]))
+        self.assertEqual(limiter.in_flight, 0)
+
+    def test_raises_overloaded_error_after_the_retries(self):
+        session = FakeSession(429, 429, 429)
+        limiter = AdaptiveRateLimiter()
+        with self.assertRaises(OverloadedError) as raised:
+            limited_post(session, limiter, "http://ffm", max_retries=2)
+        self.assertEqual(raised.exception.status_code, 429)
+        self.assertEqual(raised.exception.retry_after, 0)
+        self.assertEqual(session.posts, 3)
+        self.assertEqual(limiter.in_flight, 0)
+
+    def test_parse_retry_after(self):
+        self.assertEqual(parse_retry_after("2.5"), 2.5)
+        self.assertEqual(parse_retry_after("-1"), 0)
+        self.assertEqual(parse_retry_after("Thu, 01 Jan 1970 00:00:00 GMT"), 0)
+        self.assertIsNone(parse_retry_after("soon"))
+        self.assertIsNone(parse_retry_after(None))
+
+
+if __name__ == "__main__":
+    unittest.main()
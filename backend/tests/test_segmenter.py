@@ -0,0 +1,62 @@
+import unittest
+
+from mylibspublic.segmenter import (
+    ends_paragraph,
+    join_chunks,
+    split_paragraphs,
+    split_text,
+)
+from mylibspublic.token_estimator import estimate_tokens
+
+MIXED = (
+    "First paragraph. It has two sentences.\n\n"
+    "第二段落。這裡有中文句子！還有一句？\n"
+    "Same paragraph, new line.\n \n\n"
+    "Last paragraph without a final newline"
+)
+
+
+class TestSegmenter(unittest.TestCase):
+    def test_round_trip_restores_the_text(self):
+        for max_tokens in (1, 5, 20, 1000):
+            with self.subTest(max_tokens=max_tokens):
+                chunks = split_text(MIXED, max_tokens)
+                texts = [chunk.text for chunk in chunks]
+                self.assertEqual(join_chunks(texts, chunks), MIXED)
+
+    def test_round_trip_keeps_leading_and_trailing_whitespace_out(self):
+        text = "\n\nOne. Two.\n\n"
+        chunks = split_text(text, 1000)
+        self.assertEqual([chunk.text for chunk in chunks], ["One. Two."])
+        self.assertEqual(join_chunks(["1. 2."], chunks), "1. 2.\n\n")
+
+    def test_chunks_stay_within_the_budget(self):
+        for chunk in split_text(MIXED, 8):
+            self.assertLessEqual(estimate_tokens(chunk.text), 8)
+
+    def test_over_long_sentence_is_cut(self):
+        sentence = "word " * 200
+        chunks = split_text(sentence, 20)
+        self.assertGreater(len(chunks), 1)
+        self.assertEqual(join_chunks([c.text for c in chunks], chunks), sentence)
+
+    def test_short_paragraphs_share_a_chunk(self):
+        chunks = split_text("A.\n\nB.\n\nC.", 1000)
+        self.assertEqual(len(chunks), 1)
+        self.assertEqual(chunks[0].text, "A.\n\nB.\n\nC.")
+
+    def test_translated_chunks_keep_paragraph_breaks(self):
+        chunks = split_text(MIXED, 8)
+        joined = join_chunks([f"<{i}>" for i in range(len(chunks))], chunks)
+        self.assertEqual(joined.count("\n\n"), MIXED.count("\n\n"))
+
+    def test_paragraph_separators(self):
+        paragraphs = split_paragraphs("One.\n\nTwo.\nStill two.\n\n\nThree.")
+        self.assertEqual(
+            [p.text for p in paragraphs], ["One.", "Two.\nStill two.", "Three."]
+        )
+        self.assertEqual([ends_paragraph(p) for p in paragraphs], [True, True, False])
+
+
+if __name__ == "__main__":
+    unittest.main()
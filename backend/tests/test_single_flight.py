@@ -0,0 +1,108 @@
+import asyncio
+import threading
+import time
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+
+from mylibspublic.single_flight import SingleFlight, request_key
+
+
+class TestSingleFlight(unittest.TestCase):
+    def run_concurrently(self, flight, fn, callers=5):
+        """Call `flight.do` from several threads while `fn` is in flight."""
+        with ThreadPoolExecutor(callers) as pool:
+            futures = [pool.submit(flight.do, "key", fn) for _ in range(callers)]
+            # let every caller join before the leader finishes
+            deadline = time.monotonic() + 5
+            while flight.stats()["shared"] < callers - 1:
+                self.assertLess(time.monotonic(), deadline)
+                time.sleep(0.001)
+            fn.release.set()
+            return futures
+
+    def blocking(self, outcome):
+        calls = []
+
+        def fn():
+            calls.append(1)
+            fn.release.wait(5)
+            return outcome()
+
+        fn.release = threading.Event()
+        return fn, calls
+
+    def test_concurrent_calls_share_one_result(self):
+        flight = SingleFlight()
+        fn, calls = self.blocking(lambda: object())
+        futures = self.run_concurrently(flight, fn)
+        results = [future.result() for future in futures]
+        self.assertEqual(len(calls), 1)
+        self.assertTrue(all(result is results[0] for result in results))
+        self.assertEqual(flight.stats(), {"in_flight": 0, "leaders": 1, "shared": 4})
+
+    def test_error_reaches_every_caller(self):
+        flight = SingleFlight()
+        error = ValueError("upstream failed")
+
+        def fail():
+            raise error
+
+        fn, calls = self.blocking(fail)
+        futures = self.run_concurrently(flight, fn)
+        for future in futures:
+            self.assertIs(future.exception(), error)
+        self.assertEqual(len(calls), 1)
+        # the failure is not remembered
+        self.assertEqual(flight.do("key", lambda: "retried"), "retried")
+
+    def test_different_keys_do_not_share(self):
+        flight = SingleFlight()
+        self.assertEqual(flight.do("a", lambda: 1), 1)
+        self.assertEqual(flight.do("b", lambda: 2), 2)
+        self.assertEqual(flight.stats()["leaders"], 2)
+
+    def test_async_error_reaches_every_caller(self):
+        flight = SingleFlight()
+        calls = []
+
+        async def fail():
+            calls.append(1)
+            await asyncio.sleep(0.01)
+            raise ValueError("upstream failed")
+
+        async def main():
+            return await asyncio.gather(
+                *(flight.ado("key", fail) for _ in range(5)), return_exceptions=True
+            )
+
+        errors = asyncio.run(main())
+        self.assertEqual(len(calls), 1)
+        self.assertTrue(all(isinstance(e, ValueError) for e in errors))
+        self.assertIs(errors[0], errors[-1])
+        self.assertEqual(flight.stats()["in_flight"], 0)
+
+    def test_cancelled_waiter_does_not_cancel_the_shared_call(self):
+        flight = SingleFlight()
+
+        async def slow():
+            await asyncio.sleep(0.05)
+            return "done"
+
+        async def main():
+            first = asyncio.ensure_future(flight.ado("key", slow))
+            second = asyncio.ensure_future(flight.ado("key", slow))
+            await asyncio.sleep(0.01)
+            first.cancel()
+            return await second
+
+        self.assertEqual(asyncio.run(main()), "done")
+
+    def test_request_key(self):
+        key = request_key("http://ffm/a", b"{}")
+        self.assertEqual(key, request_key("http://ffm/a", b"{}"))
+        self.assertNotEqual(key, request_key("http://ffm/b", b"{}"))
+        self.assertNotEqual(key, request_key("http://ffm/a", b"{ }"))
+
+
+if __name__ == "__main__":
+    unittest.main()
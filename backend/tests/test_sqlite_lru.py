@@ -0,0 +1,107 @@
+import random
+import tempfile
+import time
+import unittest
+from pathlib import Path
+
+from mylibspublic.completion_cache import CompletionCache
+from mylibspublic.embedding_cache import EmbeddingCache
+from mylibspublic.translation_memory import TranslationMemory
+
+SCOPE = ("English", "Chinese", "Taiwan", "m")
+
+
+class TestSQLiteLRUStore(unittest.TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = str(Path(directory.name) / "store.sqlite3")
+
+    def assertTotalsMatchTable(self, store):
+        count, size = store._conn.execute(
+            f"SELECT COUNT(*), COALESCE(SUM(size), 0) FROM {store._table}"
+        ).fetchone()
+        stats = store.stats()
+        self.assertEqual((stats["entries"], stats["bytes"]), (count, size))
+        self.assertLessEqual(count, store.max_entries)
+        self.assertLessEqual(size, store.max_bytes)
+
+    def test_entry_limit_evicts_least_recently_used(self):
+        cache = EmbeddingCache(self.path, max_entries=3)
+        for key in "abc":
+            cache.put(key, [1.0])
+            time.sleep(0.002)
+        cache.get("a")
+        cache.put("d", [1.0])
+        self.assertIsNone(cache.get_many(["a", "b", "c", "d"])[1])
+        self.assertEqual(cache.stats()["evictions"], 1)
+        self.assertTotalsMatchTable(cache)
+
+    def test_byte_limit(self):
+        # 16 bytes per four-float vector
+        cache = EmbeddingCache(self.path, max_bytes=10 * 16)
+        for start in range(0, 40, 7):
+            cache.put_many({f"k{i}": [0.0] * 4 for i in range(start, start + 7)})
+            self.assertTotalsMatchTable(cache)
+        stats = cache.stats()
+        self.assertEqual(stats["entries"], 10)
+        self.assertEqual(stats["evictions"], 42 - 10)
+
+    def test_random_writes_keep_totals_exact(self):
+        rng = random.Random(0)
+        cache = EmbeddingCache(self.path, max_entries=50, max_bytes=2000)
+        for _ in range(200):
+            items = {
+                f"k{rng.randrange(80)}": [0.0] * rng.randint(1, 20)
+                for _ in range(rng.randint(1, 10))
+            }
+            cache.put_many(items)
+            self.assertTotalsMatchTable(cache)
+        self.assertGreater(cache.stats()["evictions"], 0)
+
+    def test_replacing_an_entry_updates_its_size(self):
+        cache = EmbeddingCache(self.path)
+        cache.put("a", [0.0] * 4)
+        cache.put("a", [0.0] * 2)
+        self.assertEqual((cache.stats()["entries"], cache.stats()["bytes"]), (1, 8))
+        self.assertTotalsMatchTable(cache)
+
+    def test_totals_are_read_back_on_open(self):
+        EmbeddingCache(self.path).put_many({"a": [0.0], "b": [0.0, 0.0]})
+        reopened = EmbeddingCache(self.path)
+        self.assertEqual(reopened.stats()["entries"], 2)
+        self.assertEqual(reopened.stats()["bytes"], 12)
+        reopened.clear()
+        self.assertTotalsMatchTable(reopened)
+        self.assertEqual(reopened.stats()["entries"], 0)
+
+    def test_expired_completions_count_as_evictions(self):
+        cache = CompletionCache(self.path, ttl=0.01)
+        cache.put("old", {"generated_text": "a"})
+        time.sleep(0.02)
+        self.assertIsNone(cache.get("old"))
+        cache.put("new", {"generated_text": "b"})
+        self.assertEqual(cache.get("new"), {"generated_text": "b"})
+        stats = cache.stats()
+        self.assertEqual((stats["entries"], stats["evictions"]), (1, 1))
+        self.assertEqual((stats["hits"], stats["misses"]), (1, 1))
+        self.assertTotalsMatchTable(cache)
+
+    def test_evicted_segments_leave_the_fuzzy_index(self):
+        memory = TranslationMemory(self.path, max_entries=2)
+        memory.prepare_fuzzy_index(*SCOPE)
+        deadline = time.monotonic() + 5
+        while memory.stats()["indexes_building"]:
+            self.assertLess(time.monotonic(), deadline)
+            time.sleep(0.01)
+        for source in ("first segment", "second segment", "third segment"):
+            memory.store({source: source.upper()}, *SCOPE)
+            time.sleep(0.002)
+        stats = memory.stats()
+        self.assertEqual((stats["entries"], stats["indexed"]), (2, 2))
+        self.assertEqual(memory.lookup(["first segment"], *SCOPE), [None])
+        self.assertTotalsMatchTable(memory)
+
+
+if __name__ == "__main__":
+    unittest.main()
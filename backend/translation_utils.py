@@ -1,21 +1,41 @@
-import traceback
+import asyncio
+import threading
 import unittest
-from pathlib import Path
+from collections import Counter
 
-import pdfplumber
 from config import Config
-from langchain.document_loaders import PyPDFLoader
-from langchain.schema import Document
-from langchain.text_splitter import CharacterTextSplitter
 
 # 這裡應該導入您的自定義模型和翻譯函數
-from mylibspublic.ffm_completion import get_ffm_completion
-
-
-def one_chunk_initial_translation(
-    source_text, model, source_lang, target_lang, country
+from mylibspublic.ffm_completion import aget_ffm_completion
+from mylibspublic.model_cascade import reflection_checks
+from mylibspublic.segmenter import (
+    Chunk,
+    ends_paragraph,
+    join_chunks,
+    split_paragraphs,
+    split_text,
+)
+from mylibspublic.structured_logging import get_logger
+from mylibspublic.token_budget import size_max_new_tokens
+from mylibspublic.token_estimator import estimate_tokens
+from mylibspublic.translation_memory import get_translation_memory
+
+logger = get_logger(__name__)
+
+# 反思建議的最少生成 token 數（原本固定的 max_tokens）
+REFLECTION_MIN_TOKENS = 350
+
+
+def _initial_translation_request(
+    source_text,
+    model,
+    source_lang,
+    target_lang,
+    country,
+    routing=None,
+    generation_info=None,
 ):
-    """執行初次翻譯。"""
+    """初次翻譯的模型呼叫參數。"""
     system_message = (
         f"你是一位專業語言學家，專門從事 {source_lang} 到 {target_lang} 的翻譯。"
     )
@@ -23,16 +43,46 @@ def one_chunk_initial_translation(
 翻譯應符合 {country} 的語言習慣。除了翻譯之外，不要提供任何解釋或其他文字。
 {source_lang}: {source_text}
 {target_lang}:"""
-    translation = get_ffm_completion(
-        translation_prompt, system_message=system_message, model=model
+    return dict(
+        user_prompt=translation_prompt,
+        system_message=system_message,
+        model=model,
+        max_tokens=size_max_new_tokens(source_text, source_lang, target_lang),
+        force_cache=Config.TRANSLATION_FORCE_CACHE,
+        source_text=source_text,
+        target_lang=target_lang,
+        routing=routing,
+        generation_info=generation_info,
+    )
+
+
+async def aone_chunk_initial_translation(
+    source_text,
+    model,
+    source_lang,
+    target_lang,
+    country,
+    routing=None,
+    generation_info=None,
+):
+    """非同步執行初次翻譯。"""
+    return await aget_ffm_completion(
+        **_initial_translation_request(
+            source_text,
+            model,
+            source_lang,
+            target_lang,
+            country,
+            routing,
+            generation_info,
+        )
     )
-    return translation
 
 
-def one_chunk_reflect_on_translation(
-    source_text, translation_1, model, source_lang, target_lang, country
+def _reflect_on_translation_request(
+    source_text, translation_1, model, source_lang, target_lang, country, routing=None
 ):
-    """反思並分析初次翻譯的結果。"""
+    """反思翻譯的模型呼叫參數。"""
     system_message = f"你是一位專業語言學家，專門從事 {source_lang} 到 {target_lang} 的翻譯。你將獲得一段源文本及其翻譯，你的目標是改進這個翻譯。"
     prompt = f"""你的任務是仔細閱讀一段從 {source_lang} 到 {target_lang} 的源文本和翻譯，然後給出建設性的批評和有用的建議來改進翻譯。
 最終翻譯的風格和語氣應該符合 {country} 口語化的 {target_lang} 風格。
@@ -54,14 +104,47 @@ def one_chunk_reflect_on_translation(
 (iv) 術語（通過確保術語使用一致且反映源文本領域；並確保只使用 {target_lang} 中等效的成語）。
 
 寫出一份具體、有幫助和建設性的建議清單，以改進翻譯。每個建議應針對翻譯的一個具體部分。只輸出建議，不要輸出其他內容。"""
-    reflection = get_ffm_completion(prompt, system_message=system_message, model=model)
-    return reflection
+    return dict(
+        user_prompt=prompt,
+        system_message=system_message,
+        model=model,
+        # 建議清單的長度大致與原文相當
+        max_tokens=size_max_new_tokens(
+            source_text, ratio=1.0, min_tokens=REFLECTION_MIN_TOKENS
+        ),
+        force_cache=Config.TRANSLATION_FORCE_CACHE,
+        routing=routing,
+    )
+
+
+async def aone_chunk_reflect_on_translation(
+    source_text, translation_1, model, source_lang, target_lang, country, routing=None
+):
+    """非同步反思並分析初次翻譯的結果。"""
+    return await aget_ffm_completion(
+        **_reflect_on_translation_request(
+            source_text,
+            translation_1,
+            model,
+            source_lang,
+            target_lang,
+            country,
+            routing,
+        )
+    )
 
 
-def one_chunk_improve_translation(
-    source_text, translation_1, reflection, model, source_lang, target_lang, country
+def _improve_translation_request(
+    source_text,
+    translation_1,
+    reflection,
+    model,
+    source_lang,
+    target_lang,
+    country,
+    routing=None,
 ):
-    """根據反思結果改進翻譯。"""
+    """改進翻譯的模型呼叫參數。"""
     system_message = (
         f"你是一位專業語言學家，專門從事 {source_lang} 到 {target_lang} 的翻譯編輯。"
     )
@@ -89,99 +172,418 @@ def one_chunk_improve_translation(
 (v) 其他錯誤。
 
 只輸出新的翻譯，不要輸出其他內容。"""
-    translation_2 = get_ffm_completion(prompt, system_message, model=model)
-    return translation_2
+    return dict(
+        user_prompt=prompt,
+        system_message=system_message,
+        model=model,
+        max_tokens=size_max_new_tokens(source_text, source_lang, target_lang),
+        force_cache=Config.TRANSLATION_FORCE_CACHE,
+        source_text=source_text,
+        target_lang=target_lang,
+        routing=routing,
+    )
 
 
-def one_chunk_translate_text(source_text, model, source_lang, target_lang, country):
-    """對單個文本塊執行完整的翻譯過程，包括初次翻譯、反思和改進。"""
-    translation_1 = one_chunk_initial_translation(
-        source_text, model, source_lang, target_lang, country
+async def aone_chunk_improve_translation(
+    source_text,
+    translation_1,
+    reflection,
+    model,
+    source_lang,
+    target_lang,
+    country,
+    routing=None,
+):
+    """非同步根據反思結果改進翻譯。"""
+    return await aget_ffm_completion(
+        **_improve_translation_request(
+            source_text,
+            translation_1,
+            reflection,
+            model,
+            source_lang,
+            target_lang,
+            country,
+            routing,
+        )
     )
-    reflection = one_chunk_reflect_on_translation(
-        source_text, translation_1, model, source_lang, target_lang, country
+
+
+def _patch_translation_prompt(source_text, match, source_lang, target_lang, country):
+    """建立修補相似譯文的系統訊息與提示。"""
+    system_message = (
+        f"你是一位專業語言學家，專門從事 {source_lang} 到 {target_lang} 的翻譯編輯。"
     )
-    translation_2 = one_chunk_improve_translation(
-        source_text, translation_1, reflection, model, source_lang, target_lang, country
+    prompt = f"""你的任務是根據一段相似源文本的既有翻譯，產生新源文本的 {target_lang} 翻譯。
+兩段源文本只有少數差異（例如日期、數字或名稱），請只修改譯文中與差異對應的部分，其餘措辭和術語保持不變。
+翻譯應符合 {country} 的語言習慣。
+
+相似源文本、其既有翻譯和新源文本用 XML 標籤 <SIMILAR_SOURCE></SIMILAR_SOURCE>、<SIMILAR_TRANSLATION></SIMILAR_TRANSLATION> 和 <SOURCE_TEXT></SOURCE_TEXT> 分隔如下：
+
+<SIMILAR_SOURCE>
+{match.source}
+</SIMILAR_SOURCE>
+
+<SIMILAR_TRANSLATION>
+{match.translation}
+</SIMILAR_TRANSLATION>
+
+<SOURCE_TEXT>
+{source_text}
+</SOURCE_TEXT>
+
+只輸出新源文本的翻譯，不要輸出其他內容。"""
+    return system_message, prompt
+
+
+async def aone_chunk_patch_translation(
+    source_text, match, model, source_lang, target_lang, country, routing=None
+):
+    """以單次呼叫修補翻譯記憶中相似段落的譯文，取代完整的三階段翻譯。"""
+    system_message, prompt = _patch_translation_prompt(
+        source_text, match, source_lang, target_lang, country
     )
-    return translation_2
+    return await aget_ffm_completion(
+        prompt,
+        system_message=system_message,
+        model=model,
+        max_tokens=size_max_new_tokens(source_text, source_lang, target_lang),
+        force_cache=Config.TRANSLATION_FORCE_CACHE,
+        source_text=source_text,
+        target_lang=target_lang,
+        routing=routing,
+    )
+
+
+def _stage_limits(stage_concurrency=None):
+    """初次翻譯、反思、改進三個階段各自的同時呼叫上限。"""
+    if stage_concurrency is None:
+        stage_concurrency = (
+            Config.TRANSLATION_INITIAL_CONCURRENCY,
+            Config.TRANSLATION_REFLECT_CONCURRENCY,
+            Config.TRANSLATION_IMPROVE_CONCURRENCY,
+        )
+    return tuple(max(1, limit) for limit in stage_concurrency)
+
+
+# 翻譯品質模式：fast 只做初次翻譯；balanced 僅在初次翻譯未通過檢查（長度比例
+# 異常、殘留原文、生成被截斷）時反思與改進；best 一律經過三個階段
+QUALITY_MODES = ("fast", "balanced", "best")
 
+_quality_counters = {}
+_quality_lock = threading.Lock()
 
-def load_pdf(file_path):
-    try:
-        # 首先嘗試使用 PyPDFLoader
-        loader = PyPDFLoader(file_path)
-        pages = loader.load()
-    except Exception as e:
-        print(f"PyPDFLoader failed: {str(e)}")
-        # 如果 PyPDFLoader 失敗，嘗試使用 pdfplumber
-        try:
-            pages = []
-            with pdfplumber.open(file_path) as pdf:
-                for page in pdf.pages:
-                    text = page.extract_text()
-                    if text:
-                        pages.append(
-                            Document(page_content=text, metadata={"source": file_path})
-                        )
-        except Exception as e:
-            print(f"pdfplumber failed: {str(e)}")
-            # 如果兩種方法都失敗，拋出異常
-            raise ValueError(f"無法讀取 PDF 文件: {file_path}")
 
-    return pages
+def _quality_mode(quality=None):
+    quality = (quality or Config.TRANSLATION_QUALITY).lower()
+    if quality not in QUALITY_MODES:
+        raise ValueError(f"未知的翻譯品質模式: {quality}")
+    return quality
 
 
-def split_documents(documents):
-    text_splitter = CharacterTextSplitter(chunk_size=1000, chunk_overlap=0)
-    return text_splitter.split_documents(documents)
+def _reflection_decision(
+    quality, source_text, translation_1, generation_info, source_lang, target_lang
+):
+    """依品質模式決定初次翻譯是否需要反思與改進，回傳 (是否反思, 觸發原因)。"""
+    if quality == "fast":
+        return False, []
+    if quality == "best":
+        return True, []
+    reasons = []
+    for check in reflection_checks(source_lang, target_lang):
+        reason = check(source_text, translation_1, generation_info)
+        if reason is not None:
+            reasons.append(reason)
+    return bool(reasons), reasons
+
+
+def _record_quality(quality, calls, reasons=(), patched=False):
+    with _quality_lock:
+        counter = _quality_counters.setdefault(quality, Counter())
+        counter["chunks"] += 1
+        counter["calls"] += calls
+        if patched:
+            counter["patched"] += 1
+        elif calls > 1:
+            counter["reflected"] += 1
+        counter.update(f"reason:{reason}" for reason in reasons)
+
+
+def translation_quality_stats():
+    """各品質模式翻譯的文本塊數、模型呼叫數、反思次數與觸發原因。"""
+    with _quality_lock:
+        return {
+            quality: {
+                **counter,
+                "calls_per_chunk": counter["calls"] / counter["chunks"],
+            }
+            for quality, counter in _quality_counters.items()
+        }
+
+
+def _translation_memory():
+    """翻譯記憶庫；未設定 TRANSLATION_MEMORY_PATH 時停用。"""
+    if not Config.TRANSLATION_MEMORY_PATH:
+        return None
+    return get_translation_memory(
+        Config.TRANSLATION_MEMORY_PATH,
+        max_bytes=Config.TRANSLATION_MEMORY_MAX_BYTES,
+        max_indexed=Config.TRANSLATION_FUZZY_MAX_INDEXED,
+    )
+
+
+def warm_translation_memory():
+    """在背景為預設語言設定建立模糊比對索引，第一個翻譯請求不必等待。"""
+    memory = _translation_memory()
+    if memory is not None and Config.TRANSLATION_FUZZY_THRESHOLD > 0:
+        memory.prepare_fuzzy_index(
+            Config.SOURCE_LANG, Config.TARGET_LANG, Config.COUNTRY, Config.MODEL_NAME
+        )
 
 
-def translate_and_store_to_knowledge_base(
-    file_path, model, source_lang, target_lang, country, progress_callback=None
+def _plan_translation(
+    source_text, model, source_lang, target_lang, country, max_chunk_tokens
 ):
-    print(f"Starting translation for file: {file_path}")
-    try:
-        # 加載 PDF
-        pages = load_pdf(file_path)
-        print(f"Loaded {len(pages)} pages from PDF")
-
-        # 獲取完整的原始文本
-        full_text = "\n\n".join(page.page_content for page in pages)
-        print(f"Combined text length: {len(full_text)}")
-
-        # 直接翻譯完整文本，不進行分割
-        translated_text = one_chunk_translate_text(
-            full_text, model, source_lang, target_lang, country
+    """依段落查詢翻譯記憶，將未命中的連續段落切成不超過 token 預算的文本塊。
+
+    記憶中只有相似段落（如日期、數字不同）者自成一塊，之後以單次修補呼叫
+    翻譯。回傳 (pieces, translations, matches, runs)：pieces 為依原順序排列
+    的段落或文本塊，translations 為對應的記憶譯文（待翻譯者為 None），
+    matches 為待修補文本塊的相似段落，runs 記錄每段待翻譯的連續段落在
+    pieces 中的範圍，翻譯完成後據此寫回記憶。
+    """
+    max_chunk_tokens = max_chunk_tokens or Config.TRANSLATION_CHUNK_TOKENS
+    paragraphs = split_paragraphs(source_text)
+    memory = _translation_memory()
+    recalled = [None] * len(paragraphs)
+    similar = [None] * len(paragraphs)
+    if memory is not None:
+        recalled = memory.lookup(
+            [paragraph.text for paragraph in paragraphs],
+            source_lang,
+            target_lang,
+            country,
+            model,
         )
-        print("Translation completed")
+        # 超過 token 預算的段落仍需切塊翻譯，不做模糊比對
+        candidates = [
+            index
+            for index, (paragraph, translation) in enumerate(zip(paragraphs, recalled))
+            if translation is None
+            and estimate_tokens(paragraph.text) <= max_chunk_tokens
+        ]
+        if candidates and Config.TRANSLATION_FUZZY_THRESHOLD > 0:
+            found = memory.fuzzy_lookup(
+                [paragraphs[index].text for index in candidates],
+                source_lang,
+                target_lang,
+                country,
+                model,
+                Config.TRANSLATION_FUZZY_THRESHOLD,
+            )
+            for index, match in zip(candidates, found):
+                similar[index] = match
+
+    pieces, translations, matches, runs = [], [], [], []
+    run = []
+
+    def flush():
+        if not run:
+            return
+        text = "".join(p.text + p.separator for p in run[:-1]) + run[-1].text
+        chunks = split_text(text, max_chunk_tokens)
+        last = chunks[-1]
+        chunks[-1] = Chunk(last.text, last.separator + run[-1].separator)
+        runs.append((len(pieces), len(pieces) + len(chunks)))
+        pieces.extend(chunks)
+        translations.extend([None] * len(chunks))
+        matches.extend([None] * len(chunks))
+        run.clear()
+
+    for paragraph, translation, match in zip(paragraphs, recalled, similar):
+        if translation is None and match is None:
+            run.append(paragraph)
+            continue
+        flush()
+        if match is not None:
+            runs.append((len(pieces), len(pieces) + 1))
+        pieces.append(paragraph)
+        translations.append(translation)
+        matches.append(match)
+    flush()
+
+    logger.debug(
+        "Planned translation",
+        paragraphs=len(paragraphs),
+        remembered=sum(1 for translation in recalled if translation is not None),
+        patched=sum(1 for match in similar if match is not None),
+        chunks=sum(1 for t, m in zip(translations, matches) if t is None and m is None),
+    )
+    return pieces, translations, matches, runs
 
-        # 保存翻譯結果
-        filename = Path(file_path).stem
-        save_path = Path("translations") / f"{filename}_translated.txt"
-        with open(save_path, "w", encoding="utf-8") as f:
-            f.write(translated_text)
 
-        print(f"Translation completed and saved to {save_path}")
-        return save_path
-    except Exception as e:
-        print(f"Error in translate_and_store_to_knowledge_base: {str(e)}")
-        print(traceback.format_exc())
-        raise
+def _remember_translation(
+    pieces, translations, runs, reviewed, model, source_lang, target_lang, country
+):
+    """將新翻譯的段落寫入翻譯記憶。
+
+    記憶譯文會直接回傳給任何品質模式的請求，因此只寫入經過反思與改進的
+    文本塊（reviewed）；fast、未觸發反思的 balanced 與修補的譯文都不寫入。
+    連續段落依段落邊界上的文本塊分組，組內文本塊都經過審閱才寫入；譯文
+    段落數與原文不符時無法逐段對應，該組也不寫入。
+    """
+    memory = _translation_memory()
+    if memory is None:
+        return
+    learned = {}
+    groups = []
+    for begin, end in runs:
+        start = begin
+        for index in range(begin, end):
+            if index == end - 1 or ends_paragraph(pieces[index]):
+                groups.append((start, index + 1))
+                start = index + 1
+    for begin, end in groups:
+        if not all(index in reviewed for index in range(begin, end)):
+            continue
+        chunks = pieces[begin:end]
+        paragraphs = split_paragraphs(join_chunks([c.text for c in chunks], chunks))
+        translated = split_paragraphs(join_chunks(translations[begin:end], chunks))
+        if len(translated) != len(paragraphs):
+            logger.debug(
+                "Paragraph count changed, not remembered",
+                source=len(paragraphs),
+                translated=len(translated),
+            )
+            continue
+        for paragraph, translation in zip(paragraphs, translated):
+            learned[paragraph.text] = translation.text
+    if learned:
+        memory.store(learned, source_lang, target_lang, country, model)
+
+
+async def atranslate_text(
+    source_text,
+    model,
+    source_lang,
+    target_lang,
+    country,
+    routing=None,
+    max_chunk_tokens=None,
+    stage_concurrency=None,
+    quality=None,
+):
+    """翻譯任意長度的文本：先依段落查詢翻譯記憶，其餘段落依段落與句子切成
+    不超過 token 預算的文本塊，翻譯後依原順序組回，段落分隔保持不變。
+
+    記憶中有相似段落者以單次呼叫修補其譯文。其餘文本塊獨立經過初次翻譯、
+    反思、改進三個階段，每個階段有各自的同時呼叫上限（stage_concurrency），
+    因此前一塊在反思時下一塊已開始初次翻譯。段落切分與翻譯記憶的 SQLite
+    查詢、寫入在執行緒中進行，不阻塞事件迴圈。
+
+    quality 選擇品質模式（見 QUALITY_MODES），決定文本塊是否需要反思與改進，
+    預設為 Config.TRANSLATION_QUALITY。路由決策依文本塊順序附加到 routing。
+    """
+    quality = _quality_mode(quality)
+    pieces, translations, matches, runs = await asyncio.to_thread(
+        _plan_translation,
+        source_text,
+        model,
+        source_lang,
+        target_lang,
+        country,
+        max_chunk_tokens,
+    )
+    if not pieces:
+        return source_text
+    pending = [index for index, text in enumerate(translations) if text is None]
+    limits = _stage_limits(stage_concurrency)
+    initial_gate, reflect_gate, improve_gate = (
+        asyncio.Semaphore(limit) for limit in limits
+    )
+    chunk_routing = {index: [] for index in pending}
+    reviewed = set()
+
+    async def translate(index):
+        text, decisions = pieces[index].text, chunk_routing[index]
+        if matches[index] is not None:
+            async with initial_gate:
+                translation = await aone_chunk_patch_translation(
+                    text,
+                    matches[index],
+                    model,
+                    source_lang,
+                    target_lang,
+                    country,
+                    decisions,
+                )
+            _record_quality(quality, 1, patched=True)
+            return translation
+        info = {}
+        async with initial_gate:
+            translation_1 = await aone_chunk_initial_translation(
+                text, model, source_lang, target_lang, country, decisions, info
+            )
+        reflect, reasons = _reflection_decision(
+            quality, text, translation_1, info, source_lang, target_lang
+        )
+        if not reflect:
+            _record_quality(quality, 1)
+            return translation_1
+        async with reflect_gate:
+            reflection = await aone_chunk_reflect_on_translation(
+                text, translation_1, model, source_lang, target_lang, country, decisions
+            )
+        async with improve_gate:
+            translation_2 = await aone_chunk_improve_translation(
+                text,
+                translation_1,
+                reflection,
+                model,
+                source_lang,
+                target_lang,
+                country,
+                decisions,
+            )
+        _record_quality(quality, 3, reasons)
+        reviewed.add(index)
+        return translation_2
+
+    results = await asyncio.gather(*(translate(index) for index in pending))
+    for index, translation in zip(pending, results):
+        translations[index] = translation
+
+    if routing is not None:
+        for index in pending:
+            routing.extend(chunk_routing[index])
+    await asyncio.to_thread(
+        _remember_translation,
+        pieces,
+        translations,
+        runs,
+        reviewed,
+        model,
+        source_lang,
+        target_lang,
+        country,
+    )
+    return join_chunks(translations, pieces)
 
 
 #####################################################################
 
 
 class TestTranslationUtils(unittest.TestCase):
-    def test_one_chunk_translate_text(self):
+    def test_translate_text(self):
         test_text = "Hello, world! This is a test sentence."
-        translated_text = one_chunk_translate_text(
-            test_text,
-            Config.MODEL_NAME,
-            Config.SOURCE_LANG,
-            Config.TARGET_LANG,
-            Config.COUNTRY,
+        translated_text = asyncio.run(
+            atranslate_text(
+                test_text,
+                Config.MODEL_NAME,
+                Config.SOURCE_LANG,
+                Config.TARGET_LANG,
+                Config.COUNTRY,
+            )
         )
         print(f"原文：{test_text}")
         print(f"翻譯：{translated_text}")
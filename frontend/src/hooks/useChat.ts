@@ -83,9 +83,12 @@ export function useChat(): ChatHook {
       ));
     }
 
+    // 串流開始後已放入的空白回覆，發生錯誤時以錯誤訊息取代
+    let placeholderAdded = false;
+
     try {
-      // 發送請求到後端
-      const response = await fetch(`${API_URL}/api/query`, {
+      // 發送請求到後端（串流版本）
+      const response = await fetch(`${API_URL}/api/query/stream`, {
         method: "POST",
         headers: { "Content-Type": "application/json" },
         body: JSON.stringify({
@@ -106,22 +109,44 @@ export function useChat(): ChatHook {
         }),
       });
 
-      if (response.ok) {
-        const data = await response.json();
-        const systemMessage: Message = {
-          sender: "system",
-          text: data.answer,
-          chunks: data.relevant_chunks,
-        };
-
-        // 更新訊息和會話
+      if (response.ok && response.body) {
+        let systemMessage: Message = { sender: "system", text: "", chunks: [] };
         setMessages(prev => [...prev, systemMessage]);
+        placeholderAdded = true;
+
+        // 逐行讀取 NDJSON 事件：先是 relevant_chunks，接著是回答片段
+        const reader = response.body.getReader();
+        const decoder = new TextDecoder();
+        let buffer = "";
+        while (true) {
+          const { done, value } = await reader.read();
+          if (done) break;
+          buffer += decoder.decode(value, { stream: true });
+          const lines = buffer.split("\n");
+          buffer = lines.pop() ?? "";
+          for (const line of lines) {
+            if (!line.trim()) continue;
+            const event = JSON.parse(line);
+            if (event.type === "chunks") {
+              systemMessage = { ...systemMessage, chunks: event.relevant_chunks };
+            } else if (event.type === "token") {
+              systemMessage = { ...systemMessage, text: systemMessage.text + event.text };
+            } else if (event.type === "error") {
+              throw new Error(event.detail);
+            }
+            const latest = systemMessage;
+            setMessages(prev => [...prev.slice(0, -1), latest]);
+          }
+        }
+
+        // 更新會話
+        const finalMessage = systemMessage;
         if (currentSession) {
           setChatSessions(prev => prev.map(session => 
             session.id === currentSession
               ? {
                   ...session,
-                  messages: [...session.messages, systemMessage],
+                  messages: [...session.messages, finalMessage],
                   updatedAt: new Date()
                 }
               : session
@@ -134,7 +159,11 @@ export function useChat(): ChatHook {
         sender: "system",
         text: "抱歉，發生錯誤。請稍後再試。",
       };
-      setMessages(prev => [...prev, errorMessage]);
+      setMessages(prev =>
+        placeholderAdded
+          ? [...prev.slice(0, -1), errorMessage]
+          : [...prev, errorMessage]
+      );
     }
   };
 